@@ -0,0 +1,16 @@
+"""
+批处理子系统
+包含任务存储、独立运行的 worker 和命令行工具
+"""
+
+from .jobs import BatchJob, BatchJobStore, parse_request_line
+from .worker import BatchWorker
+from .cli import main as cli_main
+
+__all__ = [
+    'BatchJob',
+    'BatchJobStore',
+    'parse_request_line',
+    'BatchWorker',
+    'cli_main'
+]
@@ -0,0 +1,90 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+from typing import List, Optional
+
+from .jobs import BatchJobStore
+from .worker import BatchWorker
+
+async def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog='manage.py batch', description='批处理任务工具')
+    subparsers = parser.add_subparsers(dest='command', help='可用命令')
+
+    # 提交任务
+    submit_parser = subparsers.add_parser('submit', help='提交 JSONL 请求文件')
+    submit_parser.add_argument('file', help='JSONL 文件，每行 {"custom_id", "url", "body"}')
+    submit_parser.add_argument('--concurrency', type=int, default=4, help='每个 provider 的最大并发数')
+    submit_parser.add_argument('--api-key', default=os.getenv("ROUTER_API_KEY"), help='访问路由使用的 API Key')
+
+    # 查看任务
+    status_parser = subparsers.add_parser('status', help='查看任务状态')
+    status_parser.add_argument('job_id', help='任务 ID')
+
+    subparsers.add_parser('list', help='列出所有任务')
+
+    # 导出结果
+    results_parser = subparsers.add_parser('results', help='导出任务结果')
+    results_parser.add_argument('job_id', help='任务 ID')
+    results_parser.add_argument('-o', '--output', help='输出文件，默认打印到标准输出')
+
+    # 运行 worker
+    worker_parser = subparsers.add_parser('worker', help='运行批处理 worker')
+    worker_parser.add_argument('--router-url', default=os.getenv("ROUTER_URL", "http://127.0.0.1:8000"), help='路由服务地址')
+    worker_parser.add_argument('--max-inflight', type=int, default=64, help='总并发数上限')
+    worker_parser.add_argument('--job', help='只执行指定任务，完成后退出')
+
+    parser.add_argument('--dir', default=os.getenv("BATCH_DIR", "batch_jobs"), help='任务目录')
+
+    args = parser.parse_args(argv)
+    store = BatchJobStore(args.dir)
+
+    try:
+        if args.command == 'submit':
+            with open(args.file, 'r', encoding='utf-8') as f:
+                job = store.create(f, concurrency=args.concurrency, api_key=args.api_key)
+            print(f"任务已提交: {job.id} (共 {job.total} 条请求)")
+
+        elif args.command == 'status':
+            job = store.get(args.job_id)
+            if job is None:
+                print(f"任务 '{args.job_id}' 不存在")
+            else:
+                print(json.dumps(job.public(), ensure_ascii=False, indent=2))
+
+        elif args.command == 'list':
+            jobs = store.list()
+            print(f"共有 {len(jobs)} 个任务:")
+            for job in jobs:
+                print(f"- {job.id}: {job.status}，成功 {job.completed}，失败 {job.failed}，共 {job.total}")
+
+        elif args.command == 'results':
+            if store.get(args.job_id) is None:
+                print(f"任务 '{args.job_id}' 不存在")
+            elif not os.path.exists(store.output_path(args.job_id)):
+                print(f"任务 '{args.job_id}' 还没有结果")
+            elif args.output:
+                shutil.copyfile(store.output_path(args.job_id), args.output)
+                print(f"结果已写入 {args.output}")
+            else:
+                with open(store.output_path(args.job_id), 'r', encoding='utf-8') as f:
+                    shutil.copyfileobj(f, sys.stdout)
+
+        elif args.command == 'worker':
+            worker = BatchWorker(store, router_url=args.router_url, max_inflight=args.max_inflight)
+            if args.job:
+                if not await worker.run(args.job):
+                    print(f"任务 '{args.job}' 不存在、已结束或正由其他 worker 执行")
+            else:
+                await worker.run_forever()
+
+        else:
+            parser.print_help()
+
+    except Exception as e:
+        print(f"错误: {str(e)}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,172 @@
+import fcntl
+import json
+import os
+import time
+import uuid
+from typing import IO, Any, Dict, Iterator, List, Literal, Optional, Set, Tuple
+
+from pydantic import BaseModel
+
+class BatchJob(BaseModel):
+    """批处理任务的元数据，保存在任务目录的 job.json 中"""
+    id: str
+    status: Literal["queued", "in_progress", "completed", "failed"] = "queued"
+    created_at: float
+    started_at: Optional[float] = None
+    completed_at: Optional[float] = None
+    total: int = 0
+    completed: int = 0          # 返回 2xx 的请求数
+    failed: int = 0             # 重试后仍失败的请求数
+    concurrency: int = 4        # 每个 provider 别名的最大并发数
+    owner: Optional[str] = None
+    api_key: Optional[str] = None  # 访问路由使用的密钥，不对外返回
+    error: Optional[str] = None
+
+    def public(self) -> Dict[str, Any]:
+        return self.model_dump(exclude={"api_key"})
+
+def parse_request_line(line: str, index: int) -> Dict[str, Any]:
+    """解析输入 JSONL 的一行（OpenAI Batch 格式），缺少 custom_id 时按行号生成"""
+    try:
+        request = json.loads(line)
+    except ValueError:
+        raise ValueError(f"第 {index + 1} 行不是有效的 JSON")
+    if not isinstance(request, dict) or not isinstance(request.get("body"), dict):
+        raise ValueError(f"第 {index + 1} 行缺少 body")
+    if not request["body"].get("model"):
+        raise ValueError(f"第 {index + 1} 行缺少 model")
+    url = request.get("url", "/v1/chat/completions")
+    if not url.startswith("/v1/"):
+        raise ValueError(f"第 {index + 1} 行的 url 必须以 /v1/ 开头")
+    return {
+        "custom_id": str(request.get("custom_id") or f"request-{index}"),
+        "url": url,
+        "body": request["body"],
+    }
+
+class BatchJobStore:
+    """批处理任务的磁盘存储，每个任务一个目录：
+
+    - job.json: 任务元数据，定期写入作为检查点；包含提交者的密钥，文件权限为 0600，任务目录为 0700
+    - input.jsonl: 提交的请求
+    - output.jsonl: 按完成顺序追加的结果，重启后据此跳过已完成的请求
+    - lock: 执行中的 worker 持有的文件锁，防止多个 worker 处理同一任务
+    """
+
+    def __init__(self, root: str = "batch_jobs"):
+        self.root = root
+
+    def _path(self, job_id: str, name: str) -> str:
+        if not job_id or "/" in job_id or job_id.startswith("."):
+            raise ValueError(f"无效的任务 ID: {job_id}")
+        return os.path.join(self.root, job_id, name)
+
+    def create(
+        self,
+        lines: Iterator[str],
+        concurrency: int = 4,
+        owner: Optional[str] = None,
+        api_key: Optional[str] = None
+    ) -> BatchJob:
+        """校验并保存输入，返回新任务；输入无效时抛出 ValueError 且不留下任务目录"""
+        job = BatchJob(
+            id=f"batch_{uuid.uuid4().hex[:24]}",
+            created_at=time.time(),
+            concurrency=max(concurrency, 1),
+            owner=owner,
+            api_key=api_key
+        )
+        # job.json 中保存了提交者的密钥，任务目录只允许运行服务的用户访问
+        os.makedirs(self.root, mode=0o700, exist_ok=True)
+        directory = os.path.join(self.root, job.id)
+        os.mkdir(directory, 0o700)
+        try:
+            seen: Set[str] = set()
+            with open(self._path(job.id, "input.jsonl"), "w", encoding="utf-8") as f:
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    request = parse_request_line(line, job.total)
+                    if request["custom_id"] in seen:
+                        raise ValueError(f"custom_id 重复: {request['custom_id']}")
+                    seen.add(request["custom_id"])
+                    f.write(json.dumps(request, ensure_ascii=False) + "\n")
+                    job.total += 1
+            if job.total == 0:
+                raise ValueError("输入文件中没有请求")
+            self.save(job)
+        except BaseException:
+            for name in ("input.jsonl", "job.json"):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+            os.rmdir(directory)
+            raise
+        return job
+
+    def save(self, job: BatchJob) -> None:
+        """原子写入任务元数据"""
+        path = self._path(job.id, "job.json")
+        tmp = path + ".tmp"
+        with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", encoding="utf-8") as f:
+            f.write(job.model_dump_json())
+        os.replace(tmp, path)
+
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        try:
+            with open(self._path(job_id, "job.json"), "r", encoding="utf-8") as f:
+                return BatchJob.model_validate_json(f.read())
+        except FileNotFoundError:
+            return None
+
+    def list(self) -> List[BatchJob]:
+        if not os.path.isdir(self.root):
+            return []
+        jobs = [self.get(name) for name in os.listdir(self.root)]
+        return sorted((job for job in jobs if job is not None), key=lambda job: job.created_at)
+
+    def claim(self, job_id: str) -> Optional[IO]:
+        """尝试获取任务锁，成功时返回需要保持打开的锁文件，已被其他 worker 持有时返回 None"""
+        lock = open(self._path(job_id, "lock"), "w")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return None
+        return lock
+
+    def iter_requests(self, job_id: str) -> Iterator[Dict[str, Any]]:
+        with open(self._path(job_id, "input.jsonl"), "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def recover_output(self, job_id: str) -> Tuple[Set[str], int, int]:
+        """读取已有结果，返回 (已完成的 custom_id, 成功数, 失败数)
+
+        进程崩溃时最后一行可能只写了一半，截断到最后一个完整行，之后继续追加。
+        """
+        path = self._path(job_id, "output.jsonl")
+        done: Set[str] = set()
+        succeeded = failed = 0
+        if not os.path.exists(path):
+            return done, 0, 0
+        with open(path, "rb+") as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end < len(data):
+                f.truncate(end)
+        for line in data[:end].splitlines():
+            result = json.loads(line)
+            done.add(result["custom_id"])
+            if result.get("error") is None and 200 <= result["response"]["status_code"] < 300:
+                succeeded += 1
+            else:
+                failed += 1
+        return done, succeeded, failed
+
+    def open_output(self, job_id: str) -> IO:
+        return open(self._path(job_id, "output.jsonl"), "a", encoding="utf-8")
+
+    def output_path(self, job_id: str) -> str:
+        return self._path(job_id, "output.jsonl")
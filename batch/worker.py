@@ -0,0 +1,175 @@
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from typing import Any, Dict, Optional
+
+import httpx
+from loguru import logger
+
+from proxy.catalog import split_model_id
+from .jobs import BatchJob, BatchJobStore
+
+# 可以稍后重试的状态码
+RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+class BatchWorker:
+    """执行批处理任务的 worker，作为独立进程运行（python manage.py batch worker）
+
+    请求经由路由服务转发，因此同样受到负载均衡、熔断、故障转移和限流的约束，
+    并与交互式请求共用路由服务的上游连接池和 provider 限流额度，并不相互隔离；
+    worker 自身再按 provider 别名限制并发，总并发不超过 max_inflight，以控制对交互式请求的影响。
+    """
+
+    def __init__(
+        self,
+        store: BatchJobStore,
+        router_url: str = "http://127.0.0.1:8000",
+        max_inflight: int = 64,
+        max_retries: int = 3,
+        poll_interval: float = 2.0,
+        checkpoint_interval: float = 5.0
+    ):
+        self.store = store
+        self.router_url = router_url.rstrip("/")
+        self.max_inflight = max_inflight
+        self.max_retries = max_retries
+        self.poll_interval = poll_interval
+        self.checkpoint_interval = checkpoint_interval
+
+    async def run_forever(self) -> None:
+        """轮询任务目录，依次执行排队中和中断的任务"""
+        logger.info(f"批处理 worker 已启动，任务目录: {self.store.root}，路由地址: {self.router_url}")
+        while True:
+            ran = False
+            for job in self.store.list():
+                if job.status in ("queued", "in_progress"):
+                    ran = await self.run(job.id) or ran
+            if not ran:
+                await asyncio.sleep(self.poll_interval)
+
+    async def run(self, job_id: str) -> bool:
+        """执行一个任务，已被其他 worker 持有时返回 False"""
+        lock = self.store.claim(job_id)
+        if lock is None:
+            return False
+        try:
+            job = self.store.get(job_id)
+            if job is None or job.status not in ("queued", "in_progress"):
+                return False
+            await self._run(job)
+            return True
+        finally:
+            lock.close()
+
+    async def _run(self, job: BatchJob) -> None:
+        done, job.completed, job.failed = self.store.recover_output(job.id)
+        if done:
+            logger.info(f"批处理任务 {job.id} 从检查点恢复，已完成 {len(done)}/{job.total}")
+        job.status = "in_progress"
+        job.started_at = job.started_at or time.time()
+        self.store.save(job)
+
+        headers = {"Authorization": f"Bearer {job.api_key}"} if job.api_key else {}
+        limits = httpx.Limits(max_connections=self.max_inflight, max_keepalive_connections=self.max_inflight)
+        inflight = asyncio.Semaphore(self.max_inflight)
+        # 已读入、等待执行的请求数上限，避免把整个输入文件一次读入内存
+        pending = asyncio.Semaphore(self.max_inflight * 4)
+        per_alias: Dict[str, asyncio.Semaphore] = defaultdict(lambda: asyncio.Semaphore(job.concurrency))
+        last_checkpoint = time.monotonic()
+        tasks = set()
+
+        def write(result: Dict[str, Any]) -> None:
+            nonlocal last_checkpoint
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            if result["error"] is None and 200 <= result["response"]["status_code"] < 300:
+                job.completed += 1
+            else:
+                job.failed += 1
+            if time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                last_checkpoint = time.monotonic()
+                self.store.save(job)
+
+        async def execute(request: Dict[str, Any]) -> None:
+            try:
+                alias = split_model_id(request["body"]["model"])[0] or request["body"]["model"]
+                # 先取得别名的名额再占用全局名额，排队等待某个别名的请求不会占满全局并发
+                async with per_alias[alias]:
+                    async with inflight:
+                        write(await self._send(client, request, headers, job.id))
+            finally:
+                pending.release()
+
+        try:
+            with self.store.open_output(job.id) as output:
+                async with httpx.AsyncClient(
+                    base_url=self.router_url,
+                    timeout=httpx.Timeout(600.0, connect=10.0),
+                    limits=limits
+                ) as client:
+                    for request in self.store.iter_requests(job.id):
+                        if request["custom_id"] in done:
+                            continue
+                        await pending.acquire()
+                        task = asyncio.ensure_future(execute(request))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                    if tasks:
+                        await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            self.store.save(job)
+            raise
+        except Exception as e:
+            logger.error(f"批处理任务 {job.id} 执行失败: {str(e)}")
+            job.status = "failed"
+            job.error = str(e)
+            job.completed_at = time.time()
+            self.store.save(job)
+            return
+        job.status = "completed"
+        job.completed_at = time.time()
+        self.store.save(job)
+        logger.info(f"批处理任务 {job.id} 已完成: 成功 {job.completed}，失败 {job.failed}")
+
+    async def _send(
+        self,
+        client: httpx.AsyncClient,
+        request: Dict[str, Any],
+        headers: Dict[str, str],
+        job_id: str
+    ) -> Dict[str, Any]:
+        """发送一条请求，429/5xx 和网络错误按 Retry-After 或指数退避重试"""
+        result: Dict[str, Any] = {
+            "id": f"{job_id}-{request['custom_id']}",
+            "custom_id": request["custom_id"],
+            "response": None,
+            "error": None,
+        }
+        body = {**request["body"], "stream": False}
+        for attempt in range(self.max_retries + 1):
+            retry_after: Optional[float] = None
+            try:
+                response = await client.post(request["url"], json=body, headers=headers)
+            except httpx.TransportError as e:
+                result["response"] = None
+                result["error"] = {"message": f"{type(e).__name__}: {str(e)}"}
+            else:
+                try:
+                    content = response.json()
+                except ValueError:
+                    content = response.text
+                result["response"] = {"status_code": response.status_code, "body": content}
+                result["error"] = None
+                if response.status_code not in RETRYABLE_STATUS:
+                    return result
+                try:
+                    retry_after = float(response.headers.get("retry-after", ""))
+                except ValueError:
+                    pass
+            if attempt < self.max_retries:
+                await asyncio.sleep(retry_after if retry_after is not None else random.uniform(0, min(30, 2 ** attempt)))
+        return result
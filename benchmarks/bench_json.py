@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+JSON 编码基准测试：对比非流式响应每个请求在代理上消耗的 CPU 时间
+
+before: SDK 解析为 pydantic 对象 -> model_dump() 复制为字典 -> json.dumps 编码
+after:  原样转发上游响应体，只用 json_loads 解码一次取出 usage（安装 orjson 时使用 orjson）
+
+embeddings 的 before 为 SDK 默认的 base64 请求 + 解码为浮点列表；错误响应对比每次编码与预编码常量。
+
+用法: python benchmarks/bench_json.py [--content-kb 64] [--logprobs 500] [--dimensions 1536] [--rounds 200]
+"""
+import argparse
+import array
+import base64
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import Response
+from openai._models import construct_type  # SDK 内部解析响应的方式
+from openai.types import CreateEmbeddingResponse
+from openai.types.chat import ChatCompletion
+
+from proxy.jsonfast import ERROR_UNAUTHORIZED, ORJSON_AVAILABLE, json_loads, json_response
+
+def make_completion(content_kb: int, logprobs: int) -> bytes:
+    """构造一个大的 chat completion 响应体：长文本（中英混合）加可选的 logprobs"""
+    rng = random.Random(0)
+    words = ["the", "model", "router", "请求", "响应", "latency", "token", "上游", "cache", "stream"]
+    text = " ".join(rng.choice(words) for _ in range(content_kb * 160))[:content_kb * 1024]
+    tokens = [
+        {
+            "token": rng.choice(words),
+            "logprob": -rng.random(),
+            "bytes": None,
+            "top_logprobs": [{"token": rng.choice(words), "logprob": -rng.random(), "bytes": None} for _ in range(5)],
+        }
+        for _ in range(logprobs)
+    ]
+    completion = {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "created": 1700000000,
+        "model": "deepseek-chat",
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": text},
+            "logprobs": {"content": tokens} if logprobs else None,
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 100, "completion_tokens": content_kb * 256, "total_tokens": content_kb * 256 + 100},
+    }
+    return json.dumps(completion, ensure_ascii=False).encode("utf-8")
+
+def make_embeddings(dimensions: int, count: int, encoding: str) -> bytes:
+    rng = random.Random(0)
+    data = []
+    for i in range(count):
+        vector = [rng.uniform(-1, 1) for _ in range(dimensions)]
+        if encoding == "base64":
+            vector = base64.b64encode(array.array("f", vector).tobytes()).decode("ascii")
+        data.append({"object": "embedding", "index": i, "embedding": vector})
+    usage = {"prompt_tokens": count * 8, "total_tokens": count * 8}
+    return json.dumps({"object": "list", "model": "text-embedding-3-small", "data": data, "usage": usage}).encode("utf-8")
+
+def completion_before(raw: bytes) -> Response:
+    response = construct_type(type_=ChatCompletion, value=json.loads(raw))
+    response_data = response.model_dump()
+    response_data.get("usage")
+    return Response(content=json.dumps(response_data), media_type="application/json")
+
+def embeddings_before(raw: bytes) -> Response:
+    response = construct_type(type_=CreateEmbeddingResponse, value=json.loads(raw))
+    # SDK 未指定 encoding_format 时请求 base64，再解码为浮点列表
+    for embedding in response.data:
+        embedding.embedding = array.array("f", base64.b64decode(embedding.embedding)).tolist()
+    response_data = response.model_dump()
+    response_data.get("usage")
+    return Response(content=json.dumps(response_data), media_type="application/json")
+
+def raw_after(raw: bytes) -> Response:
+    data = json_loads(raw)
+    data.get("usage")
+    return json_response(raw)
+
+def error_before() -> Response:
+    return Response(content=json.dumps({"error": "Unauthorized"}), media_type="application/json", status_code=401)
+
+def error_after() -> Response:
+    return json_response(ERROR_UNAUTHORIZED, 401)
+
+def measure(fn, rounds: int) -> float:
+    """每次调用的 CPU 时间（微秒）"""
+    fn()
+    start = time.process_time()
+    for _ in range(rounds):
+        fn()
+    return (time.process_time() - start) / rounds * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON 编码基准测试')
+    parser.add_argument('--content-kb', type=int, default=64, help='completion 文本大小（KB）')
+    parser.add_argument('--logprobs', type=int, default=500, help='completion 的 logprobs token 数，0 为不返回')
+    parser.add_argument('--dimensions', type=int, default=1536, help='embedding 维度')
+    parser.add_argument('--inputs', type=int, default=16, help='每个 embeddings 请求的输入条数')
+    parser.add_argument('--rounds', type=int, default=200, help='重复次数')
+    args = parser.parse_args()
+
+    completion = make_completion(args.content_kb, args.logprobs)
+    embeddings_base64 = make_embeddings(args.dimensions, args.inputs, "base64")
+    embeddings_float = make_embeddings(args.dimensions, args.inputs, "float")
+    error_rounds = args.rounds * 100
+    cases = [
+        (f"completion ({len(completion) // 1024} KB)",
+         lambda: completion_before(completion), lambda: raw_after(completion), args.rounds),
+        (f"embeddings ({args.inputs}x{args.dimensions})",
+         lambda: embeddings_before(embeddings_base64), lambda: raw_after(embeddings_float), args.rounds),
+        ("error 401", error_before, error_after, error_rounds),
+    ]
+
+    print(f"orjson: {'yes' if ORJSON_AVAILABLE else 'no (stdlib json)'}")
+    print(f"{'case':<28} {'before us':>12} {'after us':>12} {'saved us':>12} {'speedup':>8}")
+    for name, before, after, rounds in cases:
+        before_us = measure(before, rounds)
+        after_us = measure(after, rounds)
+        print(f"{name:<28} {before_us:>12.1f} {after_us:>12.1f} {before_us - after_us:>12.1f} {before_us / after_us:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
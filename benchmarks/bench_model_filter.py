@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+模型过滤基准测试：对比逐条件重新编译正则、每个条件重建一次列表的旧实现与预编译的 ModelFilter
+
+before: 每次获取模型列表时按空格拆分 filter，每个条件编译一次正则并遍历一遍列表
+after:  加载配置时编译一次，过滤时只做收窄列表的 search 调用
+
+re 模块本身会缓存编译结果，旧实现的主要开销同样是逐个模型的 search，因此提升有限（约 1.1-1.4x）；
+预编译的主要收益是写法错误在加载配置时就能发现，以及支持排除、OR 和字段条件。
+
+用法: python benchmarks/bench_model_filter.py [--models 5000] [--rounds 200] [--filter "gpt free"]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from proxy.filters import ModelFilter
+
+VENDORS = ["openai", "anthropic", "google", "meta-llama", "mistralai", "deepseek", "qwen", "x-ai"]
+NAMES = ["gpt-4o", "gpt-4o-mini", "claude-3.5-sonnet", "gemini-2.0-flash", "llama-3.1-70b", "r1", "qwen-2.5-72b"]
+
+def make_models(count: int) -> list:
+    rng = random.Random(0)
+    models = []
+    for i in range(count):
+        name = f"{rng.choice(VENDORS)}/{rng.choice(NAMES)}-{i}"
+        if rng.random() < 0.2:
+            name += "-preview"
+        if rng.random() < 0.3:
+            name += ":free"
+        models.append({
+            "id": name,
+            "context_length": rng.choice([8192, 32768, 128000, 200000]),
+            "pricing": {"prompt": rng.choice(["0", "0.0000005", "0.000003"])},
+        })
+    return models
+
+def filter_before(models: list, expression: str) -> list:
+    import re
+    for condition in expression.split():
+        pattern = condition.replace("*", ".*")
+        regex = re.compile(pattern, re.IGNORECASE)
+        models = [m for m in models if (
+            isinstance(m, dict) and regex.search(m["id"]) or
+            isinstance(m, str) and regex.search(m)
+        )]
+    return models
+
+def run(name: str, fn, rounds: int, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        kept = fn()
+    elapsed = time.perf_counter() - start
+    rate = rounds * count / elapsed
+    print(f"{name:<8} {len(kept):>7} kept  {elapsed * 1000:>9.1f} ms  {rate:>12,.0f} models/s")
+    return rate
+
+def main():
+    parser = argparse.ArgumentParser(description='模型过滤基准测试')
+    parser.add_argument('--models', type=int, default=5000, help='模型数量')
+    parser.add_argument('--rounds', type=int, default=200, help='重复次数')
+    parser.add_argument('--filter', default='gpt* free r1|4o', help='只含模型 ID 条件的过滤表达式（旧实现不支持 ! 排除和字段条件）')
+    args = parser.parse_args()
+
+    models = make_models(args.models)
+    model_filter = ModelFilter(args.filter)
+    before = run("before", lambda: filter_before(models, args.filter), args.rounds, args.models)
+    after = run("after", lambda: model_filter.apply(models), args.rounds, args.models)
+    print(f"after / before: {after / before:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+用户查询基准测试：对比每次新建连接与连接池两种方式的 get_user_by_api_key 吞吐
+
+before: 每次查询 aiosqlite.connect 一次（旧实现）
+after:  SQLiteProvider 长连接池（WAL + 预编译语句缓存）
+
+用法: python benchmarks/bench_sqlite_lookup.py [--users 1000] [--lookups 5000] [--concurrency 32]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiosqlite
+
+from user_management.auth import generate_api_key
+from user_management.database import SQLiteProvider, SELECT_USER_BY_API_KEY
+from user_management.models import User
+
+async def lookup_per_connection(db_path: str, api_key: str):
+    async with aiosqlite.connect(db_path) as db:
+        async with db.execute(SELECT_USER_BY_API_KEY, (api_key,)) as cursor:
+            return await cursor.fetchone()
+
+async def run(name: str, lookup, keys: list, concurrency: int) -> float:
+    queue = list(keys)
+
+    async def worker():
+        while queue:
+            await lookup(queue.pop())
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    rate = len(keys) / elapsed
+    print(f"{name:<8} {len(keys):>7} lookups  {elapsed * 1000:>9.1f} ms  {rate:>10,.0f} lookups/s")
+    return rate
+
+async def main():
+    parser = argparse.ArgumentParser(description='SQLite 用户查询基准测试')
+    parser.add_argument('--users', type=int, default=1000, help='用户数量')
+    parser.add_argument('--lookups', type=int, default=5000, help='查询次数')
+    parser.add_argument('--concurrency', type=int, default=32, help='并发数')
+    parser.add_argument('--pool-size', type=int, default=4, help='连接池大小')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench_users.db")
+        provider = SQLiteProvider(db_path, pool_size=args.pool_size)
+        await provider.initialize()
+        api_keys = []
+        for i in range(args.users):
+            user = User(username=f"user{i}", api_key=generate_api_key(), permissions={'*': True})
+            await provider.create_user(user)
+            api_keys.append(user.api_key)
+        keys = [random.choice(api_keys) for _ in range(args.lookups)]
+
+        before = await run("before", lambda key: lookup_per_connection(db_path, key), keys, args.concurrency)
+        after = await run("after", provider.get_user_by_api_key, keys, args.concurrency)
+        print(f"after / before: {after / before:.1f}x")
+        await provider.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
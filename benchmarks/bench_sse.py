@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+流式转发基准测试：对比 sdk 模式与 raw 模式每秒可处理的 chunk 数
+
+sdk 模式：json 解码 -> 构造 ChatCompletionChunk -> model_dump_json -> 拼接 SSE 帧
+raw 模式：SSEFrameSplitter 切帧（可选改写 model 字段）
+
+用法: python benchmarks/bench_sse.py [--chunks 20000] [--rewrite]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openai._models import construct_type  # SDK 内部解析流式 chunk 的方式
+from openai.types.chat import ChatCompletionChunk
+
+from proxy.sse import SSEFrameSplitter, extract_usage, rewrite_model
+
+def make_stream(chunks: int, read_size: int) -> list:
+    """构造上游 SSE 字节流，并按 read_size 切成网络读取块"""
+    frames = []
+    for i in range(chunks):
+        chunk = {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": 1700000000,
+            "model": "deepseek-chat",
+            "choices": [{"index": 0, "delta": {"content": f"token{i} "}, "finish_reason": None}],
+        }
+        frames.append(f"data: {json.dumps(chunk)}\n\n")
+    usage = {"prompt_tokens": 10, "completion_tokens": chunks, "total_tokens": chunks + 10}
+    frames.append(f"data: {json.dumps({'id': 'chatcmpl-bench', 'object': 'chat.completion.chunk', 'created': 1700000000, 'model': 'deepseek-chat', 'choices': [], 'usage': usage})}\n\n")
+    frames.append("data: [DONE]\n\n")
+    data = "".join(frames).encode("utf-8")
+    return [data[i:i + read_size] for i in range(0, len(data), read_size)]
+
+def bench_sdk(reads: list) -> int:
+    count = 0
+    buffer = b""
+    for data in reads:
+        buffer += data
+        *events, buffer = buffer.split(b"\n\n")
+        for event in events:
+            payload = event[5:].strip()
+            if payload == b"[DONE]":
+                continue
+            chunk = construct_type(type_=ChatCompletionChunk, value=json.loads(payload))
+            if chunk.choices:
+                _ = f"data: {chunk.model_dump_json()}\n\n"
+            count += 1
+    return count
+
+def bench_raw(reads: list, rewrite: bool) -> int:
+    count = 0
+    splitter = SSEFrameSplitter()
+    for data in reads:
+        for frame in splitter.feed(data):
+            if frame == b"data: [DONE]\n\n":
+                continue
+            extract_usage(frame)
+            if rewrite:
+                frame = rewrite_model(frame, "[deepseek]deepseek-chat")
+            count += 1
+    return count
+
+def run(name: str, fn, *args) -> float:
+    start = time.perf_counter()
+    count = fn(*args)
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed
+    print(f"{name:<12} {count:>8} chunks  {elapsed * 1000:>9.1f} ms  {rate:>12,.0f} chunks/s")
+    return rate
+
+def main():
+    parser = argparse.ArgumentParser(description='SSE 流式转发基准测试')
+    parser.add_argument('--chunks', type=int, default=20000, help='chunk 数量')
+    parser.add_argument('--read-size', type=int, default=4096, help='每次网络读取的字节数')
+    parser.add_argument('--rewrite', action='store_true', help='raw 模式下改写 model 字段')
+    args = parser.parse_args()
+
+    reads = make_stream(args.chunks, args.read_size)
+    sdk_rate = run("sdk", bench_sdk, reads)
+    raw_rate = run("raw", bench_raw, reads, args.rewrite)
+    print(f"raw / sdk: {raw_rate / sdk_rate:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+"""
+端到端压测：在本地启动模拟上游（mock_upstream.py）和路由（uvicorn main:app），
+以固定并发或固定 RPS 发送请求，报告吞吐、代理额外开销、首字节耗时和路由进程内存。
+全程只访问本机端口，可离线运行。
+
+场景矩阵：流式 / 非流式 × 是否开启 ENABLE_ACCOUNT_MANAGEMENT，另有一组直连上游的基线。
+代理额外开销 = 经路由的首字节耗时 - 上游配置的首字节延迟（非流式为完整响应延迟）。
+
+用法: python benchmarks/load_test.py [--duration 10] [--concurrency 32] [--rps 0] [--latency 0.05] [--json out.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import httpx
+
+from user_management.auth import generate_api_key
+from user_management.database import SQLiteProvider
+from user_management.models import User
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+def read_rss_mb(pid: int) -> float:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+async def wait_ready(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url, timeout=1.0)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"服务未在 {timeout} 秒内就绪: {url}")
+
+def child_env(**extra: str) -> Dict[str, str]:
+    """子进程环境：去掉可能触发外部访问的 Langfuse 配置"""
+    env = {k: v for k, v in os.environ.items() if not k.startswith("LANGFUSE_")}
+    env["PYTHONPATH"] = REPO_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env.update(extra)
+    return env
+
+class Upstream:
+    """以子进程运行的模拟上游"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.port = free_port()
+        self.proc: Optional[subprocess.Popen] = None
+
+    async def __aenter__(self) -> "Upstream":
+        env = child_env(
+            MOCK_LATENCY=str(self.args.latency),
+            MOCK_TOKENS=str(self.args.tokens),
+            MOCK_TOKENS_PER_SEC=str(self.args.tokens_per_sec),
+            MOCK_ERROR_RATE=str(self.args.error_rate)
+        )
+        env["PYTHONPATH"] = os.path.join(REPO_ROOT, "benchmarks") + os.pathsep + env["PYTHONPATH"]
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "mock_upstream:app_from_env", "--factory",
+             "--port", str(self.port), "--log-level", "warning"],
+            env=env
+        )
+        await wait_ready(f"http://127.0.0.1:{self.port}/v1/models")
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.proc.terminate()
+        self.proc.wait()
+
+class Router:
+    """在临时目录中以子进程运行路由，配置只指向模拟上游"""
+
+    def __init__(self, upstream_port: int, account_management: bool):
+        self.port = free_port()
+        self.account_management = account_management
+        self.workdir = tempfile.mkdtemp(prefix="llmrouter-load-")
+        self.api_key = "sk-load-test"
+        self.proc: Optional[subprocess.Popen] = None
+        with open(os.path.join(self.workdir, "config.yaml"), "w") as f:
+            f.write(
+                "servers:\n"
+                "  mock:\n"
+                f"    url: \"http://127.0.0.1:{upstream_port}/v1\"\n"
+                "    api_key: \"mock\"\n"
+                "tracing:\n"
+                "  enabled: false\n"
+                "coalesce:\n"
+                "  enabled: false\n"
+            )
+
+    async def _create_user(self) -> None:
+        db = SQLiteProvider(db_path=os.path.join(self.workdir, "users.db"))
+        await db.initialize()
+        try:
+            user = await db.create_user(User(
+                username="load-test",
+                api_key=generate_api_key(),
+                permissions={"*": True}
+            ))
+            self.api_key = user.api_key
+        finally:
+            await db.close()
+
+    async def __aenter__(self) -> "Router":
+        if self.account_management:
+            await self._create_user()
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(self.port), "--log-level", "warning"],
+            cwd=self.workdir,
+            env=child_env(ENABLE_ACCOUNT_MANAGEMENT="true" if self.account_management else "false")
+        )
+        await wait_ready(f"http://127.0.0.1:{self.port}/docs")
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.proc.terminate()
+        self.proc.wait()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+async def one_request(client: httpx.AsyncClient, url: str, body: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    start = time.perf_counter()
+    ttfb = None
+    async with client.stream("POST", url, json=body, headers=headers) as response:
+        async for _ in response.aiter_raw():
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+        total = time.perf_counter() - start
+    return {"status": response.status_code, "ttfb": ttfb if ttfb is not None else total, "total": total}
+
+async def drive(
+    url: str,
+    body: Dict[str, Any],
+    headers: Dict[str, str],
+    duration: float,
+    concurrency: int,
+    rps: float,
+    pid: Optional[int]
+) -> Dict[str, Any]:
+    """固定并发（rps=0）或固定 RPS（并发数作为上限）发送请求，返回原始样本"""
+    results: List[Dict[str, Any]] = []
+    errors = 0
+    rss: List[float] = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60.0) as client:
+
+        async def send():
+            nonlocal errors
+            try:
+                results.append(await one_request(client, url, body, headers))
+            except httpx.HTTPError:
+                errors += 1
+
+        async def sample_memory():
+            while True:
+                rss.append(read_rss_mb(pid))
+                await asyncio.sleep(0.5)
+
+        sampler = asyncio.create_task(sample_memory()) if pid else None
+        start = time.perf_counter()
+        deadline = start + duration
+        if rps > 0:
+            slots = asyncio.Semaphore(concurrency)
+            tasks = set()
+
+            async def paced():
+                try:
+                    await send()
+                finally:
+                    slots.release()
+
+            sent = 0
+            while time.perf_counter() < deadline:
+                await asyncio.sleep(max(start + sent / rps - time.perf_counter(), 0))
+                await slots.acquire()
+                task = asyncio.create_task(paced())
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                sent += 1
+            if tasks:
+                await asyncio.gather(*tasks)
+        else:
+            async def worker():
+                while time.perf_counter() < deadline:
+                    await send()
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        if sampler:
+            sampler.cancel()
+            rss.append(read_rss_mb(pid))
+    return {"results": results, "errors": errors, "elapsed": elapsed, "rss": rss}
+
+def summarize(name: str, raw: Dict[str, Any], expected_ttfb: float) -> Dict[str, Any]:
+    ok = [r for r in raw["results"] if 200 <= r["status"] < 300]
+    ttfb = [r["ttfb"] for r in ok]
+    overhead = [(t - expected_ttfb) * 1000 for t in ttfb]
+    return {
+        "scenario": name,
+        "requests": len(raw["results"]) + raw["errors"],
+        "failed": len(raw["results"]) - len(ok) + raw["errors"],
+        "throughput": len(ok) / raw["elapsed"] if raw["elapsed"] else 0.0,
+        "overhead_ms": {p: percentile(overhead, p) for p in (50, 95, 99)},
+        "ttfb_ms": {p: percentile(ttfb, p) * 1000 for p in (50, 95, 99)},
+        "total_ms_p50": percentile([r["total"] for r in ok], 50) * 1000,
+        "rss_mb_peak": max(raw["rss"]) if raw["rss"] else None,
+        "rss_mb_end": raw["rss"][-1] if raw["rss"] else None,
+    }
+
+def print_table(rows: List[Dict[str, Any]]) -> None:
+    header = (f"{'scenario':<22}{'requests':>9}{'failed':>7}{'req/s':>9}"
+              f"{'ovh p50':>9}{'p95':>8}{'p99':>8}{'ttfb p50':>10}{'p99':>8}{'rss MB':>9}")
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        rss = f"{row['rss_mb_peak']:.1f}" if row["rss_mb_peak"] is not None else "-"
+        print(f"{row['scenario']:<22}{row['requests']:>9}{row['failed']:>7}{row['throughput']:>9.1f}"
+              f"{row['overhead_ms'][50]:>9.2f}{row['overhead_ms'][95]:>8.2f}{row['overhead_ms'][99]:>8.2f}"
+              f"{row['ttfb_ms'][50]:>10.2f}{row['ttfb_ms'][99]:>8.2f}{rss:>9}")
+    print("ovh = proxy overhead; latencies in ms, rss = router peak RSS")
+
+async def main():
+    parser = argparse.ArgumentParser(description='路由端到端压测（本地模拟上游，可离线运行）')
+    parser.add_argument('--duration', type=float, default=10, help='每个场景的持续时间（秒）')
+    parser.add_argument('--concurrency', type=int, default=32, help='并发数；指定 --rps 时为最大并发')
+    parser.add_argument('--rps', type=float, default=0, help='固定请求速率，0 表示按固定并发尽快发送')
+    parser.add_argument('--latency', type=float, default=0.05, help='上游首字节延迟（秒）')
+    parser.add_argument('--tokens', type=int, default=64, help='每个响应的 token 数')
+    parser.add_argument('--tokens-per-sec', type=float, default=2000, help='上游输出速率，0 表示不限速')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='上游注入错误的比例')
+    parser.add_argument('--mode', choices=['all', 'stream', 'non-stream'], default='all', help='只跑流式或非流式')
+    parser.add_argument('--account', choices=['all', 'off', 'on'], default='all', help='ENABLE_ACCOUNT_MANAGEMENT 取值')
+    parser.add_argument('--skip-baseline', action='store_true', help='不跑直连上游的基线')
+    parser.add_argument('--json', help='将结果写入 JSON 文件')
+    args = parser.parse_args()
+
+    modes = [m for m in (True, False) if args.mode == "all" or (args.mode == "stream") == m]
+    accounts = [a for a in (False, True) if args.account == "all" or (args.account == "on") == a]
+    generation = args.tokens / args.tokens_per_sec if args.tokens_per_sec > 0 else 0.0
+    rows = []
+
+    async with Upstream(args) as upstream:
+        for stream in modes:
+            body = {
+                "model": "[mock]mock-0",
+                "messages": [{"role": "user", "content": "hello"}],
+                "stream": stream,
+            }
+            expected = args.latency if stream else args.latency + generation
+            label = "stream" if stream else "non-stream"
+            if not args.skip_baseline:
+                raw = await drive(
+                    f"http://127.0.0.1:{upstream.port}/v1/chat/completions",
+                    dict(body, model="mock-0"), {}, args.duration, args.concurrency, args.rps, None
+                )
+                rows.append(summarize(f"{label}/direct", raw, expected))
+            for account in accounts:
+                async with Router(upstream.port, account) as router:
+                    headers = {"Authorization": f"Bearer {router.api_key}"}
+                    url = f"http://127.0.0.1:{router.port}/v1/chat/completions"
+                    # 预热：建立上游连接池并加载模型列表
+                    await drive(url, body, headers, 1.0, min(args.concurrency, 4), 0, None)
+                    raw = await drive(url, body, headers, args.duration, args.concurrency, args.rps, router.proc.pid)
+                    rows.append(summarize(f"{label}/account-{'on' if account else 'off'}", raw, expected))
+
+    print_table(rows)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": rows}, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    asyncio.run(main())
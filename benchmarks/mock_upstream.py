@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+模拟的 OpenAI 兼容上游，供压测使用，不访问任何外部服务
+
+- GET  /v1/models: 返回 --models 个模型
+- POST /v1/chat/completions: 支持流式与非流式
+    首字节延迟 --latency 秒，之后按 --tokens-per-sec 速率输出 --tokens 个 token
+    --error-rate 比例的请求返回 --error-status（默认 500）
+
+用法: python benchmarks/mock_upstream.py [--port 9100] [--latency 0.05] [--tokens 64] [--tokens-per-sec 500]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+
+def create_app(
+    latency: float = 0.05,
+    tokens: int = 64,
+    tokens_per_sec: float = 500.0,
+    error_rate: float = 0.0,
+    error_status: int = 500,
+    models: int = 20
+) -> FastAPI:
+    app = FastAPI()
+    model_list = json.dumps({
+        "object": "list",
+        "data": [{"id": f"mock-{i}", "object": "model", "owned_by": "mock"} for i in range(models)],
+    }).encode("utf-8")
+    interval = 1.0 / tokens_per_sec if tokens_per_sec > 0 else 0.0
+
+    def chunk(model: str, content: str = None, finish: str = None, usage: dict = None) -> str:
+        data = {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [] if usage else [{"index": 0, "delta": {"content": content} if content else {}, "finish_reason": finish}],
+        }
+        if usage:
+            data["usage"] = usage
+        return f"data: {json.dumps(data)}\n\n"
+
+    @app.get("/v1/models")
+    async def list_models():
+        return Response(content=model_list, media_type="application/json")
+
+    @app.post("/v1/chat/completions")
+    async def chat(request: Request):
+        body = await request.json()
+        model = body.get("model", "mock")
+        if error_rate and random.random() < error_rate:
+            return Response(
+                content=json.dumps({"error": {"message": "injected error", "type": "server_error"}}),
+                media_type="application/json",
+                status_code=error_status
+            )
+        usage = {"prompt_tokens": 16, "completion_tokens": tokens, "total_tokens": 16 + tokens}
+        if body.get("stream"):
+            async def generate():
+                await asyncio.sleep(latency)
+                for i in range(tokens):
+                    yield chunk(model, f"tok{i} ")
+                    if interval:
+                        await asyncio.sleep(interval)
+                yield chunk(model, finish="stop")
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    yield chunk(model, usage=usage)
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(generate(), media_type="text/event-stream")
+        await asyncio.sleep(latency + tokens * interval)
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": " ".join(f"tok{i}" for i in range(tokens))},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        }
+
+    return app
+
+def app_from_env() -> FastAPI:
+    """供 uvicorn --factory 使用，参数来自环境变量"""
+    return create_app(
+        latency=float(os.getenv("MOCK_LATENCY", "0.05")),
+        tokens=int(os.getenv("MOCK_TOKENS", "64")),
+        tokens_per_sec=float(os.getenv("MOCK_TOKENS_PER_SEC", "500")),
+        error_rate=float(os.getenv("MOCK_ERROR_RATE", "0")),
+        error_status=int(os.getenv("MOCK_ERROR_STATUS", "500")),
+        models=int(os.getenv("MOCK_MODELS", "20"))
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description='模拟的 OpenAI 兼容上游')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--latency', type=float, default=0.05, help='首字节延迟（秒）')
+    parser.add_argument('--tokens', type=int, default=64, help='每个响应的 token 数')
+    parser.add_argument('--tokens-per-sec', type=float, default=500, help='输出速率，0 表示不限速')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='注入错误的比例')
+    parser.add_argument('--error-status', type=int, default=500, help='注入错误的状态码')
+    parser.add_argument('--models', type=int, default=20, help='/v1/models 返回的模型数')
+    args = parser.parse_args()
+
+    import uvicorn
+    app = create_app(args.latency, args.tokens, args.tokens_per_sec, args.error_rate, args.error_status, args.models)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
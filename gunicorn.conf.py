@@ -0,0 +1,38 @@
+# 多 worker 部署配置：gunicorn -c gunicorn.conf.py main:app
+#
+# 多个 worker 之间通过共享状态存储同步 bypass 设置和模型目录，
+# 需要在 .env 中设置 STATE_BACKEND=sqlite（单机）或 STATE_BACKEND=redis
+import logging
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+# 流式响应可能持续较长时间，避免被 worker 超时机制中断
+timeout = int(os.getenv("WORKER_TIMEOUT", "600"))
+graceful_timeout = 30
+keepalive = 5
+
+# gunicorn 在调用 on_starting 之前已按 errorlog / loglevel 配置好该 logger
+logger = logging.getLogger("gunicorn.error")
+
+def on_starting(server):
+    if workers > 1 and os.getenv("STATE_BACKEND", "memory").lower() == "memory":
+        logger.warning("多 worker 部署时请设置 STATE_BACKEND=sqlite 或 redis，否则 bypass 设置不会在 worker 之间共享")
+    # Prometheus 多进程指标：各 worker 把指标写入 PROMETHEUS_MULTIPROC_DIR，/metrics 汇总所有进程
+    directory = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        # 清理上次运行留下的指标文件
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.endswith(".db"):
+                os.remove(os.path.join(directory, name))
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        try:
+            from prometheus_client import multiprocess
+        except ImportError:
+            return
+        multiprocess.mark_process_dead(worker.pid)
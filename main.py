@@ -1,20 +1,17 @@
 from fastapi import FastAPI, Request, Response
 from fastapi.responses import StreamingResponse
-import langfuse
-from langfuse.openai import openai
 from loguru import logger
 import json
-import yaml
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Callable, Awaitable, Union
 import os
-from datetime import datetime
+import time
+import math
+import signal
 import asyncio
-import aiohttp
-from pydantic import BaseModel, Field
+import hmac
+import httpx
+import openai
 from dotenv import load_dotenv
-import time
-from dataclasses import dataclass
-from threading import Lock
 
 # 用户管理系统
 from user_management import (
@@ -24,7 +21,73 @@ from user_management import (
     BypassRequest, 
     set_user_bypass, 
     get_user_bypass,
-    get_user_bypass_model
+    get_user_bypass_model,
+    user_bypass_cache,
+    auth_cache
+)
+# 批处理任务
+from batch import BatchJob, BatchJobStore
+# 代理核心
+from proxy import (
+    ServerConfig,
+    Config,
+    load_config,
+    UpstreamClient,
+    UpstreamClientRegistry,
+    normalize_base_url,
+    SSEFrameSplitter,
+    DONE_FRAME,
+    frame_data,
+    rewrite_model,
+    extract_usage,
+    RequestContext,
+    Route,
+    ModelCatalog,
+    StateBackend,
+    create_state_backend,
+    TracingConfig,
+    TraceExporter,
+    TraceRecord,
+    AccessLogConfig,
+    AccessLogger,
+    LoadBalancer,
+    BackendLease,
+    parse_retry_after,
+    VirtualModelConfig,
+    FailoverRunner,
+    UpstreamStatusError,
+    RETRYABLE_STATUS,
+    backoff_delay,
+    CircuitOpenError,
+    RateLimiter,
+    RateLimitExceeded,
+    EMPTY_PERMIT,
+    estimate_tokens,
+    CacheConfig,
+    ResponseCache,
+    CoalesceConfig,
+    RequestCoalescer,
+    EmbeddingBatchConfig,
+    EmbeddingBatcher,
+    batch_key,
+    shared_params,
+    normalize_input,
+    metrics,
+    CacheEntry,
+    cache_key,
+    parse_cache_control,
+    split_model_id,
+    SamplingProfiler,
+    server_timing,
+    json_loads,
+    json_response,
+    error_body,
+    ERROR_UNAUTHORIZED,
+    ERROR_FORBIDDEN_ADMIN,
+    ERROR_ADMIN_DISABLED,
+    ERROR_FORBIDDEN_PROVIDER,
+    ERROR_UNSUPPORTED_ENDPOINT,
+    ERROR_BATCH_NOT_FOUND
 )
 
 load_dotenv()  # load .env
@@ -34,80 +97,236 @@ logger.add("api_proxy.log",
            format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}",
            rotation="50 MB")
 
-class ServerConfig(BaseModel):
-    url: str
-    api_key: str
-    model_filter: Optional[str] = Field(None, alias='filter')
-    override: Optional[List[str]] = None
-    append: Optional[List[str]] = None
-
-class Config(BaseModel):
-    servers: Dict[str, ServerConfig]
-
 # 全局配置
 config: Config = None
 db: Optional[SQLiteProvider] = None
+state: Optional[StateBackend] = None
+tracer = TraceExporter(TracingConfig(enabled=False))
+access_log = AccessLogger(AccessLogConfig(enabled=False))
+balancer = LoadBalancer()
+clients = UpstreamClientRegistry(on_connect=balancer.observe_connect)
+catalog = ModelCatalog(clients)
+failover = FailoverRunner()
+response_cache = ResponseCache(CacheConfig(enabled=False))
+coalescer = RequestCoalescer(CoalesceConfig(enabled=False))
+embedding_batcher = EmbeddingBatcher()
+profiler = SamplingProfiler()
+CONFIG_PATH = os.getenv("CONFIG_PATH", "config.yaml")
+# 大于 0 时每隔该秒数检查配置文件是否修改，修改后自动重新加载；也可以向进程发送 SIGHUP 触发
+CONFIG_RELOAD_INTERVAL = float(os.getenv("CONFIG_RELOAD_INTERVAL", "0"))
+# 重新加载时不会生效、需要重启的配置项
+RESTART_REQUIRED = ("tracing", "access_log", "cache", "coalesce")
+config_watcher: Optional[asyncio.Task] = None
 ENABLE_ACCOUNT_MANAGEMENT = os.getenv("ENABLE_ACCOUNT_MANAGEMENT", "false").lower() == "true"
 ENABLE_BYPASS = os.getenv("ENABLE_BYPASS", "true").lower() == "true"
-
-def load_config(config_path: str = "config.yaml") -> Config:
-    """加载YAML配置文件"""
-    try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config_data = yaml.safe_load(f)
-            return Config(**config_data)
-    except Exception as e:
-        logger.error(f"加载配置文件失败: {str(e)}")
-        raise
+# 未启用用户管理时访问 /api/admin/* 需要的令牌，为空时管理接口不可用
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# 多 worker 部署时使用 sqlite 或 redis 共享 bypass 设置和模型目录
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "state.db")
+# 模型目录的磁盘快照，重启后立即可用，设为空则不使用
+CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH", "catalog_snapshot.json")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# 在响应头 Server-Timing 中返回各阶段耗时
+ENABLE_SERVER_TIMING = os.getenv("ENABLE_SERVER_TIMING", "true").lower() == "true"
+# 限流额度不足时最多排队等待的时间（秒），超过则返回 429
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "2"))
+rate_limiter = RateLimiter(max_wait=RATE_LIMIT_MAX_WAIT)
+# 批处理任务目录，与 python manage.py batch worker 使用同一个目录
+BATCH_DIR = os.getenv("BATCH_DIR", "batch_jobs")
+batch_store = BatchJobStore(BATCH_DIR)
 
 app = FastAPI(title="OpenAI API Proxy Router")
 
 @app.on_event("startup")
 async def startup_event():
     """服务启动时加载配置"""
-    global config, db
-    config = load_config()
+    global config, db, state, tracer, access_log, response_cache, coalescer, config_watcher
+    config = load_config(CONFIG_PATH)
     logger.info(f"已加载服务器配置: {list(config.servers.keys())}")
+    clients.build(config)
+    clients.start()
+    catalog.configure(config)
+    loaded = catalog.use_snapshot(CATALOG_SNAPSHOT_PATH)
+    if loaded:
+        logger.info(f"已从快照载入 {loaded} 个服务器的模型列表")
+    balancer.configure(config)
+    
+    state = create_state_backend(STATE_BACKEND, db_path=STATE_DB_PATH, redis_url=REDIS_URL)
+    await state.initialize()
+    catalog.use_state(state)
+    if loaded:
+        # 快照中过期的列表在后台重新验证，配置了共享存储时优先读取其他 worker 的结果
+        revalidating = catalog.revalidate()
+        if revalidating:
+            logger.info(f"正在后台重新验证 {revalidating} 个服务器的过期模型列表")
+    user_bypass_cache.use_backend(state)
+    if state.shared:
+        logger.info(f"已启用共享状态存储: {STATE_BACKEND}")
+    
+    auth_cache.on_lookup = lambda hit: metrics.cache_lookup("auth", hit)
+    
+    tracer = TraceExporter(config.tracing)
+    tracer.start()
+    access_log = AccessLogger(config.access_log)
+    access_log.start()
+    response_cache = ResponseCache(config.cache)
+    await response_cache.initialize()
+    coalescer = RequestCoalescer(config.coalesce)
     
     if ENABLE_ACCOUNT_MANAGEMENT:
         db = SQLiteProvider()
         await db.initialize()
         logger.info("用户管理系统已启用")
+    elif os.path.exists("users.db"):
+        # 未启用用户管理时仍从用户库读取 provider 限流配置（manage.py limit provider）
+        db = SQLiteProvider()
+        await db.initialize()
+    
+    try:
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGHUP, lambda: asyncio.ensure_future(reload_config("SIGHUP"))
+        )
+    except (NotImplementedError, RuntimeError, AttributeError):
+        # Windows 没有 SIGHUP，非主线程运行时无法注册信号处理
+        pass
+    if CONFIG_RELOAD_INTERVAL > 0:
+        config_watcher = asyncio.create_task(watch_config(CONFIG_RELOAD_INTERVAL))
+
+async def reload_config(reason: str) -> bool:
+    """重新加载配置文件，校验失败时继续使用当前配置
+    
+    路由表、上游客户端、端点池和模型目录在同一次事件循环调度中一起替换，请求看到的要么全是旧配置要么全是新配置；
+    未变化端点的连接池原样保留，进行中的请求（包括流式响应）不受影响。
+    """
+    global config
+    try:
+        new_config = await asyncio.to_thread(load_config, CONFIG_PATH)
+    except Exception as e:
+        logger.error(f"重新加载配置失败（{reason}），继续使用当前配置: {str(e)}")
+        return False
+    clients.build(new_config)
+    balancer.configure(new_config)
+    catalog.configure(new_config)
+    old, config = config, new_config
+    logger.info(f"已重新加载配置（{reason}）: {list(config.servers.keys())}")
+    pending = [name for name in RESTART_REQUIRED if getattr(old, name) != getattr(new_config, name)]
+    if pending:
+        logger.warning(f"以下配置项需要重启服务才能生效: {pending}")
+    return True
+
+async def watch_config(interval: float):
+    """定期检查配置文件的修改时间，变化后重新加载"""
+    def mtime() -> Optional[int]:
+        try:
+            return os.stat(CONFIG_PATH).st_mtime_ns
+        except OSError:
+            return None
+    
+    last = mtime()
+    while True:
+        await asyncio.sleep(interval)
+        current = mtime()
+        if current is not None and current != last:
+            last = current
+            await reload_config("配置文件已修改")
 
-async def log_request_response(request_data: Dict[Any, Any], 
-                             response_data: Dict[Any, Any], 
-                             target_url: str,
-                             is_stream: bool):
-    """记录请求和响应的详细信息"""
-    model_name = request_data.get("model", "unknown")
-    
-    log_entry = {
-        "timestamp": datetime.now().isoformat(),
-        "model": model_name,
-        "target_url": target_url,
-        "is_stream": is_stream,
-        "request": request_data,
-    }
-    
-    if not is_stream:
-        usage = response_data.get("usage", {})
-        log_entry.update({
-            "response": response_data,
-            "tokens": {
-                "prompt": usage.get("prompt_tokens", 0),
-                "completion": usage.get("completion_tokens", 0),
-                "total": usage.get("total_tokens", 0)
-            }
-        })
-    
-    logger.info(json.dumps(log_entry, ensure_ascii=False))
+@app.on_event("shutdown")
+async def shutdown_event():
+    """服务关闭时发送剩余追踪数据，释放上游连接和数据库连接"""
+    if config_watcher:
+        config_watcher.cancel()
+    await asyncio.to_thread(tracer.close)
+    await asyncio.to_thread(access_log.close)
+    profiler.stop()
+    await response_cache.close()
+    await clients.aclose()
+    if db:
+        await db.close()
+    if state:
+        await state.close()
+
+def log_request_response(
+    ctx: RequestContext,
+    status: int,
+    start_time: float,
+    response: Any = None,
+    usage: Optional[Dict[str, Any]] = None
+):
+    """记录请求和响应的详细信息：请求路径上只做采样判断和入队，编码与写文件由后台线程完成"""
+    username = ctx.user.username if ctx.user else None
+    if not access_log.sampled(ctx.route.server_alias, username):
+        return
+    access_log.log(
+        model=ctx.model,
+        real_model=ctx.route.real_model,
+        provider=ctx.route.server_alias,
+        target_url=ctx.route.target_url,
+        username=username,
+        is_stream=ctx.is_stream,
+        status=status,
+        duration=time.time() - start_time,
+        request=ctx.raw,
+        response=response,
+        usage=usage,
+        extra={"timings_ms": {name: round(seconds * 1000, 3) for name, seconds in ctx.timings.items()}}
+    )
+
+async def require_admin(request: Request) -> Optional[Response]:
+    """管理接口鉴权，不满足时返回错误响应
+    
+    启用用户管理时要求用户拥有 admin 权限；未启用时要求请求头 Authorization: Bearer <ADMIN_TOKEN>，
+    没有设置 ADMIN_TOKEN 时管理接口不可用。
+    """
+    if ENABLE_ACCOUNT_MANAGEMENT:
+        user = await get_current_user(request, db)
+        if not (user and user.permissions.get("admin")):
+            return json_response(ERROR_FORBIDDEN_ADMIN, 403)
+        return None
+    if not ADMIN_TOKEN:
+        return json_response(ERROR_ADMIN_DISABLED, 403)
+    authorization = request.headers.get("authorization", "")
+    token = authorization[7:] if authorization.lower().startswith("bearer ") else ""
+    if not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        return json_response(ERROR_FORBIDDEN_ADMIN, 403)
+    return None
+
+def record_trace(
+    ctx: RequestContext,
+    server_config: Optional[ServerConfig],
+    start_time: float,
+    response: Any,
+    usage: Optional[Dict[str, Any]] = None,
+    error: Optional[str] = None
+):
+    """把本次调用交给后台追踪导出，请求路径上只做一次入队"""
+    user_id = ctx.user.username if ctx.user else None
+    if not tracer.should_trace(server_config, user_id):
+        return
+    trace_start = time.perf_counter()
+    tracer.record(TraceRecord(
+        model=ctx.route.real_model,
+        provider=ctx.route.server_alias,
+        user_id=user_id,
+        start_time=start_time,
+        end_time=time.time(),
+        request=ctx.raw,
+        response=response,
+        usage=usage,
+        error=error
+    ))
+    ctx.span("trace", trace_start)
 
 def get_server_config(server_alias: str) -> Optional[ServerConfig]:
     """根据服务器别名获取服务器配置"""
     return config.servers.get(server_alias)
 
-def parse_target_url(model: str, proxy_url: Optional[str] = None) -> tuple[str, Optional[str]]:
-    """解析目标URL和服务器别名
+def parse_target_url(
+    server_alias: Optional[str],
+    url: Optional[str],
+    proxy_url: Optional[str] = None
+) -> tuple[str, Optional[str]]:
+    """由模型名的解析结果确定目标URL和服务器别名
     支持两种模式：
     1. proxy模式：直接使用proxy_url参数
     2. auto模式：从model名称中解析，格式为[server_alias]model_name
@@ -115,25 +334,23 @@ def parse_target_url(model: str, proxy_url: Optional[str] = None) -> tuple[str,
     if proxy_url:
         return proxy_url, None
     
-    if model.startswith("[") and "]" in model:
-        server_alias = model[1:model.index("]")]
-        server_config = get_server_config(server_alias)
-        if server_config:
-            return server_config.url, server_alias
+    if server_alias is not None:
+        if url:
+            return url, server_alias
         raise ValueError(f"未找到服务器别名 '{server_alias}' 的配置")
     
     raise ValueError("无法确定目标服务器URL，请使用 [server_alias]model_name 格式或提供 proxy 参数")
 
-def extract_real_model_name(model: str) -> str:
-    """从model字段中提取真实的模型名称"""
-    if model.startswith("[") and "]" in model:
-        return model[model.index("]") + 1:]
-    return model
-
-def get_llm_api_key(headers: Dict[str, str], server_alias: Optional[str]) -> str:
+def get_llm_api_key(
+    headers: Dict[str, str],
+    server_alias: Optional[str],
+    lease: Optional[BackendLease] = None
+) -> str:
     """获取LLM API密钥
-    优先使用配置文件中的LLM API密钥，如果没有则使用请求头中的authorization
+    优先使用负载均衡选中端点的密钥，其次是配置文件中的LLM API密钥，如果没有则使用请求头中的authorization
     """
+    if lease is not None:
+        return lease.backend.api_key
     if server_alias and server_alias in config.servers:
         return config.servers[server_alias].api_key
     
@@ -145,322 +362,931 @@ def get_llm_api_key(headers: Dict[str, str], server_alias: Optional[str]) -> str
     
     raise ValueError("未找到有效的LLM API密钥")
 
-async def fetch_models_from_server(server_alias: str, server_config: ServerConfig) -> List[Dict[str, Any]]:
-    """从单个服务器获取模型列表"""
-    try:
-        logger.debug(f"从服务器 {server_alias} 获取模型列表")
-        
-        # 如果设置了 override，直接返回指定的模型列表
-        if server_config.override is not None:
-            return [{"id": f"[{server_alias}]{model}"} for model in server_config.override]
-            
-        headers = {
-            "Authorization": f"Bearer {server_config.api_key}",
-            "Content-Type": "application/json"
-        }
-        models_url = f"{server_config.url}/models"
-
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(models_url, headers=headers, timeout=10) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        raise Exception(f"获取模型列表失败: HTTP {response.status}, {error_text}")
-                    data = await response.json()
-                    
-                    # 标准OpenAI格式
-                    models = data.get("data", [])
-                    if not models and isinstance(data, list):
-                        # 某些服务器可能直接返回模型列表
-                        models = data
-                    
-                    # 应用过滤器
-                    if server_config.model_filter:
-                        filter_conditions = server_config.model_filter.split()
-                        for condition in filter_conditions:
-                            # 将*通配符转换为正则表达式
-                            pattern = condition.replace("*", ".*")
-                            import re
-                            regex = re.compile(pattern, re.IGNORECASE)
-                            models = [m for m in models if (
-                                isinstance(m, dict) and regex.search(m["id"]) or
-                                isinstance(m, str) and regex.search(m)
-                            )]
-                        
-                    # 为每个模型添加服务器标识
-                    processed_models = []
-                    for model in models:
-                        if isinstance(model, str):
-                            # 如果模型是字符串，转换为字典
-                            model = {"id": model}
-                        model["id"] = f"[{server_alias}]{model['id']}"
-                        processed_models.append(model)
-                    
-                    # 添加 append 字段中的模型
-                    if server_config.append:
-                        for model in server_config.append:
-                            processed_models.append({"id": f"[{server_alias}]{model}"})
-                    
-                    return processed_models
-            except asyncio.TimeoutError:
-                logger.error(f"从服务器 {server_alias} 获取模型列表超时")
-                return []
-            except aiohttp.ClientError as e:
-                logger.error(f"从服务器 {server_alias} 获取模型列表网络错误: {str(e)}")
-                return []
-    except Exception as e:
-        logger.error(f"从服务器 {server_alias} 获取模型列表失败: {str(e)}")
-        return []
-
 @app.get("/v1/models")
 async def list_models(request: Request):
-    """获取所有配置的服务器的模型列表，使用缓存机制"""
-    global models_cache
-    
+    """获取所有配置的服务器的模型列表，过期时返回旧列表并在后台刷新"""
     try:
-        current_time = time.time()
-        
-        # 使用锁检查缓存： 即使多个请求同时到达，也只有一个请求会更新缓存
-        with cache_lock:
-            if models_cache and (current_time - models_cache.timestamp) < CACHE_TTL:
-                logger.debug("返回缓存的模型列表")
-                return Response(
-                    content=json.dumps({"data": models_cache.data, "object": "list"}),
-                    media_type="application/json"
-                )
-        
-        # 缓存无效或不存在，获取新数据
-        tasks = []
-        for server_alias, server_config in config.servers.items():
-            task = fetch_models_from_server(server_alias, server_config)
-            tasks.append(task)
-        
-        # 等待所有请求完成
-        models_lists = await asyncio.gather(*tasks)
-        
-        # 合并所有模型列表
-        all_models = []
-        for models in models_lists:
-            all_models.extend(models)
-        
-        # 更新缓存
-        with cache_lock:
-            models_cache = ModelsCache(
-                data=all_models,
-                timestamp=current_time
-            )
-        
         return Response(
-            content=json.dumps({"data": all_models, "object": "list"}),
+            content=await catalog.get_payload(),
             media_type="application/json"
         )
     except Exception as e:
         logger.error(f"获取模型列表失败: {str(e)}")
-        return Response(
-            content=json.dumps({"error": str(e)}),
-            media_type="application/json",
-            status_code=500
+        return json_response({"error": str(e)}, 500)
+
+@app.post("/v1/batches")
+async def create_batch(request: Request):
+    """提交批处理任务：请求体为 JSONL，每行 {"custom_id", "url", "body"}
+    
+    任务由独立运行的 worker（python manage.py batch worker）执行，可选参数 ?concurrency= 为每个 provider 的并发数。
+    """
+    user = None
+    if ENABLE_ACCOUNT_MANAGEMENT:
+        user = await get_current_user(request, db)
+        if not user:
+            return json_response(ERROR_UNAUTHORIZED, 401)
+    authorization = request.headers.get("authorization", "")
+    api_key = authorization[7:] if authorization.lower().startswith("bearer ") else None
+    try:
+        concurrency = int(request.query_params.get("concurrency", "4"))
+        lines = (await request.body()).decode("utf-8").splitlines()
+        job = await asyncio.to_thread(
+            batch_store.create, lines, concurrency, user.username if user else None, api_key
         )
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+    logger.info(f"已提交批处理任务 {job.id}，共 {job.total} 条请求")
+    return json_response(job.public())
+
+async def get_batch_job(request: Request, job_id: str) -> Union[BatchJob, Response]:
+    """读取批处理任务，启用用户管理时只有提交者和 admin 可以访问"""
+    user = await get_current_user(request, db) if ENABLE_ACCOUNT_MANAGEMENT else None
+    if ENABLE_ACCOUNT_MANAGEMENT and not user:
+        return json_response(ERROR_UNAUTHORIZED, 401)
+    try:
+        job = await asyncio.to_thread(batch_store.get, job_id)
+    except ValueError:
+        job = None
+    if job is None or (user and job.owner != user.username and not user.permissions.get("admin")):
+        return json_response(ERROR_BATCH_NOT_FOUND, 404)
+    return job
+
+@app.get("/v1/batches/{job_id}")
+async def batch_status(request: Request, job_id: str):
+    """查看批处理任务的状态和进度"""
+    job = await get_batch_job(request, job_id)
+    if isinstance(job, Response):
+        return job
+    return json_response(job.public())
+
+@app.get("/v1/batches/{job_id}/results")
+async def batch_results(request: Request, job_id: str):
+    """下载批处理结果（JSONL），任务未完成时返回已完成的部分"""
+    job = await get_batch_job(request, job_id)
+    if isinstance(job, Response):
+        return job
+    path = batch_store.output_path(job.id)
+    if not os.path.exists(path):
+        return Response(content=b"", media_type="application/x-ndjson")
+    
+    def read_lines():
+        # 只返回完整的行，worker 正在写入的最后一行留到下次下载
+        pending = b""
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(65536)
+                if not chunk:
+                    break
+                data = pending + chunk
+                end = data.rfind(b"\n") + 1
+                if end:
+                    yield data[:end]
+                pending = data[end:]
+    
+    return StreamingResponse(read_lines(), media_type="application/x-ndjson")
 
 @app.post("/v1/{path:path}")
 async def proxy_openai(request: Request, path: str):
     """处理所有OpenAI API请求的主路由"""
+    ctx = RequestContext(request)
+    start = time.perf_counter()
+    if not profiler.sample():
+        return with_server_timing(ctx, start, await handle_openai(ctx, start))
+    # 被采样分析器选中的请求，在响应发送完毕后退出采样
+    try:
+        response = await handle_openai(ctx, start)
+    except BaseException:
+        profiler.exit()
+        raise
+    return with_server_timing(ctx, start, release_after(response, profiler.exit))
+
+def with_server_timing(ctx: RequestContext, start: float, response: Response) -> Response:
+    """在响应头 Server-Timing 中返回开始响应之前各阶段的耗时"""
+    if ENABLE_SERVER_TIMING:
+        response.headers["Server-Timing"] = server_timing(ctx.timings, time.perf_counter() - start)
+    return response
+
+async def handle_openai(ctx: RequestContext, start: float) -> Response:
+    """认证、bypass、路由之后把请求交给 proxy_request / proxy_virtual"""
+    request = ctx.request
     try:
         # 如果启用了用户管理，先进行用户认证
-        current_user = "anonymous"
         if ENABLE_ACCOUNT_MANAGEMENT:
-            current_user = await get_current_user(request, db)
-            if not current_user:
-                return Response(
-                    content=json.dumps({"error": "Unauthorized"}),
-                    media_type="application/json",
-                    status_code=401
-                )
+            ctx.user = await get_current_user(request, db)
+            if not ctx.user:
+                return json_response(ERROR_UNAUTHORIZED, 401)
+            ctx.timings["auth"] = time.perf_counter() - start
+            metrics.auth(ctx.timings["auth"])
+        if db is not None:
+            await rate_limiter.sync(db)
         
-        body = await request.json()
+        body_start = time.perf_counter()
+        await ctx.read_body()
+        ctx.span("body", body_start)
+        username = ctx.user.username if ctx.user else None
         proxy_url = request.query_params.get("proxy")
-        model = body.get("model", "")
         
         # 如果启用了 bypass 功能并且用户有 bypass 设置，则使用 bypass 模型
-        if ENABLE_BYPASS and ENABLE_ACCOUNT_MANAGEMENT and current_user != "anonymous":
-            bypass_model = get_user_bypass_model(current_user.username)
+        if ENABLE_BYPASS and ctx.user:
+            bypass_start = time.perf_counter()
+            bypass_model = await get_user_bypass_model(ctx.user.username)
+            ctx.span("bypass", bypass_start)
             if bypass_model and bypass_model != "auto":
-                logger.info(f"用户 {current_user.username} 使用 bypass 模型: {bypass_model}")
-                model = bypass_model
-                body["model"] = model
+                logger.info(f"用户 {ctx.user.username} 使用 bypass 模型: {bypass_model}")
+                ctx.set_model(bypass_model)
+        
+        if not proxy_url and ctx.model in config.virtual_models:
+            virtual = config.virtual_models[ctx.model]
+            return await with_metrics(
+                ctx, "virtual", start, lambda: with_quota(ctx, "user", username, lambda: proxy_virtual(ctx, virtual))
+            )
         
-        target_url, server_alias = parse_target_url(model, proxy_url)
-        if not target_url.endswith("/v1"):
-            target_url = f"{target_url.rstrip('/')}/v1"
+        route_start = time.perf_counter()
+        ctx.route = resolve_route(ctx.model, proxy_url)
             
-        if ENABLE_ACCOUNT_MANAGEMENT and current_user:
+        if ctx.user:
             # 检查用户权限
-            if server_alias not in current_user.permissions and '*' not in current_user.permissions:
-                return Response(
-                    content=json.dumps({"error": "Forbidden: No access to this provider"}),
-                    media_type="application/json",
-                    status_code=403
-                )
+            if not has_provider_access(ctx.user, ctx.route.server_alias):
+                return json_response(ERROR_FORBIDDEN_PROVIDER, 403)
+        ctx.timings["routing"] = time.perf_counter() - route_start
+        metrics.routing(ctx.timings["routing"])
         
-        return await proxy_request(request, target_url, server_alias, current_user)
+        return await with_metrics(
+            ctx,
+            ctx.route.server_alias or "proxy",
+            start,
+            lambda: with_quota(ctx, "user", username, lambda: proxy_request(ctx))
+        )
         
+    except RateLimitExceeded as e:
+        return error_response(e)
     except Exception as e:
         logger.error(f"处理请求失败: {str(e)}")
+        return json_response({"error": str(e)}, 500)
+
+def resolve_route(model: str, proxy_url: Optional[str] = None) -> Route:
+    """解析模型名得到路由结果，每个请求只查询一次路由缓存"""
+    server_alias, url, real_model = catalog.index.resolve(model)
+    target_url, server_alias = parse_target_url(server_alias, url, proxy_url)
+    return Route(
+        target_url=normalize_base_url(target_url),
+        server_alias=server_alias,
+        real_model=real_model
+    )
+
+def has_provider_access(user: User, server_alias: Optional[str]) -> bool:
+    """检查用户是否有权访问该 provider"""
+    return server_alias in user.permissions or '*' in user.permissions
+
+def release_after(response: Response, release: Callable[[], None]) -> Response:
+    """响应发送完毕后执行 release：流式响应在最后一帧之后，其余立即执行"""
+    if isinstance(response, StreamingResponse):
+        body = response.body_iterator
+        
+        async def wrapped():
+            try:
+                async for chunk in body:
+                    yield chunk
+            finally:
+                release()
+        
+        response.body_iterator = wrapped()
+    else:
+        release()
+    return response
+
+async def with_metrics(
+    ctx: RequestContext,
+    provider: str,
+    start: float,
+    call: Callable[[], Awaitable[Response]]
+) -> Response:
+    """记录请求数、进行中请求数和代理额外开销（开始响应的耗时减去上游首字节耗时）"""
+    if not metrics.enabled:
+        return await call()
+    inflight = metrics.inflight.labels(provider)
+    inflight.inc()
+    try:
+        response = await call()
+    except BaseException:
+        inflight.dec()
+        raise
+    overhead = time.perf_counter() - start - ctx.timings.get("upstream_first_byte", 0.0)
+    metrics.request(provider, metrics_model(ctx, provider), response.status_code, overhead)
+    return release_after(response, inflight.dec)
+
+def metrics_model(ctx: RequestContext, provider: str) -> str:
+    """指标的 model 标签：只使用配置中的虚拟模型和模型目录中存在的模型名，其余归为 other
+    
+    模型名由客户端传入，直接作为标签会让时间序列数量无限增长。
+    """
+    if provider == "virtual":
+        return ctx.model
+    if ctx.route.real_model in catalog.index.by_alias.get(provider, ()):
+        return ctx.route.real_model
+    return "other"
+
+def decode_response(content: bytes) -> Optional[Dict[str, Any]]:
+    """解码上游的非流式响应体，不是 JSON 对象时返回 None（响应体仍原样转发给客户端）"""
+    try:
+        data = json_loads(content)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+def record_usage(ctx: RequestContext, usage: Optional[Dict[str, Any]]) -> None:
+    """记录上游返回的 token 用量，用于限流结算和指标"""
+    if usage:
+        ctx.usage.update(usage)
+        metrics.usage(ctx.route.server_alias, usage)
+
+def record_upstream(ctx: RequestContext, first_byte: Optional[float], total: float, chunks: int = 0) -> None:
+    """记录上游首字节耗时和总耗时"""
+    if first_byte is not None:
+        ctx.timings["upstream_first_byte"] = first_byte
+    ctx.timings["upstream"] = total
+    metrics.upstream(ctx.route.server_alias, first_byte, total, chunks)
+
+async def with_quota(
+    ctx: RequestContext,
+    scope: str,
+    name: Optional[str],
+    call: Callable[[], Awaitable[Response]]
+) -> Response:
+    """在用户或 provider 的限流额度内执行 call，请求结束后归还并发名额、按实际 token 用量结算"""
+    quota_start = time.perf_counter()
+    permit = await rate_limiter.acquire(scope, name, estimate_tokens(ctx.raw))
+    ctx.span("quota", quota_start)
+    if permit is EMPTY_PERMIT:
+        return await call()
+    try:
+        response = await call()
+    except BaseException:
+        permit.release()
+        raise
+    return release_after(response, lambda: permit.release(ctx.usage.get("total_tokens")))
+
+def error_response(e: Exception) -> Response:
+    """把转发过程中的异常转换为返回给客户端的错误响应"""
+    if isinstance(e, UpstreamStatusError):
+        # 上游报错时原样返回错误内容和状态码
+        return Response(content=e.content, media_type=e.media_type, status_code=e.status_code)
+    if isinstance(e, openai.APIStatusError):
+        # SDK 模式下同样原样返回，与 raw 模式一致
+        try:
+            content = e.response.content
+        except httpx.ResponseNotRead:
+            content = error_body(str(e))
         return Response(
-            content=json.dumps({"error": str(e)}),
-            media_type="application/json",
-            status_code=500
+            content=content,
+            media_type=e.response.headers.get("content-type", "application/json"),
+            status_code=e.status_code
+        )
+    if isinstance(e, RateLimitExceeded):
+        return json_response(
+            {"error": str(e)},
+            429,
+            headers={"Retry-After": str(max(math.ceil(e.retry_after), 1))}
         )
+    if isinstance(e, CircuitOpenError):
+        return json_response(
+            {"error": str(e)},
+            503,
+            headers={"Retry-After": str(max(int(e.retry_after), 1))}
+        )
+    if isinstance(e, ValueError):
+        return json_response({"error": str(e)}, 401)
+    logger.error(f"代理请求失败: {str(e)}")
+    return json_response({"error": str(e)}, 500)
 
-async def proxy_request(
-    request: Request, 
-    target_url: str, 
-    server_alias: Optional[str] = None,
-    current_user: Optional[User] = None
-) -> Response:
+async def proxy_request(ctx: RequestContext) -> Response:
     """代理请求到目标服务器"""
-    # 读取原始请求内容
-    body = await request.json()
-    headers = dict(request.headers)
+    try:
+        if "/embeddings" in ctx.request.url.path and ctx.route.server_alias:
+            server_config = get_server_config(ctx.route.server_alias)
+            if server_config and server_config.embedding_batch.enabled and "input" in ctx.body:
+                return await batch_embeddings(ctx, server_config.embedding_batch)
+        return await with_coalescing(ctx, lambda: with_cache(
+            ctx,
+            lambda: with_quota(ctx, "provider", ctx.route.server_alias, lambda: forward_request(ctx))
+        ))
+    except Exception as e:
+        return error_response(e)
+
+async def batch_embeddings(ctx: RequestContext, settings: EmbeddingBatchConfig) -> Response:
+    """embeddings 微批处理：与同一窗口内的其他请求合并发给上游，再取回本请求的部分
+    
+    provider 限流额度、token 用量和访问日志都按拆分后的结果由每个调用方分别结算和记录。
+    """
+    route = ctx.route
+    
+    async def flush(inputs: List[Any]) -> Dict[str, Any]:
+        # 只由共享参数、模型和合并后的输入组成，不带第一个调用方的其他字段
+        merged = ctx.with_body({**shared_params(ctx.body), "model": ctx.model, "input": inputs})
+        response = await forward_request(merged)
+        if response.status_code != 200:
+            raise UpstreamStatusError(response.status_code, response.body, response.media_type or "application/json")
+        return json_loads(response.body)
+    
+    async def submit() -> Response:
+        start_time = time.time()
+        upstream_start = time.perf_counter()
+        key = batch_key(route.server_alias, route.real_model, ctx.body)
+        data = await embedding_batcher.submit(key, normalize_input(ctx.body["input"]), settings, flush)
+        # 包括在批次窗口内等待的时间
+        ctx.span("upstream", upstream_start)
+        usage = data.get("usage")
+        record_usage(ctx, usage)
+        log_request_response(ctx, 200, start_time, usage=usage)
+        return json_response(data)
+    
+    return await with_quota(ctx, "provider", route.server_alias, submit)
+
+def request_key(ctx: RequestContext, deterministic_only: bool = True) -> Optional[str]:
+    """计算本次请求的缓存 / 合并键，不满足条件时返回 None
+    
+    只处理配置文件中 provider 的 chat/completions 请求；deterministic_only 时只处理 temperature 为 0 的请求。
+    """
+    if "/chat/completions" not in ctx.request.url.path:
+        return None
+    server_config = get_server_config(ctx.route.server_alias) if ctx.route.server_alias else None
+    if server_config is None:
+        return None
+    # 先只扫描 temperature，确定需要计算键时才解码请求体
+    if deterministic_only and ctx.temperature != 0:
+        return None
+    # raw 模式改写了帧中的 model 字段，不同的请求模型名对应不同的缓存内容
+    rewritten = ctx.is_stream and server_config.stream_mode == "raw" and server_config.rewrite_model
+    return cache_key(
+        ctx.request.url.path,
+        ctx.route.server_alias,
+        ctx.route.real_model,
+        ctx.body,
+        ctx.is_stream,
+        ctx.model if rewritten else None
+    )
+
+def cached_response(ctx: RequestContext, entry: CacheEntry) -> Response:
+    """用缓存内容构造响应：流式响应一次性回放全部 SSE 帧"""
+    start_time = time.time()
+    headers = {"X-Cache": "HIT", "Age": str(int(entry.age))}
+    # 命中缓存不消耗上游 token，按 0 结算 TPM 额度
+    ctx.usage.setdefault("total_tokens", 0)
+    log_request_response(ctx, 200, start_time)
+    if ctx.is_stream:
+        async def replay():
+            yield entry.value
+        
+        return StreamingResponse(replay(), media_type="text/event-stream", headers=headers)
+    return Response(content=entry.value, media_type="application/json", headers=headers)
+
+async def with_cache(ctx: RequestContext, call: Callable[[], Awaitable[Response]]) -> Response:
+    """按缓存键查询响应缓存，未命中时执行 call 并缓存成功的响应
+    
+    客户端可以用 Cache-Control 控制缓存：no-store 不读也不写，no-cache 跳过缓存并刷新，max-age=N 只接受 N 秒内的缓存。
+    响应头 X-Cache 标记 HIT / MISS / REFRESH / BYPASS。
+    """
+    server_config = get_server_config(ctx.route.server_alias) if ctx.route.server_alias else None
+    if not response_cache.enabled or server_config is None or not server_config.cache:
+        return await call()
+    key = request_key(ctx, response_cache.settings.deterministic_only)
+    if key is None:
+        return await call()
+    lookup, store, max_age = parse_cache_control(ctx.request.headers.get("cache-control"))
+    if not lookup and not store:
+        response_cache.bypassed += 1
+        response = await call()
+        response.headers["X-Cache"] = "BYPASS"
+        return response
+    if lookup:
+        cache_start = time.perf_counter()
+        entry = await response_cache.get(key, max_age)
+        ctx.span("cache", cache_start)
+        metrics.cache_lookup("response", entry is not None)
+        if entry is not None:
+            return cached_response(ctx, entry)
+    response = await call()
+    response.headers["X-Cache"] = "MISS" if lookup else "REFRESH"
+    if not store or response.status_code != 200:
+        return response
+    if not isinstance(response, StreamingResponse):
+        response_cache.put(key, response.body)
+        return response
+    
+    # 流式响应边发送边收集，完整结束且没有出错时写入缓存
+    body = response.body_iterator
+    limit = response_cache.settings.max_entry_bytes
+    
+    async def tee():
+        parts = []
+        size = 0
+        completed = False
+        try:
+            async for chunk in body:
+                if size <= limit:
+                    data = chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+                    parts.append(data)
+                    size += len(data)
+                yield chunk
+            completed = True
+        finally:
+            if completed and not ctx.failed and size <= limit:
+                response_cache.put(key, b"".join(parts))
     
+    response.body_iterator = tee()
+    return response
+
+async def with_coalescing(ctx: RequestContext, call: Callable[[], Awaitable[Response]]) -> Response:
+    """相同的请求已在进行中时共享其结果，不再重复请求上游
+    
+    后加入的请求响应头带 X-Coalesced: true，不计入 TPM 用量。
+    """
+    key = request_key(ctx, coalescer.settings.deterministic_only) if coalescer.enabled else None
+    if key is None:
+        return await call()
+    response = await coalescer.run(key, call)
+    if "x-coalesced" in response.headers:
+        ctx.usage.setdefault("total_tokens", 0)
+    return response
+
+async def proxy_virtual(ctx: RequestContext, virtual: VirtualModelConfig) -> Response:
+    """虚拟模型：沿目标链故障转移，非流式请求可选对冲
+    
+    流式请求在拿到上游第一个数据块之后才开始向客户端发送，因此失败只会发生在首字节之前，可以安全地换下一个目标。
+    """
+    targets = virtual.targets
+    if ctx.user:
+        targets = [t for t in targets if has_provider_access(ctx.user, split_model_id(t)[0])]
+        if not targets:
+            return json_response(ERROR_FORBIDDEN_PROVIDER, 403)
+    ctx.route = resolve_route(targets[0])
+    
+    async def attempt(target: str) -> Response:
+        attempt_ctx = ctx.with_route(resolve_route(target))
+        return await with_coalescing(attempt_ctx, lambda: with_cache(attempt_ctx, lambda: with_quota(
+            attempt_ctx,
+            "provider",
+            attempt_ctx.route.server_alias,
+            lambda: forward_request(attempt_ctx, sdk_retries=False)
+        )))
+    
+    try:
+        return await failover.run(virtual, attempt, targets, hedge=virtual.hedge and not ctx.is_stream)
+    except Exception as e:
+        return error_response(e)
+
+def first_byte_deadline(lease: Optional[BackendLease], server_config: Optional[ServerConfig]) -> Optional[float]:
+    """流式请求收到第一帧的截止时刻（time.monotonic），没有可用的自适应值时返回 None"""
+    if lease is None or server_config is None:
+        return None
+    timeout = lease.first_byte_timeout(server_config.pool)
+    return time.monotonic() + timeout if timeout is not None else None
+
+async def before_deadline(awaitable: Awaitable[Any], deadline: Optional[float]) -> Any:
+    """在截止时刻之前等待 awaitable 完成，超时按上游读超时处理（计入端点统计，可以故障转移）"""
+    if deadline is None:
+        return await awaitable
     try:
+        return await asyncio.wait_for(awaitable, max(deadline - time.monotonic(), 0.0))
+    except asyncio.TimeoutError:
+        raise httpx.ReadTimeout("上游首字节超时")
+
+async def post_upstream(
+    upstream: UpstreamClient,
+    path: str,
+    content: bytes,
+    timeout: Any,
+    retries: int
+) -> httpx.Response:
+    """把已编码的请求体直接发给上游，不经过 SDK 的解码和重新编码
+    
+    与 SDK 的内部重试一致：retries 次内对 408/429/5xx 和网络错误重试，优先按 Retry-After，否则指数退避。
+    """
+    headers = {"Authorization": f"Bearer {upstream.api_key}", "Content-Type": "application/json"}
+    attempt = 0
+    while True:
+        try:
+            response = await upstream.http.post(
+                f"{upstream.base_url}{path}", content=content, headers=headers, timeout=timeout
+            )
+        except httpx.TransportError:
+            if attempt >= retries:
+                raise
+            delay = None
+        else:
+            if response.status_code not in RETRYABLE_STATUS or attempt >= retries:
+                return response
+            delay = parse_retry_after(response.headers)
+        if delay is None or delay > 60:
+            delay = backoff_delay(attempt, 0.5, 8.0)
+        await asyncio.sleep(delay)
+        attempt += 1
+
+def upstream_error(response: httpx.Response, lease: Optional[BackendLease]) -> UpstreamStatusError:
+    """上游返回错误状态码：计入端点统计，返回原样保留响应内容的异常"""
+    if lease:
+        lease.done(response.status_code, parse_retry_after(response.headers))
+    return UpstreamStatusError(
+        response.status_code,
+        response.content,
+        response.headers.get("content-type", "application/json")
+    )
+
+async def forward_request(ctx: RequestContext, sdk_retries: bool = True) -> Response:
+    """转发一次请求，上游失败时抛出异常（由调用方决定返回错误还是换下一个目标）
+    
+    sdk_retries 为 False 时不使用 SDK 内部重试，由故障转移链负责重试。
+    非流式请求和 embeddings 直接发送请求体字节（只替换 model 字段），不经过 SDK。
+    """
+    route = ctx.route
+    # 配置文件中的 provider 按负载均衡策略选择端点（url + api_key）
+    lease = balancer.acquire(route.server_alias) if route.server_alias in balancer.pools else None
+    if lease is not None:
+        route.target_url = lease.backend.url
+    
+    try:
+        client_start = time.perf_counter()
         # 获取LLM API密钥
-        llm_api_key = get_llm_api_key(headers, server_alias)
-        
-        is_stream = body.get("stream", False)
-        # 从model字段中提取真实的模型名称
-        body["model"] = extract_real_model_name(body["model"])
-
-        # 创建OpenAI客户端
-        client = openai.AsyncOpenAI(
-            api_key=llm_api_key,
-            base_url=target_url
-        )
+        llm_api_key = get_llm_api_key(ctx.request.headers, route.server_alias, lease)
         
-        # 如果启用了用户管理且有用户信息，添加user_id参数
-        completion_kwargs = {**body}
-        if ENABLE_ACCOUNT_MANAGEMENT and current_user:
-            completion_kwargs["user_id"] = current_user.username
+        # 获取复用的上游客户端
+        upstream = clients.get(route.server_alias, route.target_url, llm_api_key)
+        sdk = upstream.sdk if sdk_retries else upstream.sdk_no_retry
+        retries = upstream.sdk.max_retries if sdk_retries else 0
+        ctx.span("client", client_start)
         
-        if "/chat/completions" in request.url.path:
-            if is_stream:
-                # 流式响应
-                stream = await client.chat.completions.create(**completion_kwargs)
+        if "/chat/completions" in ctx.request.url.path:
+            server_config = get_server_config(route.server_alias) if route.server_alias else None
+            start_time = time.time()
+            # 按端点观测到的延迟调整连接超时；流式请求的首字节截止时间单独计算，不影响之后的读取
+            timeout = lease.timeout(server_config.pool) if lease else openai.NOT_GIVEN
+            if ctx.is_stream and server_config and server_config.stream_mode == "raw":
+                # 原样转发上游 SSE 帧，请求体只替换 model 字段，不做完整解码
+                response_model = ctx.model if server_config.rewrite_model else None
+                return await proxy_raw_stream(ctx, upstream, server_config, lease, response_model)
+            
+            traced = tracer.should_trace(server_config, ctx.user.username if ctx.user else None)
+            
+            if ctx.is_stream:
+                # sdk 模式逐块解析后重新编码，SDK 只接受字典形式的请求体；需要原样转发时使用 stream_mode: raw
+                body = ctx.upstream_body(route.real_model)
+                # 流式响应：先取到第一个数据块再开始响应，之前的失败可以故障转移
+                deadline = first_byte_deadline(lease, server_config)
+                stream = await before_deadline(sdk.chat.completions.create(**body, timeout=timeout), deadline)
+                chunks = stream.__aiter__()
+                try:
+                    first = await before_deadline(chunks.__anext__(), deadline)
+                except StopAsyncIteration:
+                    first = None
+                except BaseException:
+                    await stream.close()
+                    raise
+                if lease:
+                    lease.first_byte()
+                first_byte = time.time() - start_time
+                ctx.timings["upstream_first_byte"] = first_byte
+                
+                async def upstream_chunks():
+                    if first is not None:
+                        yield first
+                        async for chunk in chunks:
+                            yield chunk
                 
                 async def generate():
+                    frames = [] if traced else None
+                    error = None
+                    usage = None
+                    count = 0
+                    serialize = 0.0
                     try:
-                        async for chunk in stream:
+                        async for chunk in upstream_chunks():
+                            count += 1
+                            if chunk.usage:
+                                usage = chunk.usage.model_dump()
                             if chunk.choices:
-                                yield f"data: {chunk.model_dump_json()}\n\n"
-                        openai.flush_langfuse()
+                                serialize_start = time.perf_counter()
+                                frame = f"data: {chunk.model_dump_json()}\n\n"
+                                serialize += time.perf_counter() - serialize_start
+                                if traced:
+                                    frames.append(frame.encode("utf-8"))
+                                yield frame
                     except Exception as e:
-                        logger.error(f"流式响应生成失败: {str(e)}")
-                        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+                        error = str(e)
+                        ctx.failed = True
+                        logger.error(f"流式响应生成失败: {error}")
+                        if lease:
+                            lease.fail(e)
+                        yield f"data: {json.dumps({'error': error})}\n\n"
                     finally:
+                        # 客户端中途断开时也立即关闭上游流，归还连接
+                        await stream.close()
+                        if lease:
+                            lease.done(200)
                         yield "data: [DONE]\n\n"
+                        ctx.timings["serialize"] = ctx.timings.get("serialize", 0.0) + serialize
+                        if traced:
+                            record_trace(ctx, server_config, start_time, frames, usage=usage, error=error)
+                        record_upstream(ctx, first_byte, time.time() - start_time, count)
+                        record_usage(ctx, usage)
+                        log_request_response(ctx, 200, start_time, usage=usage)
                 
                 return StreamingResponse(
                     generate(),
                     media_type="text/event-stream"
                 )
             else:
-                # 非流式响应
-                response = await client.chat.completions.create(**completion_kwargs)
-                response_data = response.model_dump()
-                await log_request_response(body, response_data, target_url, is_stream)
-                return Response(
-                    content=json.dumps(response_data),
-                    media_type="application/json"
+                # 非流式响应：请求体和响应体都原样转发，响应只解码一次用于结算用量和追踪
+                upstream_response = await post_upstream(
+                    upstream, "/chat/completions", ctx.upstream_bytes(route.real_model),
+                    timeout if lease else httpx.USE_CLIENT_DEFAULT, retries
                 )
+                if upstream_response.status_code != 200:
+                    raise upstream_error(upstream_response, lease)
+                if lease:
+                    lease.done(200)
+                elapsed = time.time() - start_time
+                record_upstream(ctx, elapsed, elapsed)
+                serialize_start = time.perf_counter()
+                content = upstream_response.content
+                response_data = decode_response(content)
+                usage = response_data.get("usage") if response_data else None
+                ctx.span("serialize", serialize_start)
+                if traced:
+                    record_trace(ctx, server_config, start_time, response_data)
+                record_usage(ctx, usage)
+                log_request_response(ctx, 200, start_time, content, usage)
+                return json_response(content)
+        elif "/embeddings" in ctx.request.url.path:
+            server_config = get_server_config(route.server_alias) if route.server_alias else None
+            start_time = time.time()
+            timeout = lease.timeout(server_config.pool) if lease else httpx.USE_CLIENT_DEFAULT
+            # 未指定 encoding_format 时按 API 默认的 float 格式返回，请求体和响应体都原样转发
+            upstream_response = await post_upstream(
+                upstream, "/embeddings", ctx.upstream_bytes(route.real_model), timeout, retries
+            )
+            if upstream_response.status_code != 200:
+                raise upstream_error(upstream_response, lease)
+            if lease:
+                lease.done(200)
+            elapsed = time.time() - start_time
+            record_upstream(ctx, elapsed, elapsed)
+            serialize_start = time.perf_counter()
+            content = upstream_response.content
+            response_data = decode_response(content)
+            usage = response_data.get("usage") if response_data else None
+            ctx.span("serialize", serialize_start)
+            if not ctx.merged:
+                record_usage(ctx, usage)
+                # 向量数据较大，访问日志只记录用量
+                log_request_response(ctx, 200, start_time, usage=usage)
+            return json_response(content)
         else:
             # 其他API端点暂不支持
-            return Response(
-                content=json.dumps({"error": "Unsupported API endpoint"}),
-                media_type="application/json",
-                status_code=400
-            )
-                
-    except ValueError as e:
-        return Response(
-            content=json.dumps({"error": str(e)}),
-            media_type="application/json",
-            status_code=401
-        )
+            if lease:
+                lease.cancel()
+            return json_response(ERROR_UNSUPPORTED_ENDPOINT, 400)
+    
+    except asyncio.CancelledError:
+        # 对冲请求中落败的一方会被取消
+        if lease:
+            lease.cancel()
+        raise
     except Exception as e:
-        logger.error(f"代理请求失败: {str(e)}")
-        return Response(
-            content=json.dumps({"error": str(e)}),
-            media_type="application/json",
-            status_code=500
-        )
+        if lease:
+            lease.fail(e)
+        raise
 
-@dataclass
-class ModelsCache:
-    data: List[Dict[str, Any]]
-    timestamp: float
+async def proxy_raw_stream(
+    ctx: RequestContext,
+    upstream: UpstreamClient,
+    server_config: ServerConfig,
+    lease: Optional[BackendLease] = None,
+    response_model: Optional[str] = None
+) -> Response:
+    """raw 流式模式：不经过 pydantic 解析，直接转发上游 SSE 字节帧
+    
+    response_model 不为空时只改写帧中的 model 字段；token 用量取自上游最后的 usage 帧。
+    上游报错或在第一帧之前断开时抛出异常。
+    """
+    start_time = time.time()
+    traced = tracer.should_trace(server_config, ctx.user.username if ctx.user else None)
+    upstream_request = upstream.http.build_request(
+        "POST",
+        f"{upstream.base_url}/chat/completions",
+        content=ctx.upstream_bytes(ctx.route.real_model),
+        headers={
+            "Authorization": f"Bearer {upstream.api_key}",
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream"
+        },
+        timeout=lease.timeout(server_config.pool) if lease else httpx.USE_CLIENT_DEFAULT
+    )
+    deadline = first_byte_deadline(lease, server_config)
+    upstream_response = await before_deadline(upstream.http.send(upstream_request, stream=True), deadline)
+    if upstream_response.status_code != 200:
+        content = await upstream_response.aread()
+        await upstream_response.aclose()
+        log_request_response(ctx, upstream_response.status_code, start_time, response=content)
+        raise upstream_error(upstream_response, lease)
+    
+    async def frames():
+        splitter = SSEFrameSplitter()
+        async for data in upstream_response.aiter_bytes():
+            for frame in splitter.feed(data):
+                yield frame
+        for frame in splitter.flush():
+            yield frame
+    
+    # 先取到第一帧再开始响应
+    upstream_frames = frames()
+    try:
+        first = await before_deadline(upstream_frames.__anext__(), deadline)
+    except StopAsyncIteration:
+        first = None
+    except BaseException:
+        await upstream_response.aclose()
+        raise
+    if lease:
+        lease.first_byte()
+    first_byte = time.time() - start_time
+    ctx.timings["upstream_first_byte"] = first_byte
+    
+    async def all_frames():
+        if first is not None:
+            yield first
+            async for frame in upstream_frames:
+                yield frame
+    
+    async def generate():
+        usage = None
+        error = None
+        # 需要追踪时保留原始帧，由导出线程拼接输出内容
+        traced_frames = [] if traced else None
+        count = 0
+        try:
+            async for frame in all_frames():
+                # 上游的 [DONE] 帧统一在结尾补发
+                if frame_data(frame) == b"[DONE]":
+                    continue
+                count += 1
+                usage = extract_usage(frame) or usage
+                if traced:
+                    traced_frames.append(frame)
+                yield rewrite_model(frame, response_model) if response_model else frame
+        except Exception as e:
+            error = str(e)
+            ctx.failed = True
+            logger.error(f"流式响应转发失败: {error}")
+            if lease:
+                lease.fail(e)
+            yield f"data: {json.dumps({'error': error})}\n\n".encode("utf-8")
+        finally:
+            await upstream_response.aclose()
+            if lease:
+                lease.done(200)
+        yield DONE_FRAME
+        if traced:
+            record_trace(ctx, server_config, start_time, traced_frames, usage=usage, error=error)
+        record_upstream(ctx, first_byte, time.time() - start_time, count)
+        record_usage(ctx, usage)
+        log_request_response(ctx, 200, start_time, usage=usage)
+    
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream"
+    )
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus 指标，需要安装 prometheus_client；多 worker 部署时设置 PROMETHEUS_MULTIPROC_DIR 汇总各进程"""
+    if not metrics.enabled:
+        return json_response({"error": "prometheus_client is not installed"}, 404)
+    content, media_type = await asyncio.to_thread(metrics.render)
+    return Response(content=content, media_type=media_type)
+
+@app.get("/api/admin/tracing")
+async def tracing_stats(request: Request):
+    """查看追踪导出队列的状态：队列深度、已导出、丢弃、落盘、失败数量"""
+    denied = await require_admin(request)
+    if denied:
+        return denied
+    return json_response(tracer.stats())
+
+@app.get("/api/admin/upstreams")
+async def upstream_stats(request: Request):
+    """查看各 provider 端点的状态：进行中请求数、延迟、摘除剩余时间、熔断器状态，degraded 标记降级的 provider"""
+    denied = await require_admin(request)
+    if denied:
+        return denied
+    return json_response(balancer.stats())
+
+@app.get("/api/admin/limits")
+async def limit_stats(request: Request):
+    """查看本 worker 的限流状态：各用户 / provider 的剩余额度、进行中请求数和被拒绝次数"""
+    denied = await require_admin(request)
+    if denied:
+        return denied
+    return json_response(rate_limiter.stats())
 
-# 全局缓存和锁
-models_cache: Optional[ModelsCache] = None
-cache_lock = Lock()
-CACHE_TTL = 300  # 缓存时间为5分钟
+@app.get("/api/admin/cache")
+async def cache_stats(request: Request):
+    """查看响应缓存的状态：内存 / 磁盘命中数、未命中数、命中率、写入和淘汰数量，以及请求合并的统计"""
+    denied = await require_admin(request)
+    if denied:
+        return denied
+    return json_response({**response_cache.stats(), "coalescing": coalescer.stats()})
 
+@app.get("/api/admin/embeddings")
+async def embedding_stats(request: Request):
+    """查看 embeddings 微批处理的状态：收到的请求数、实际上游调用数、等待中的批次"""
+    denied = await require_admin(request)
+    if denied:
+        return denied
+    return json_response(embedding_batcher.stats())
+
+@app.get("/api/admin/profiler")
+async def profiler_stats(request: Request):
+    """查看采样分析器的状态：是否在采样窗口内、剩余时间、被选中的请求数和样本数"""
+    denied = await require_admin(request)
+    if denied:
+        return denied
+    return json_response(profiler.stats())
+
+@app.post("/api/admin/profiler")
+async def start_profiler(request: Request):
+    """开启采样窗口：?sample_rate=0.1&duration=60&interval_ms=5，到时自动关闭
+    
+    采样器只在本 worker 进程内生效，多 worker 部署时请求会被分到不同进程。
+    """
+    denied = await require_admin(request)
+    if denied:
+        return denied
+    try:
+        profiler.start(
+            sample_rate=float(request.query_params.get("sample_rate", "0.1")),
+            duration=float(request.query_params.get("duration", "60")),
+            interval=float(request.query_params.get("interval_ms", "5")) / 1000
+        )
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+    logger.info(f"已开启采样分析: {profiler.stats()}")
+    return json_response(profiler.stats())
+
+@app.delete("/api/admin/profiler")
+async def stop_profiler(request: Request):
+    """提前关闭采样窗口，已采集的调用栈保留到下一次开启"""
+    denied = await require_admin(request)
+    if denied:
+        return denied
+    await asyncio.to_thread(profiler.stop)
+    return json_response(profiler.stats())
+
+@app.get("/api/admin/profiler/stacks")
+async def profiler_stacks(request: Request):
+    """导出折叠栈文本，可直接交给 flamegraph.pl 或 speedscope 生成火焰图"""
+    denied = await require_admin(request)
+    if denied:
+        return denied
+    return Response(content=profiler.collapsed(), media_type="text/plain")
 
 @app.post("/api/user/bypass")
 async def bypass_endpoint_post(request: Request, bypass_request: BypassRequest):
     """设置用户的 bypass 模型"""
 
     if not ENABLE_BYPASS:
-        return Response(
-            content=json.dumps({
-                "status": "error",
-                "message": "Bypass 功能未启用"
-            }),
-            media_type="application/json",
-            status_code=400
-        )
+        return json_response({
+            "status": "error",
+            "message": "Bypass 功能未启用"
+        }, 400)
     
     if not ENABLE_ACCOUNT_MANAGEMENT:
-        return Response(
-            content=json.dumps({
-                "status": "error",
-                "message": "用户管理系统未启用"
-            }),
-            media_type="application/json",
-            status_code=400
-        )
+        return json_response({
+            "status": "error",
+            "message": "用户管理系统未启用"
+        }, 400)
     
     return await set_user_bypass(
         request, 
         bypass_request, 
         db, 
         get_current_user, 
-        fetch_models_from_server, 
-        models_cache, 
-        config
+        catalog
     )
 
 @app.get("/api/user/bypass")
 async def bypass_endpoint_get(request: Request):
     """获取用户的 bypass 设置"""
     if not ENABLE_BYPASS:
-        return Response(
-            content=json.dumps({
-                "status": "error",
-                "message": "Bypass 功能未启用"
-            }),
-            media_type="application/json",
-            status_code=400
-        )
+        return json_response({
+            "status": "error",
+            "message": "Bypass 功能未启用"
+        }, 400)
     
     if not ENABLE_ACCOUNT_MANAGEMENT:
-        return Response(
-            content=json.dumps({
-                "status": "error",
-                "message": "用户管理系统未启用"
-            }),
-            media_type="application/json",
-            status_code=400
-        )
+        return json_response({
+            "status": "error",
+            "message": "用户管理系统未启用"
+        }, 400)
     
     return await get_user_bypass(request, db, get_current_user)
 
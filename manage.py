@@ -1,6 +1,12 @@
 #!/usr/bin/env python
 from user_management.cli import main
 import asyncio
+import sys
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        # 批处理任务：python manage.py batch submit/status/results/worker
+        from batch.cli import main as batch_main
+        asyncio.run(batch_main(sys.argv[2:]))
+    else:
+        asyncio.run(main())
@@ -0,0 +1,159 @@
+"""
+代理核心子系统
+包含配置模型、上游客户端注册表等请求转发相关组件
+"""
+
+from .config import (
+    PoolConfig,
+    TracingConfig,
+    AccessLogConfig,
+    CacheConfig,
+    CoalesceConfig,
+    BreakerConfig,
+    EmbeddingBatchConfig,
+    TimeoutConfig,
+    BackendConfig,
+    VirtualModelConfig,
+    ServerConfig,
+    Config,
+    load_config
+)
+from .clients import (
+    UpstreamClient,
+    UpstreamClientRegistry,
+    normalize_base_url,
+    HTTP2_AVAILABLE
+)
+from .context import RequestContext, Route, scan_top_level
+from .filters import ModelFilter
+from .catalog import (
+    ModelCatalog,
+    CatalogIndex,
+    split_model_id,
+    fetch_models_from_server,
+    ModelListing,
+    CACHE_TTL
+)
+from .state import (
+    StateBackend,
+    MemoryStateBackend,
+    SQLiteStateBackend,
+    RedisStateBackend,
+    create_state_backend
+)
+from .tracing import TraceExporter, TraceRecord, build_events
+from .access_log import AccessLogger, iter_access_log
+from .breaker import CircuitBreaker, CircuitOpenError
+from .balancer import LoadBalancer, BackendPool, BackendLease, Backend, parse_retry_after
+from .failover import FailoverRunner, UpstreamStatusError, LatencyWindow, RETRYABLE_STATUS, is_retryable, backoff_delay
+from .ratelimit import RateLimiter, RateLimitExceeded, Permit, TokenBucket, EMPTY_PERMIT, estimate_tokens
+from .cache import ResponseCache, CacheEntry, cache_key, parse_cache_control
+from .coalesce import RequestCoalescer, StreamBroadcaster
+from .embeddings import EmbeddingBatcher, batch_key, normalize_input, shared_params, split_response
+from .metrics import Metrics, metrics, PROMETHEUS_AVAILABLE
+from .profiling import SamplingProfiler, server_timing
+from .jsonfast import (
+    json_dumps,
+    json_loads,
+    json_response,
+    error_body,
+    ORJSON_AVAILABLE,
+    ERROR_UNAUTHORIZED,
+    ERROR_FORBIDDEN_ADMIN,
+    ERROR_ADMIN_DISABLED,
+    ERROR_FORBIDDEN_PROVIDER,
+    ERROR_UNSUPPORTED_ENDPOINT,
+    ERROR_BATCH_NOT_FOUND
+)
+from .sse import SSEFrameSplitter, DONE_FRAME, frame_data, rewrite_model, extract_usage
+
+__all__ = [
+    'PoolConfig',
+    'TracingConfig',
+    'AccessLogConfig',
+    'CacheConfig',
+    'CoalesceConfig',
+    'BreakerConfig',
+    'EmbeddingBatchConfig',
+    'TimeoutConfig',
+    'BackendConfig',
+    'VirtualModelConfig',
+    'ServerConfig',
+    'Config',
+    'load_config',
+    'UpstreamClient',
+    'UpstreamClientRegistry',
+    'normalize_base_url',
+    'HTTP2_AVAILABLE',
+    'RequestContext',
+    'Route',
+    'scan_top_level',
+    'ModelFilter',
+    'ModelCatalog',
+    'CatalogIndex',
+    'split_model_id',
+    'fetch_models_from_server',
+    'ModelListing',
+    'CACHE_TTL',
+    'StateBackend',
+    'MemoryStateBackend',
+    'SQLiteStateBackend',
+    'RedisStateBackend',
+    'create_state_backend',
+    'TraceExporter',
+    'TraceRecord',
+    'build_events',
+    'AccessLogger',
+    'iter_access_log',
+    'CircuitBreaker',
+    'CircuitOpenError',
+    'LoadBalancer',
+    'BackendPool',
+    'BackendLease',
+    'Backend',
+    'parse_retry_after',
+    'FailoverRunner',
+    'UpstreamStatusError',
+    'LatencyWindow',
+    'RETRYABLE_STATUS',
+    'is_retryable',
+    'backoff_delay',
+    'RateLimiter',
+    'RateLimitExceeded',
+    'Permit',
+    'TokenBucket',
+    'EMPTY_PERMIT',
+    'estimate_tokens',
+    'ResponseCache',
+    'CacheEntry',
+    'cache_key',
+    'parse_cache_control',
+    'RequestCoalescer',
+    'StreamBroadcaster',
+    'EmbeddingBatcher',
+    'batch_key',
+    'shared_params',
+    'normalize_input',
+    'split_response',
+    'Metrics',
+    'metrics',
+    'PROMETHEUS_AVAILABLE',
+    'SamplingProfiler',
+    'server_timing',
+    'json_dumps',
+    'json_loads',
+    'json_response',
+    'error_body',
+    'ORJSON_AVAILABLE',
+    'ERROR_UNAUTHORIZED',
+    'ERROR_FORBIDDEN_ADMIN',
+    'ERROR_ADMIN_DISABLED',
+    'ERROR_FORBIDDEN_PROVIDER',
+    'ERROR_UNSUPPORTED_ENDPOINT',
+    'ERROR_BATCH_NOT_FOUND',
+    'SSEFrameSplitter',
+    'DONE_FRAME',
+    'frame_data',
+    'rewrite_model',
+    'extract_usage'
+]
@@ -0,0 +1,223 @@
+import hashlib
+import io
+import json
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional, Union
+
+from loguru import logger
+
+from .config import AccessLogConfig
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖，未安装时不支持压缩
+    zstandard = None
+
+Payload = Union[bytes, Dict[str, Any], None]
+
+class AccessLogger:
+    """结构化访问日志
+
+    - 请求路径只做采样判断和一次非阻塞入队
+    - 写入线程负责载荷的截断/摘要、JSON 编码、（可选）zstd 压缩和按大小轮转
+    - 输出为紧凑的 JSONL，payload=full 时可用 iter_access_log 读回重放
+    """
+
+    def __init__(self, settings: AccessLogConfig):
+        self.settings = settings
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=settings.queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+        self._writer = None
+        self._written = 0
+        self.dropped = 0
+        self.failed = 0     # 写文件失败而丢失的记录数
+        if settings.compress and zstandard is None:
+            logger.warning("未安装 zstandard，访问日志不压缩")
+
+    @property
+    def path(self) -> str:
+        if self.settings.compress and zstandard is not None:
+            return f"{self.settings.path}.zst"
+        return self.settings.path
+
+    def sampled(self, provider: Optional[str], username: Optional[str]) -> bool:
+        """按用户 > provider > 全局的优先级取采样率"""
+        if not self.settings.enabled:
+            return False
+        rate = self.settings.sample_rate
+        if provider is not None and provider in self.settings.provider_sample_rates:
+            rate = self.settings.provider_sample_rates[provider]
+        if username is not None and username in self.settings.user_sample_rates:
+            rate = self.settings.user_sample_rates[username]
+        return rate >= 1.0 or random.random() < rate
+
+    def log(
+        self,
+        *,
+        model: str,
+        real_model: str,
+        provider: Optional[str],
+        target_url: str,
+        username: Optional[str],
+        is_stream: bool,
+        status: int,
+        duration: float,
+        request: Payload,
+        response: Payload = None,
+        usage: Optional[Dict[str, Any]] = None,
+        extra: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """记录一次请求，载荷处理和写文件都在写入线程中完成"""
+        usage = usage or {}
+        entry = {
+            "ts": datetime.now().isoformat(),
+            "user": username,
+            "provider": provider,
+            "model": model,
+            "real_model": real_model,
+            "target_url": target_url,
+            "stream": is_stream,
+            "status": status,
+            "duration_ms": round(duration * 1000, 2),
+            "tokens": {
+                "prompt": usage.get("prompt_tokens", 0),
+                "completion": usage.get("completion_tokens", 0),
+                "total": usage.get("total_tokens", 0)
+            },
+            "request": request,
+            "response": response,
+        }
+        if extra:
+            entry.update(extra)
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self) -> None:
+        if self.settings.enabled and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="access-log-writer", daemon=True)
+            self._thread.start()
+
+    def close(self, timeout: float = 5.0) -> None:
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _payload(self, payload: Payload) -> Any:
+        """按配置处理请求/响应载荷：full 原样、truncate 截断、hash 只保留摘要、none 不记录"""
+        if payload is None or self.settings.payload == "none":
+            return None
+        raw = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        if self.settings.payload == "hash":
+            return {"sha256": hashlib.sha256(raw).hexdigest(), "bytes": len(raw)}
+        if self.settings.payload == "truncate" and len(raw) > self.settings.max_payload_bytes:
+            text = raw[:self.settings.max_payload_bytes].decode("utf-8", errors="ignore")
+            return {"truncated": text, "bytes": len(raw)}
+        if isinstance(payload, bytes):
+            try:
+                return json.loads(payload)
+            except ValueError:
+                return payload.decode("utf-8", errors="replace")
+        return payload
+
+    def _open(self) -> None:
+        self._file = open(self.path, "ab")
+        self._written = self._file.tell()
+        self._writer = zstandard.ZstdCompressor().stream_writer(self._file) if self.path.endswith(".zst") else self._file
+
+    def _close_file(self) -> None:
+        try:
+            if self._writer is not None and self._writer is not self._file:
+                self._writer.flush(zstandard.FLUSH_FRAME)
+        finally:
+            if self._file is not None:
+                self._file.close()
+            self._file = self._writer = None
+
+    def _discard_file(self) -> None:
+        """写入出错后关闭当前文件，下一批记录重新打开"""
+        try:
+            self._close_file()
+        except Exception as e:
+            logger.error(f"关闭访问日志文件失败: {str(e)}")
+
+    def _rotate(self) -> None:
+        self._close_file()
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        base, ext = (self.path[:-4], ".zst") if self.path.endswith(".zst") else (self.path, "")
+        target, n = f"{base}.{stamp}{ext}", 1
+        while os.path.exists(target):
+            target, n = f"{base}.{stamp}-{n}{ext}", n + 1
+        os.replace(self.path, target)
+        self._open()
+
+    def _run(self) -> None:
+        try:
+            stopping = False
+            while not stopping:
+                entry = self._queue.get()
+                if entry is None:
+                    break
+                lines = [entry]
+                # 一次取出队列中已有的全部记录，批量写入
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stopping = True
+                        break
+                    lines.append(item)
+                data = bytearray()
+                for item in lines:
+                    try:
+                        item["request"] = self._payload(item["request"])
+                        item["response"] = self._payload(item["response"])
+                        data += json.dumps(item, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                        data += b"\n"
+                    except Exception as e:
+                        logger.error(f"写入访问日志失败: {str(e)}")
+                # 磁盘写满、权限或压缩错误只丢失这一批，写入线程继续运行
+                try:
+                    if self._writer is None:
+                        self._open()
+                    self._writer.write(bytes(data))
+                    self._writer.flush()
+                    self._written += len(data)
+                    if self._written >= self.settings.rotate_bytes:
+                        self._rotate()
+                except Exception:
+                    self.failed += len(lines)
+                    logger.exception(f"写入访问日志失败，丢弃 {len(lines)} 条记录")
+                    self._discard_file()
+        finally:
+            self._discard_file()
+
+def iter_access_log(path: str) -> Iterator[Dict[str, Any]]:
+    """逐条读取访问日志（支持 .zst），用于重放或离线分析"""
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("读取压缩日志需要安装 zstandard")
+        with open(path, "rb") as f:
+            reader = io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True), encoding="utf-8")
+            for line in reader:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
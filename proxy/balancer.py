@@ -0,0 +1,285 @@
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import openai
+from loguru import logger
+
+from .breaker import CircuitBreaker, CircuitOpenError
+from .clients import ClientKey, normalize_base_url
+from .config import BreakerConfig, Config, PoolConfig, TimeoutConfig
+from .failover import LatencyWindow
+
+def parse_retry_after(headers: Any) -> Optional[float]:
+    """解析 Retry-After 响应头（秒），无法解析时返回 None"""
+    value = headers.get("retry-after") if headers is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+class Backend:
+    """provider 下的一个上游端点 (url, api_key)，记录并发数、延迟、摘除和熔断状态"""
+
+    def __init__(
+        self,
+        server_alias: str,
+        url: str,
+        api_key: str,
+        weight: int = 1,
+        breaker: Optional[BreakerConfig] = None
+    ):
+        self.server_alias = server_alias
+        self.url = normalize_base_url(url)
+        self.api_key = api_key
+        self.weight = max(weight, 1)
+        self.inflight = 0
+        self.ewma_latency: Optional[float] = None
+        self.ejected_until = 0.0
+        self.current_weight = 0   # 平滑加权轮询的当前权重
+        self.requests = 0
+        self.failures = 0
+        self.breaker = CircuitBreaker(breaker or BreakerConfig())
+        self.connect_latency = LatencyWindow()
+        self.first_byte_latency = LatencyWindow()   # 流式请求的首字节延迟
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return (self.url, self.api_key)
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def timeout(self, pool: PoolConfig, settings: TimeoutConfig) -> httpx.Timeout:
+        """按观测到的连接耗时分位数计算本次请求的连接超时，上限为连接池的静态配置
+
+        读超时对整个响应的每次读取生效（流式响应中两帧之间的间隔也受它约束），保持静态值；
+        流式请求的首字节截止时间见 first_byte_timeout。
+        """
+        connect = pool.connect_timeout
+        if settings.adaptive and len(self.connect_latency.samples) >= settings.min_samples:
+            p = self.connect_latency.percentile(settings.percentile)
+            connect = min(max(p * settings.multiplier, settings.min_connect), pool.connect_timeout)
+        return httpx.Timeout(pool.timeout, connect=connect)
+
+    def first_byte_timeout(self, pool: PoolConfig, settings: TimeoutConfig) -> Optional[float]:
+        """流式请求从发出到收到第一帧的截止时间（秒），样本不足或未开启自适应时返回 None
+
+        非流式请求的首字节就是完整响应，无法单独约束，不使用该值。
+        """
+        if not settings.adaptive or len(self.first_byte_latency.samples) < settings.min_samples:
+            return None
+        p = self.first_byte_latency.percentile(settings.percentile)
+        return min(max(p * settings.multiplier, settings.min_first_byte), pool.timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        connect_p99 = self.connect_latency.percentile(0.99)
+        first_byte_p99 = self.first_byte_latency.percentile(0.99)
+        return {
+            "url": self.url,
+            "weight": self.weight,
+            "inflight": self.inflight,
+            "ewma_latency_ms": round(self.ewma_latency * 1000, 2) if self.ewma_latency is not None else None,
+            "connect_p99_ms": round(connect_p99 * 1000, 2) if connect_p99 is not None else None,
+            "first_byte_p99_ms": round(first_byte_p99 * 1000, 2) if first_byte_p99 is not None else None,
+            "ejected_for": round(self.ejected_until - now, 1) if self.ejected_until > now else 0,
+            "requests": self.requests,
+            "failures": self.failures,
+            "breaker": self.breaker.stats(),
+        }
+
+class BackendLease:
+    """一次请求对某个端点的占用，结束时调用 done() 归还（可重复调用，只生效一次）"""
+
+    def __init__(self, pool: "BackendPool", backend: Backend, probe: bool = False):
+        self.pool = pool
+        self.backend = backend
+        self.probe = probe          # 是否为熔断器半开状态下的探测请求
+        self.start = time.monotonic()
+        self.latency: Optional[float] = None
+        self.streamed = False
+        self._done = False
+
+    def first_byte(self) -> None:
+        """流式响应收到首个数据帧时记录延迟"""
+        if self.latency is None:
+            self.latency = time.monotonic() - self.start
+            self.streamed = True
+
+    def timeout(self, pool: PoolConfig) -> httpx.Timeout:
+        return self.backend.timeout(pool, self.pool.timeouts)
+
+    def first_byte_timeout(self, pool: PoolConfig) -> Optional[float]:
+        return self.backend.first_byte_timeout(pool, self.pool.timeouts)
+
+    def done(self, status: Optional[int] = 200, retry_after: Optional[float] = None) -> None:
+        """status 为 None 表示网络错误或超时"""
+        if self._done:
+            return
+        self._done = True
+        latency = self.latency if self.latency is not None else time.monotonic() - self.start
+        self.pool.release(self, latency, status, retry_after)
+
+    def fail(self, error: Exception) -> None:
+        """按异常类型归还：上游错误状态码和网络错误计入端点统计，其余错误只释放占用"""
+        if isinstance(error, openai.APIStatusError):
+            self.done(error.status_code, parse_retry_after(error.response.headers))
+        elif isinstance(error, (openai.APIConnectionError, httpx.TransportError)):
+            self.done(None)
+        else:
+            self.cancel()
+
+    def cancel(self) -> None:
+        """未实际访问上游时释放占用，不计入统计"""
+        if self._done:
+            return
+        self._done = True
+        self.backend.inflight = max(self.backend.inflight - 1, 0)
+        self.backend.breaker.on_cancel(self.probe)
+
+class BackendPool:
+    """一个 provider 别名下的端点池
+
+    选择策略：
+    - round_robin: 平滑加权轮询
+    - least_outstanding: 进行中请求数 / 权重 最小
+    - ewma: EWMA 延迟 × (进行中请求数 + 1) / 权重 最小
+    返回 429/5xx 或网络错误的端点会被暂时摘除 eject_seconds 秒；
+    5xx 和网络错误同时计入熔断器，熔断中的端点不参与选择，全部熔断时快速失败。
+    """
+
+    def __init__(
+        self,
+        server_alias: str,
+        backends: List[Backend],
+        policy: str = "round_robin",
+        eject_seconds: float = 30.0,
+        ewma_alpha: float = 0.3,
+        timeouts: Optional[TimeoutConfig] = None
+    ):
+        self.server_alias = server_alias
+        self.backends = backends
+        self.policy = policy
+        self.eject_seconds = eject_seconds
+        self.ewma_alpha = ewma_alpha
+        self.timeouts = timeouts or TimeoutConfig()
+
+    def _candidates(self) -> List[Backend]:
+        now = time.monotonic()
+        allowed = [b for b in self.backends if b.breaker.allow(now)]
+        if not allowed:
+            retry_after = min(b.breaker.retry_after(now) for b in self.backends)
+            raise CircuitOpenError(self.server_alias, retry_after)
+        available = [b for b in allowed if b.available(now)]
+        if available:
+            return available
+        # 全部被摘除时选择最早恢复的端点，而不是直接失败
+        return [min(allowed, key=lambda b: b.ejected_until)]
+
+    def pick(self) -> Backend:
+        candidates = self._candidates()
+        if len(candidates) == 1:
+            return candidates[0]
+        if self.policy == "least_outstanding":
+            return min(candidates, key=lambda b: b.inflight / b.weight)
+        if self.policy == "ewma":
+            return min(candidates, key=lambda b: (b.ewma_latency or 0.0) * (b.inflight + 1) / b.weight)
+        total = 0
+        best = None
+        for backend in candidates:
+            backend.current_weight += backend.weight
+            total += backend.weight
+            if best is None or backend.current_weight > best.current_weight:
+                best = backend
+        best.current_weight -= total
+        return best
+
+    def acquire(self) -> BackendLease:
+        backend = self.pick()
+        backend.inflight += 1
+        backend.requests += 1
+        return BackendLease(self, backend, probe=backend.breaker.on_acquire())
+
+    def release(
+        self,
+        lease: BackendLease,
+        latency: float,
+        status: Optional[int],
+        retry_after: Optional[float] = None
+    ) -> None:
+        backend = lease.backend
+        backend.inflight = max(backend.inflight - 1, 0)
+        # 429 说明端点可用只是被限流，不计入熔断
+        backend.breaker.record(status is not None and status < 500, lease.probe)
+        if status is None or status == 429 or status >= 500:
+            backend.failures += 1
+            eject = retry_after if status == 429 and retry_after else self.eject_seconds
+            backend.ejected_until = time.monotonic() + eject
+            logger.warning(f"上游端点 {self.server_alias} {backend.url} 返回 {status or '网络错误'}，暂时摘除 {eject:.0f} 秒")
+            return
+        if backend.ewma_latency is None:
+            backend.ewma_latency = latency
+        else:
+            backend.ewma_latency += self.ewma_alpha * (latency - backend.ewma_latency)
+        if lease.streamed:
+            backend.first_byte_latency.add(latency)
+
+    def stats(self) -> Dict[str, Any]:
+        backends = [b.stats() for b in self.backends]
+        return {
+            "policy": self.policy,
+            # 有端点熔断或被摘除时标记为降级
+            "degraded": any(b["breaker"]["state"] != "closed" or b["ejected_for"] > 0 for b in backends),
+            "backends": backends,
+        }
+
+class LoadBalancer:
+    """按 provider 别名管理端点池"""
+
+    def __init__(self):
+        self.pools: Dict[str, BackendPool] = {}
+        self._by_key: Dict[ClientKey, Backend] = {}
+
+    def configure(self, config: Config) -> None:
+        """根据配置重建端点池，保留未变化端点的统计数据"""
+        old = {
+            (alias, backend.key): backend
+            for alias, pool in self.pools.items() for backend in pool.backends
+        }
+        pools = {}
+        by_key = {}
+        for server_alias, server_config in config.servers.items():
+            backends = []
+            for endpoint in server_config.endpoints():
+                backend = Backend(
+                    server_alias, endpoint.url, endpoint.api_key, endpoint.weight, server_config.breaker
+                )
+                previous = old.get((server_alias, backend.key))
+                if previous is not None:
+                    previous.weight = backend.weight
+                    previous.breaker.settings = server_config.breaker
+                    backend = previous
+                backends.append(backend)
+                by_key[(server_alias, backend.url, backend.api_key)] = backend
+            pools[server_alias] = BackendPool(
+                server_alias,
+                backends,
+                server_config.balance,
+                server_config.eject_seconds,
+                timeouts=server_config.timeouts
+            )
+        self.pools = pools
+        self._by_key = by_key
+
+    def acquire(self, server_alias: str) -> BackendLease:
+        return self.pools[server_alias].acquire()
+
+    def observe_connect(self, key: ClientKey, seconds: float) -> None:
+        """记录新建连接的耗时（由上游客户端的连接跟踪回调调用）"""
+        backend = self._by_key.get(key)
+        if backend is not None:
+            backend.connect_latency.add(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {alias: pool.stats() for alias, pool in self.pools.items()}
@@ -0,0 +1,111 @@
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from .config import BreakerConfig
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """provider 的所有端点熔断器都处于打开状态，快速失败"""
+
+    def __init__(self, server_alias: str, retry_after: float):
+        super().__init__(f"服务器 '{server_alias}' 暂时不可用（熔断中）")
+        self.server_alias = server_alias
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """单个上游端点的熔断器
+
+    - closed: 正常放行，滚动窗口内请求数达到 min_requests 且错误率超过阈值时打开
+    - open: 拒绝请求，open_seconds 后进入半开
+    - half_open: 最多放行 half_open_requests 个探测请求，成功则关闭，失败则重新打开
+    滚动窗口按 buckets 个时间桶统计成功/失败次数。
+    """
+
+    def __init__(self, settings: BreakerConfig):
+        self.settings = settings
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probes = 0
+        self.trips = 0
+        self._buckets: Deque[List[float]] = deque()  # [桶开始时间, 成功数, 失败数]
+
+    def _bucket(self, now: float) -> List[float]:
+        width = self.settings.window / self.settings.buckets
+        if not self._buckets or now - self._buckets[-1][0] >= width:
+            self._buckets.append([now, 0, 0])
+        while self._buckets and now - self._buckets[0][0] >= self.settings.window:
+            self._buckets.popleft()
+        return self._buckets[-1]
+
+    def counts(self, now: Optional[float] = None) -> Dict[str, int]:
+        now = now if now is not None else time.monotonic()
+        live = [b for b in self._buckets if now - b[0] < self.settings.window]
+        return {"success": int(sum(b[1] for b in live)), "failure": int(sum(b[2] for b in live))}
+
+    def allow(self, now: float) -> bool:
+        """是否可以向该端点发送请求（不占用探测名额）"""
+        if not self.settings.enabled:
+            return True
+        if self.state == OPEN:
+            if now - self.opened_at < self.settings.open_seconds:
+                return False
+            self.state = HALF_OPEN
+            self.probes = 0
+        if self.state == HALF_OPEN:
+            return self.probes < self.settings.half_open_requests
+        return True
+
+    def retry_after(self, now: float) -> float:
+        return max(self.opened_at + self.settings.open_seconds - now, 0.0)
+
+    def on_acquire(self) -> bool:
+        """请求发出前调用，返回是否为半开状态下的探测请求"""
+        if self.state == HALF_OPEN:
+            self.probes += 1
+            return True
+        return False
+
+    def on_cancel(self, probe: bool) -> None:
+        """请求未实际完成时归还探测名额"""
+        if probe and self.state == HALF_OPEN:
+            self.probes = max(self.probes - 1, 0)
+
+    def record(self, success: bool, probe: bool = False, now: Optional[float] = None) -> None:
+        now = now if now is not None else time.monotonic()
+        if probe and self.state == HALF_OPEN:
+            self.probes = max(self.probes - 1, 0)
+            if success:
+                self.state = CLOSED
+                self._buckets.clear()
+            else:
+                self._trip(now)
+            return
+        bucket = self._bucket(now)
+        bucket[1 if success else 2] += 1
+        if self.state == CLOSED and not success and self.settings.enabled:
+            counts = self.counts(now)
+            total = counts["success"] + counts["failure"]
+            if total >= self.settings.min_requests and counts["failure"] / total >= self.settings.error_rate:
+                self._trip(now)
+
+    def _trip(self, now: float) -> None:
+        self.state = OPEN
+        self.opened_at = now
+        self.probes = 0
+        self.trips += 1
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        state = self.state
+        if state == OPEN and now - self.opened_at >= self.settings.open_seconds:
+            state = HALF_OPEN
+        return {
+            "state": state,
+            "retry_after": round(self.retry_after(now), 1) if state == OPEN else 0,
+            "trips": self.trips,
+            **self.counts(now),
+        }
@@ -0,0 +1,226 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Set, Tuple
+
+import aiosqlite
+from loguru import logger
+
+from .config import CacheConfig
+
+# 不影响输出内容、不参与缓存键计算的字段
+_KEY_EXCLUDED = frozenset({"model", "stream", "user"})
+
+def cache_key(
+    path: str,
+    server_alias: Optional[str],
+    real_model: str,
+    body: Dict[str, Any],
+    stream: bool,
+    response_model: Optional[str] = None
+) -> str:
+    """按 (provider, 真实模型, 消息和采样参数) 计算规范化的缓存键
+
+    字段按键名排序后序列化，参数顺序不同的等价请求得到相同的键；
+    流式和非流式的响应格式不同，分开缓存。
+    """
+    canonical = {key: value for key, value in body.items() if key not in _KEY_EXCLUDED}
+    payload = json.dumps(
+        [path, server_alias, real_model, stream, response_model, canonical],
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+@dataclass
+class CacheEntry:
+    value: bytes
+    created_at: float   # time.time()
+    expires_at: float
+
+    @property
+    def age(self) -> float:
+        return max(time.time() - self.created_at, 0.0)
+
+class ResponseCache:
+    """精确匹配的响应缓存
+
+    - 内存层：按字节数淘汰的 LRU
+    - 磁盘层：SQLite 文件，内存未命中时查询，命中后提升到内存
+    - 写磁盘在后台任务中进行，不阻塞响应
+    - 非流式缓存响应体，流式缓存完整的 SSE 帧，命中时一次性回放
+    """
+
+    def __init__(self, settings: CacheConfig):
+        self.settings = settings
+        self._memory: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._memory_bytes = 0
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._writes = 0
+        self._pending: Set[asyncio.Task] = set()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.stores = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.settings.enabled
+
+    async def initialize(self) -> None:
+        if not self.settings.enabled or not self.settings.disk_path or self._conn is not None:
+            return
+        self._conn = await aiosqlite.connect(self.settings.disk_path)
+        await self._conn.execute("PRAGMA journal_mode=WAL")
+        await self._conn.execute("PRAGMA synchronous=NORMAL")
+        await self._conn.execute("PRAGMA busy_timeout=5000")
+        await self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        await self._conn.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created_at)")
+        await self._conn.commit()
+        logger.info(f"已启用响应缓存: {self.settings.disk_path}")
+
+    async def close(self) -> None:
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    def _remember(self, key: str, entry: CacheEntry) -> None:
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old.value)
+        self._memory[key] = entry
+        self._memory_bytes += len(entry.value)
+        while self._memory_bytes > self.settings.max_memory_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted.value)
+            self.evictions += 1
+
+    async def get(self, key: str, max_age: Optional[float] = None) -> Optional[CacheEntry]:
+        """查询缓存，max_age 来自客户端的 Cache-Control: max-age"""
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None and now < entry.expires_at:
+            if max_age is None or entry.age <= max_age:
+                self._memory.move_to_end(key)
+                self.hits_memory += 1
+                return entry
+            entry = None
+        elif entry is not None:
+            self._memory_bytes -= len(self._memory.pop(key).value)
+            entry = None
+        if self._conn is not None:
+            try:
+                async with self._conn.execute(
+                    "SELECT value, created_at, expires_at FROM responses WHERE key = ?", (key,)
+                ) as cursor:
+                    row = await cursor.fetchone()
+            except Exception as e:
+                logger.error(f"读取响应缓存失败: {str(e)}")
+                row = None
+            if row is not None and now < row[2]:
+                entry = CacheEntry(value=row[0], created_at=row[1], expires_at=row[2])
+                if max_age is None or entry.age <= max_age:
+                    self._remember(key, entry)
+                    self.hits_disk += 1
+                    return entry
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: bytes) -> None:
+        """写入内存层，并在后台写入磁盘层"""
+        if len(value) > self.settings.max_entry_bytes:
+            return
+        now = time.time()
+        entry = CacheEntry(value=value, created_at=now, expires_at=now + self.settings.ttl)
+        self._remember(key, entry)
+        self.stores += 1
+        if self._conn is not None:
+            task = asyncio.ensure_future(self._store(key, entry))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    async def _store(self, key: str, entry: CacheEntry) -> None:
+        try:
+            await self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, entry.value, entry.created_at, entry.expires_at)
+            )
+            await self._conn.commit()
+            self._writes += 1
+            if self._writes % 100 == 0:
+                await self._trim()
+        except Exception as e:
+            logger.error(f"写入响应缓存失败: {str(e)}")
+
+    async def _trim(self) -> None:
+        """清理过期条目，超出磁盘容量时删除最旧的条目"""
+        await self._conn.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+        async with self._conn.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM responses") as cursor:
+            total = (await cursor.fetchone())[0]
+        if total > self.settings.max_disk_bytes:
+            excess = total - self.settings.max_disk_bytes
+            # 按写入时间从旧到新累加大小，删除累计量达到 excess 之前的条目
+            await self._conn.execute("""
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, SUM(LENGTH(value)) OVER (
+                            ORDER BY created_at ROWS UNBOUNDED PRECEDING
+                        ) - LENGTH(value) AS before
+                        FROM responses
+                    ) WHERE before < ?
+                )
+            """, (excess,))
+        await self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits_memory + self.hits_disk + self.misses
+        return {
+            "enabled": self.settings.enabled,
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_rate": round((self.hits_memory + self.hits_disk) / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+        }
+
+def parse_cache_control(value: Optional[str]) -> Tuple[bool, bool, Optional[float]]:
+    """解析客户端的 Cache-Control，返回 (读缓存, 写缓存, max_age)
+
+    - no-store: 既不读也不写
+    - no-cache: 不读缓存，用上游的新结果刷新缓存
+    - max-age=N: 只接受 N 秒内写入的缓存
+    """
+    if not value:
+        return True, True, None
+    lookup, store, max_age = True, True, None
+    for directive in value.lower().split(","):
+        directive = directive.strip()
+        if directive == "no-store":
+            lookup, store = False, False
+        elif directive == "no-cache":
+            lookup = False
+        elif directive.startswith("max-age="):
+            try:
+                max_age = float(directive[8:])
+            except ValueError:
+                pass
+    return lookup, store, max_age
@@ -0,0 +1,529 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+import httpx
+from loguru import logger
+
+from .clients import UpstreamClientRegistry, normalize_base_url
+from .config import Config, ServerConfig
+from .jsonfast import json_dumps, json_loads
+from .metrics import metrics
+from .state import StateBackend
+
+CACHE_TTL = 300          # 默认缓存时间为5分钟
+ERROR_RETRY_TTL = 30     # 获取失败后的重试间隔
+FETCH_TIMEOUT = 10       # 单个服务器的请求超时
+
+@dataclass
+class ModelListing:
+    """一次获取模型列表的结果"""
+    models: Optional[List[Dict[str, Any]]]  # None 表示上游返回 304，沿用已缓存的列表
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+async def fetch_models_from_server(
+    server_alias: str,
+    server_config: ServerConfig,
+    http: httpx.AsyncClient,
+    etag: Optional[str] = None,
+    last_modified: Optional[str] = None
+) -> ModelListing:
+    """从单个服务器获取模型列表，失败时抛出异常
+
+    传入上次响应的 ETag / Last-Modified 时发送条件请求，列表没有变化时上游返回 304。
+    """
+    logger.debug(f"从服务器 {server_alias} 获取模型列表")
+
+    # 如果设置了 override，直接返回指定的模型列表
+    if server_config.override is not None:
+        return ModelListing([{"id": f"[{server_alias}]{model}"} for model in server_config.override])
+
+    headers = {
+        "Authorization": f"Bearer {server_config.api_key}",
+        "Content-Type": "application/json"
+    }
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    models_url = f"{server_config.url}/models"
+
+    timeout = httpx.Timeout(FETCH_TIMEOUT, connect=min(server_config.pool.connect_timeout, FETCH_TIMEOUT))
+    response = await http.get(models_url, headers=headers, timeout=timeout)
+    if response.status_code == 304 and (etag or last_modified):
+        return ModelListing(None, etag, last_modified)
+    if response.status_code != 200:
+        raise Exception(f"获取模型列表失败: HTTP {response.status_code}, {response.text}")
+    data = json_loads(response.content)
+
+    # 标准OpenAI格式
+    models = data.get("data", []) if isinstance(data, dict) else []
+    if not models and isinstance(data, list):
+        # 某些服务器可能直接返回模型列表
+        models = data
+
+    # 如果模型是字符串，转换为字典
+    models = [
+        {"id": model} if isinstance(model, str) else model
+        for model in models
+        if isinstance(model, str) or isinstance(model, dict) and isinstance(model.get("id"), str)
+    ]
+
+    # 应用过滤器（加载配置时已编译）
+    if server_config.compiled_filter is not None:
+        models = server_config.compiled_filter.apply(models)
+
+    # 为每个模型添加服务器标识
+    processed_models = []
+    for model in models:
+        model["id"] = f"[{server_alias}]{model['id']}"
+        processed_models.append(model)
+
+    # 添加 append 字段中的模型
+    if server_config.append:
+        for model in server_config.append:
+            processed_models.append({"id": f"[{server_alias}]{model}"})
+
+    return ModelListing(
+        processed_models,
+        response.headers.get("etag"),
+        response.headers.get("last-modified")
+    )
+
+ParsedModel = Tuple[Optional[str], Optional[str], str]  # (server_alias, url, real_model)
+
+def split_model_id(model: str) -> Tuple[Optional[str], str]:
+    """拆分 [server_alias]model_name 格式的模型名"""
+    if model.startswith("[") and "]" in model:
+        end = model.index("]")
+        return model[1:end], model[end + 1:]
+    return None, model
+
+class CatalogIndex:
+    """模型 ID 索引，每次目录刷新时重建一次
+
+    - ids: 全部模型 ID 的哈希集合，O(1) 判断模型是否可用
+    - by_alias: 按服务器别名分组的真实模型名
+    - 路由解析 LRU：模型字符串 -> (server_alias, url, real_model)
+    """
+
+    def __init__(
+        self,
+        models: List[Dict[str, Any]],
+        servers: Dict[str, ServerConfig],
+        route_cache_size: int = 1024
+    ):
+        self.ids: FrozenSet[str] = frozenset(m["id"] for m in models)
+        by_alias: Dict[str, set] = {}
+        for model_id in self.ids:
+            server_alias, real_model = split_model_id(model_id)
+            if server_alias is not None:
+                by_alias.setdefault(server_alias, set()).add(real_model)
+        self.by_alias: Dict[str, FrozenSet[str]] = {
+            server_alias: frozenset(names) for server_alias, names in by_alias.items()
+        }
+        self._servers = servers
+        self._route_cache_size = route_cache_size
+        self._routes: "OrderedDict[str, ParsedModel]" = OrderedDict()
+
+    def __contains__(self, model_id: str) -> bool:
+        return model_id in self.ids
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def resolve(self, model: str) -> ParsedModel:
+        """解析模型字符串，未知别名的 url 为 None，结果缓存在 LRU 中"""
+        parsed = self._routes.get(model)
+        metrics.cache_lookup("model", parsed is not None)
+        if parsed is not None:
+            self._routes.move_to_end(model)
+            return parsed
+        server_alias, real_model = split_model_id(model)
+        server_config = self._servers.get(server_alias) if server_alias is not None else None
+        parsed = (server_alias, server_config.url if server_config else None, real_model)
+        self._routes[model] = parsed
+        if len(self._routes) > self._route_cache_size:
+            self._routes.popitem(last=False)
+        return parsed
+
+@dataclass
+class ProviderEntry:
+    """单个服务器的模型列表缓存"""
+    models: List[Dict[str, Any]]
+    fetched_at: float   # time.monotonic()
+    ttl: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    fetched_wall: float = field(default_factory=time.time)  # 写入快照用的墙钟时间
+
+    def is_stale(self, now: float) -> bool:
+        return now - self.fetched_at >= self.ttl
+
+class ModelCatalog:
+    """/v1/models 的模型目录服务
+
+    - single-flight：同一服务器同一时刻最多只有一个刷新任务
+    - stale-while-revalidate：缓存过期后继续返回旧列表，由后台任务刷新
+    - 按服务器设置 TTL，冷启动时最多等待 cold_start_timeout，慢服务器不阻塞其他服务器
+    - 合并后的响应体在每次刷新时序列化一次
+    - 配置共享状态存储后，多个 worker 共用同一份模型列表，每个 TTL 周期内通常只有一个 worker 请求上游
+    - 启用磁盘快照后，启动时同步载入上次的列表，过期的随即在后台用条件请求（ETag / Last-Modified）重新验证
+    """
+
+    def __init__(
+        self,
+        clients: UpstreamClientRegistry,
+        cold_start_timeout: float = FETCH_TIMEOUT
+    ):
+        self.clients = clients
+        self.cold_start_timeout = cold_start_timeout
+        self._servers: Dict[str, ServerConfig] = {}
+        self._virtual_models: List[str] = []
+        self._entries: Dict[str, ProviderEntry] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._models: List[Dict[str, Any]] = []
+        self._payload = b'{"data": [], "object": "list"}'
+        self.index = CatalogIndex([], {})
+        self.state: Optional[StateBackend] = None
+        self.snapshot_path: Optional[str] = None
+        self._snapshot_task: Optional[asyncio.Task] = None
+        self._snapshot_dirty = False
+
+    def use_state(self, state: Optional[StateBackend]) -> None:
+        """使用共享状态存储，仅在跨进程共享时生效"""
+        self.state = state if state is not None and state.shared else None
+
+    def use_snapshot(self, path: Optional[str]) -> int:
+        """启用磁盘快照并同步载入，返回载入的服务器数量，需要在 configure 之后调用
+
+        只载入配置（地址、密钥、过滤规则等）没有变化的服务器；快照缺失或损坏时按冷启动处理。
+        """
+        self.snapshot_path = path or None
+        if self.snapshot_path is None:
+            return 0
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                snapshot = json_loads(f.read())
+            providers = snapshot["providers"]
+            if not isinstance(providers, dict):
+                raise TypeError("providers 不是对象")
+        except FileNotFoundError:
+            return 0
+        except Exception as e:
+            logger.error(f"读取模型目录快照失败: {str(e)}")
+            return 0
+        now, wall = time.monotonic(), time.time()
+        loaded = 0
+        for server_alias, data in providers.items():
+            server_config = self._servers.get(server_alias)
+            if server_config is None or server_alias in self._entries:
+                continue
+            try:
+                entry = self._snapshot_entry(data, server_config, now, wall)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning(f"跳过模型目录快照中 {server_alias} 的无效记录: {str(e)}")
+                continue
+            if entry is not None:
+                self._entries[server_alias] = entry
+                loaded += 1
+        if loaded:
+            self._rebuild()
+        return loaded
+
+    def _snapshot_entry(
+        self, data: Any, server_config: ServerConfig, now: float, wall: float
+    ) -> Optional[ProviderEntry]:
+        """校验并转换快照中的一条记录，配置已变化时返回 None，格式错误时抛出 KeyError / TypeError / ValueError"""
+        if not isinstance(data, dict):
+            raise TypeError("记录不是对象")
+        if data.get("digest") != self._digest(server_config):
+            return None
+        fetched_at = float(data["fetched_at"])
+        models = data["models"]
+        if not isinstance(models, list) or not all(isinstance(m, dict) and isinstance(m.get("id"), str) for m in models):
+            raise ValueError("models 格式错误")
+        ttl = server_config.models_ttl if server_config.models_ttl is not None else CACHE_TTL
+        age = max(wall - fetched_at, 0.0)
+        return ProviderEntry(
+            models=models,
+            fetched_at=now - age,
+            ttl=ttl,
+            etag=data.get("etag"),
+            last_modified=data.get("last_modified"),
+            fetched_wall=fetched_at
+        )
+
+    def revalidate(self) -> int:
+        """在后台刷新已过期的列表（不等待结果），返回启动的刷新数
+
+        启动时载入快照后调用，过期的列表用条件请求重新验证，不必等到第一次请求 /v1/models。
+        """
+        now = time.monotonic()
+        stale = [
+            server_alias for server_alias, entry in self._entries.items()
+            if server_alias in self._servers and entry.is_stale(now)
+        ]
+        for server_alias in stale:
+            self._refresh(server_alias)
+        return len(stale)
+
+    def _schedule_snapshot(self) -> None:
+        """标记快照需要写回，由单个后台任务合并写入"""
+        if self.snapshot_path is None:
+            return
+        self._snapshot_dirty = True
+        if self._snapshot_task is None:
+            self._snapshot_task = asyncio.create_task(self._flush_snapshot())
+
+    async def _flush_snapshot(self) -> None:
+        try:
+            while self._snapshot_dirty:
+                self._snapshot_dirty = False
+                # 各服务器的列表创建后不再修改，浅拷贝即可在线程中编码
+                entries = {
+                    server_alias: (self._digest(self._servers[server_alias]), entry)
+                    for server_alias, entry in self._entries.items() if server_alias in self._servers
+                }
+                await asyncio.to_thread(self._write_snapshot, entries)
+        except Exception as e:
+            logger.error(f"写入模型目录快照失败: {str(e)}")
+        finally:
+            self._snapshot_task = None
+
+    def _write_snapshot(self, entries: Dict[str, Tuple[str, ProviderEntry]]) -> None:
+        snapshot = {
+            "version": 1,
+            "providers": {
+                server_alias: {
+                    "digest": digest,
+                    "fetched_at": entry.fetched_wall,
+                    "etag": entry.etag,
+                    "last_modified": entry.last_modified,
+                    "models": entry.models,
+                }
+                for server_alias, (digest, entry) in entries.items()
+            },
+        }
+        # 多个 worker 可能同时写入，各自使用独立的临时文件再原子替换
+        tmp = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(json_dumps(snapshot))
+        os.replace(tmp, self.snapshot_path)
+
+    @staticmethod
+    def _listing(server_config: ServerConfig) -> Tuple[Any, ...]:
+        """影响模型列表内容的配置项"""
+        return (
+            server_config.url,
+            server_config.api_key,
+            server_config.model_filter,
+            server_config.override,
+            server_config.append,
+            server_config.models_ttl
+        )
+
+    @classmethod
+    def _digest(cls, server_config: ServerConfig) -> str:
+        """影响模型列表内容的配置项的摘要，配置变化后不会载入旧配置下的快照"""
+        return hashlib.sha1(json.dumps(cls._listing(server_config)).encode("utf-8")).hexdigest()[:12]
+
+    def configure(self, config: Config) -> None:
+        """设置服务器列表，移除已删除服务器的缓存
+
+        重新加载配置时，只有地址、密钥、过滤规则等变化的服务器会丢弃缓存并立即重新获取，其他服务器的列表保持不变。
+        """
+        old = self._servers
+        self._servers = dict(config.servers)
+        self._virtual_models = list(config.virtual_models)
+        changed = [
+            server_alias for server_alias, server_config in self._servers.items()
+            if server_alias in old and self._listing(old[server_alias]) != self._listing(server_config)
+        ]
+        for server_alias in list(self._entries):
+            if server_alias not in self._servers or server_alias in changed:
+                del self._entries[server_alias]
+        for server_alias in list(self._inflight):
+            if server_alias not in self._servers or server_alias in changed:
+                # 旧配置下的刷新结果作废，由 _fetch 丢弃
+                del self._inflight[server_alias]
+        self._rebuild()
+        for server_alias in changed:
+            self._refresh(server_alias)
+
+    @property
+    def models(self) -> List[Dict[str, Any]]:
+        """当前缓存的合并模型列表（不触发刷新）"""
+        return self._models
+
+    def _refresh(self, server_alias: str) -> asyncio.Task:
+        """启动（或复用正在进行的）刷新任务"""
+        task = self._inflight.get(server_alias)
+        if task is None:
+            task = asyncio.create_task(self._fetch(server_alias))
+            self._inflight[server_alias] = task
+
+            def done(finished: asyncio.Task) -> None:
+                if self._inflight.get(server_alias) is finished:
+                    del self._inflight[server_alias]
+
+            task.add_done_callback(done)
+        return task
+
+    async def _fetch(self, server_alias: str) -> None:
+        server_config = self._servers.get(server_alias)
+        if server_config is None:
+            return
+        ttl = server_config.models_ttl if server_config.models_ttl is not None else CACHE_TTL
+        upstream = self.clients.get(
+            server_alias, normalize_base_url(server_config.url), server_config.api_key
+        )
+        old = self._entries.get(server_alias)
+        failed = False
+        try:
+            entry = await self._load_shared(server_alias, server_config, ttl)
+            if entry is None:
+                listing = await fetch_models_from_server(
+                    server_alias,
+                    server_config,
+                    upstream.http,
+                    etag=old.etag if old else None,
+                    last_modified=old.last_modified if old else None
+                )
+                entry = ProviderEntry(
+                    models=listing.models if listing.models is not None else old.models,
+                    fetched_at=time.monotonic(),
+                    ttl=ttl,
+                    etag=listing.etag,
+                    last_modified=listing.last_modified
+                )
+                await self._store_shared(server_alias, server_config, entry)
+        except httpx.TimeoutException:
+            logger.error(f"从服务器 {server_alias} 获取模型列表超时")
+            entry = self._failed_entry(server_alias)
+            failed = True
+        except httpx.HTTPError as e:
+            logger.error(f"从服务器 {server_alias} 获取模型列表网络错误: {str(e)}")
+            entry = self._failed_entry(server_alias)
+            failed = True
+        except Exception as e:
+            logger.error(f"从服务器 {server_alias} 获取模型列表失败: {str(e)}")
+            entry = self._failed_entry(server_alias)
+            failed = True
+        # 刷新期间服务器可能已被移除，或者配置已重新加载
+        current = self._servers.get(server_alias)
+        if current is not None and self._listing(current) == self._listing(server_config):
+            self._entries[server_alias] = entry
+            self._rebuild()
+            if not failed:
+                self._schedule_snapshot()
+
+    @staticmethod
+    def _shared_key(server_alias: str, server_config: ServerConfig) -> str:
+        """共享存储的键，包含配置摘要，配置变化后不会读到旧配置下的列表"""
+        digest = hashlib.sha1(server_config.model_dump_json().encode("utf-8")).hexdigest()[:12]
+        return f"catalog:{server_alias}:{digest}"
+
+    async def _load_shared(
+        self, server_alias: str, server_config: ServerConfig, ttl: float
+    ) -> Optional[ProviderEntry]:
+        """从共享存储读取其他 worker 获取的未过期列表"""
+        if self.state is None:
+            return None
+        try:
+            value = await self.state.get(self._shared_key(server_alias, server_config))
+        except Exception as e:
+            logger.error(f"读取共享模型列表失败: {str(e)}")
+            return None
+        if value is None:
+            return None
+        data = json_loads(value)
+        age = time.time() - data["fetched_at"]
+        if age >= ttl:
+            return None
+        return ProviderEntry(
+            models=data["models"],
+            fetched_at=time.monotonic() - age,
+            ttl=ttl,
+            etag=data.get("etag"),
+            last_modified=data.get("last_modified"),
+            fetched_wall=data["fetched_at"]
+        )
+
+    async def _store_shared(
+        self, server_alias: str, server_config: ServerConfig, entry: ProviderEntry
+    ) -> None:
+        if self.state is None:
+            return
+        value = json_dumps({
+            "models": entry.models,
+            "fetched_at": entry.fetched_wall,
+            "etag": entry.etag,
+            "last_modified": entry.last_modified
+        })
+        try:
+            await self.state.set(self._shared_key(server_alias, server_config), value, ttl=entry.ttl)
+        except Exception as e:
+            logger.error(f"写入共享模型列表失败: {str(e)}")
+
+    def _failed_entry(self, server_alias: str) -> ProviderEntry:
+        """获取失败时保留旧列表（包括从快照载入的），并在 ERROR_RETRY_TTL 后重试"""
+        old = self._entries.get(server_alias)
+        if old is None:
+            return ProviderEntry(models=[], fetched_at=time.monotonic(), ttl=ERROR_RETRY_TTL)
+        return ProviderEntry(
+            models=old.models,
+            fetched_at=time.monotonic(),
+            ttl=ERROR_RETRY_TTL,
+            etag=old.etag,
+            last_modified=old.last_modified,
+            fetched_wall=old.fetched_wall
+        )
+
+    def _rebuild(self) -> None:
+        """按配置顺序合并各服务器的模型列表并预先序列化"""
+        models = []
+        for server_alias in self._servers:
+            entry = self._entries.get(server_alias)
+            if entry:
+                models.extend(entry.models)
+        # 虚拟模型排在最后，可以像普通模型一样使用和设为 bypass
+        models.extend({"id": model_id, "object": "model", "owned_by": "virtual"} for model_id in self._virtual_models)
+        self._models = models
+        self._payload = json_dumps({"data": models, "object": "list"})
+        self.index = CatalogIndex(models, self._servers)
+
+    async def refresh(self) -> None:
+        """检查所有服务器的缓存：缺失的等待获取，过期的在后台刷新"""
+        now = time.monotonic()
+        cold = []
+        for server_alias in self._servers:
+            entry = self._entries.get(server_alias)
+            if entry is None:
+                cold.append(self._refresh(server_alias))
+            elif entry.is_stale(now):
+                self._refresh(server_alias)
+        if cold:
+            # 只等待有限时间，超时的服务器在后台继续获取
+            await asyncio.wait(cold, timeout=self.cold_start_timeout)
+
+    async def get_payload(self) -> bytes:
+        """返回预先序列化的 /v1/models 响应体"""
+        await self.refresh()
+        return self._payload
+
+    async def get_models(self) -> List[Dict[str, Any]]:
+        """返回合并后的模型列表"""
+        await self.refresh()
+        return self._models
+
+    async def get_index(self) -> CatalogIndex:
+        """返回模型 ID 索引"""
+        await self.refresh()
+        return self.index
@@ -0,0 +1,255 @@
+import asyncio
+import importlib.util
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+import httpx
+import openai
+from loguru import logger
+
+from .config import Config, PoolConfig
+
+# h2 为可选依赖，未安装时退回 HTTP/1.1
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+ClientKey = Tuple[Optional[str], str, str]  # (server_alias, base_url, api_key)
+
+# 移除的客户端（重新加载配置或超出按需客户端上限）最多等待这么久让进行中的请求（包括长时间的流式响应）结束
+DRAIN_TIMEOUT = 600.0
+DRAIN_CHECK_INTERVAL = 1.0
+
+def normalize_base_url(url: str) -> str:
+    """统一上游地址格式，保证以 /v1 结尾"""
+    if not url.endswith("/v1"):
+        url = f"{url.rstrip('/')}/v1"
+    return url
+
+@dataclass
+class UpstreamClient:
+    """一个上游端点对应的复用客户端"""
+    key: ClientKey
+    http: "TrackedAsyncClient"
+    sdk: "openai.AsyncOpenAI"
+    static: bool                      # 是否由配置文件在启动时创建
+    pool: Optional[PoolConfig] = None
+    last_used: float = field(default_factory=time.monotonic)
+    _no_retry: Optional["openai.AsyncOpenAI"] = field(default=None, repr=False)
+
+    @property
+    def base_url(self) -> str:
+        return self.key[1]
+
+    @property
+    def api_key(self) -> str:
+        return self.key[2]
+
+    @property
+    def sdk_no_retry(self) -> "openai.AsyncOpenAI":
+        """不在 SDK 内部重试的客户端，用于由故障转移链负责重试的请求"""
+        if self._no_retry is None:
+            self._no_retry = self.sdk.with_options(max_retries=0)
+        return self._no_retry
+
+class _TrackedStream(httpx.AsyncByteStream):
+    """包装响应体，关闭时把请求计为结束"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, client: "TrackedAsyncClient"):
+        self._stream = stream
+        self._client = client
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._client.inflight -= 1
+        await self._stream.aclose()
+
+class TrackedAsyncClient(httpx.AsyncClient):
+    """记录进行中请求数的 httpx 客户端，流式响应在响应体关闭后才计为结束"""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.inflight = 0
+
+    async def send(self, request: httpx.Request, *, stream: bool = False, **kwargs: Any) -> httpx.Response:
+        self.inflight += 1
+        try:
+            response = await super().send(request, stream=stream, **kwargs)
+        except BaseException:
+            self.inflight -= 1
+            raise
+        if stream:
+            response.stream = _TrackedStream(response.stream, self)
+        else:
+            self.inflight -= 1
+        return response
+
+def _build_http_client(pool: PoolConfig) -> TrackedAsyncClient:
+    """按连接池配置创建 httpx 客户端"""
+    return TrackedAsyncClient(
+        http2=pool.http2 and HTTP2_AVAILABLE,
+        limits=httpx.Limits(
+            max_connections=pool.max_connections,
+            max_keepalive_connections=pool.max_keepalive_connections,
+            keepalive_expiry=pool.keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(pool.timeout, connect=pool.connect_timeout),
+    )
+
+class UpstreamClientRegistry:
+    """上游客户端注册表
+
+    以 (server_alias, base_url, api_key) 为键复用连接池：
+    - 配置文件中的 provider 在启动时创建，常驻内存
+    - proxy 模式的地址按需创建，空闲超时或超出数量上限时回收
+    """
+
+    def __init__(
+        self,
+        idle_ttl: float = 300.0,
+        max_dynamic_clients: int = 64,
+        on_connect: Optional[Callable[[ClientKey, float], None]] = None
+    ):
+        self.idle_ttl = idle_ttl
+        self.max_dynamic_clients = max_dynamic_clients
+        # 新建连接（TCP + TLS）完成时回调，用于统计连接耗时
+        self.on_connect = on_connect
+        self._static: Dict[ClientKey, UpstreamClient] = {}
+        self._dynamic: "OrderedDict[ClientKey, UpstreamClient]" = OrderedDict()
+        self._proxy_pool = PoolConfig()
+        self._evict_task: Optional[asyncio.Task] = None
+        self._draining: Set[asyncio.Task] = set()
+
+    def build(self, config: Config) -> None:
+        """根据配置文件创建各 provider 的客户端
+
+        重新加载配置时调用同一方法：端点和连接池配置都没变的客户端原样保留，
+        新增的端点创建客户端，移除（或连接池配置变化）的客户端在进行中的请求结束后关闭。
+        """
+        self._proxy_pool = config.proxy_pool
+        static: Dict[ClientKey, UpstreamClient] = {}
+        for server_alias, server_config in config.servers.items():
+            for endpoint in server_config.endpoints():
+                key = (server_alias, normalize_base_url(endpoint.url), endpoint.api_key)
+                client = static.get(key) or self._static.get(key)
+                if client is None or client.pool != server_config.pool:
+                    client = self._create(key, server_config.pool, static=True)
+                static[key] = client
+        created = sum(1 for key, client in static.items() if self._static.get(key) is not client)
+        retired = [client for key, client in self._static.items() if static.get(key) is not client]
+        self._static = static
+        for client in retired:
+            self._drain(client)
+        logger.info(
+            f"已创建上游客户端: {created} 个，保留 {len(static) - created} 个，"
+            f"待关闭 {len(retired)} 个 (HTTP/2: {HTTP2_AVAILABLE})"
+        )
+
+    def _drain(self, client: UpstreamClient) -> None:
+        """等待客户端上进行中的请求结束后关闭，最多等待 DRAIN_TIMEOUT"""
+        async def drain():
+            deadline = time.monotonic() + DRAIN_TIMEOUT
+            try:
+                while client.http.inflight > 0 and time.monotonic() < deadline:
+                    await asyncio.sleep(DRAIN_CHECK_INTERVAL)
+            finally:
+                await client.http.aclose()
+                logger.debug(f"已关闭移除的上游客户端: {client.key[0]} {client.base_url}")
+
+        task = asyncio.create_task(drain())
+        self._draining.add(task)
+        task.add_done_callback(self._draining.discard)
+
+    def _connect_tracer(self, key: ClientKey) -> Callable[[httpx.Request], Any]:
+        """给请求挂上 httpcore 的 trace 回调，只有新建连接时才会记录耗时"""
+        async def on_request(request: httpx.Request) -> None:
+            started = None
+            secure = request.url.scheme == "https"
+
+            async def trace(event: str, info: Dict[str, Any]) -> None:
+                nonlocal started
+                if event == "connection.connect_tcp.started":
+                    started = time.monotonic()
+                elif started is not None and event == (
+                    "connection.start_tls.complete" if secure else "connection.connect_tcp.complete"
+                ):
+                    self.on_connect(key, time.monotonic() - started)
+                    started = None
+
+            request.extensions["trace"] = trace
+        return on_request
+
+    def _create(self, key: ClientKey, pool: PoolConfig, static: bool) -> UpstreamClient:
+        http = _build_http_client(pool)
+        if static and self.on_connect is not None:
+            http.event_hooks["request"].append(self._connect_tracer(key))
+        sdk = openai.AsyncOpenAI(api_key=key[2], base_url=key[1], http_client=http)
+        return UpstreamClient(key=key, http=http, sdk=sdk, static=static, pool=pool if static else None)
+
+    def get(self, server_alias: Optional[str], base_url: str, api_key: str) -> UpstreamClient:
+        """获取（必要时创建）上游客户端"""
+        key = (server_alias, base_url, api_key)
+        client = self._static.get(key)
+        if client is None:
+            client = self._dynamic.get(key)
+            if client is None:
+                client = self._create(key, self._proxy_pool, static=False)
+                self._dynamic[key] = client
+                self._trim()
+            else:
+                self._dynamic.move_to_end(key)
+        client.last_used = time.monotonic()
+        return client
+
+    def _trim(self) -> None:
+        """超出数量上限时移除最久未使用的按需客户端，进行中的请求结束后再关闭"""
+        while len(self._dynamic) > self.max_dynamic_clients:
+            _, client = self._dynamic.popitem(last=False)
+            self._drain(client)
+
+    async def evict_idle(self) -> int:
+        """关闭空闲超时且没有进行中请求的按需客户端，返回回收数量"""
+        deadline = time.monotonic() - self.idle_ttl
+        expired = [
+            key for key, client in self._dynamic.items()
+            if client.last_used < deadline and client.http.inflight == 0
+        ]
+        for key in expired:
+            client = self._dynamic.pop(key)
+            await client.http.aclose()
+        if expired:
+            logger.debug(f"回收空闲上游客户端: {len(expired)} 个")
+        return len(expired)
+
+    async def _evict_loop(self) -> None:
+        while True:
+            await asyncio.sleep(max(self.idle_ttl / 2, 1.0))
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                logger.error(f"回收空闲上游客户端失败: {str(e)}")
+
+    def start(self) -> None:
+        """启动后台空闲回收任务"""
+        if self._evict_task is None:
+            self._evict_task = asyncio.create_task(self._evict_loop())
+
+    async def aclose(self) -> None:
+        """关闭所有客户端，在服务关闭时调用"""
+        if self._evict_task is not None:
+            self._evict_task.cancel()
+            self._evict_task = None
+        draining = list(self._draining)
+        for task in draining:
+            task.cancel()
+        await asyncio.gather(*draining, return_exceptions=True)
+        clients = list(self._static.values()) + list(self._dynamic.values())
+        self._static.clear()
+        self._dynamic.clear()
+        await asyncio.gather(*(c.http.aclose() for c in clients), return_exceptions=True)
@@ -0,0 +1,151 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+from loguru import logger
+
+from .config import CoalesceConfig
+
+class StreamBroadcaster:
+    """把一个流式响应分发给多个订阅者
+
+    后台任务从上游读取数据块并保存在缓冲区中，后加入的订阅者先收到已发送的数据块再跟上实时进度。
+    所有订阅者都断开时停止读取上游。
+    """
+
+    def __init__(self, source: AsyncIterator[Any], on_done: Optional[Callable[[], None]] = None):
+        self._source = source
+        self._on_done = on_done
+        self.chunks: List[Any] = []
+        self.size = 0
+        self.done = False
+        self._changed = asyncio.Event()
+        self._subscribers = 0
+        self._task = asyncio.ensure_future(self._pump())
+
+    async def _pump(self) -> None:
+        try:
+            async for chunk in self._source:
+                self.chunks.append(chunk)
+                self.size += len(chunk)
+                self._notify()
+        except Exception as e:
+            logger.error(f"合并的流式响应读取失败: {str(e)}")
+        finally:
+            self.done = True
+            self._notify()
+            if self._on_done is not None:
+                self._on_done()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        self._subscribers += 1
+        i = 0
+        try:
+            while True:
+                changed = self._changed
+                while i < len(self.chunks):
+                    yield self.chunks[i]
+                    i += 1
+                if self.done:
+                    return
+                await changed.wait()
+        finally:
+            self._subscribers -= 1
+            if self._subscribers == 0 and not self.done:
+                self._task.cancel()
+
+class _Flight:
+    """一个正在进行的上游请求"""
+
+    def __init__(self, task: "asyncio.Task[Response]"):
+        self.task = task
+        self.waiters = 0
+        self.broadcaster: Optional[StreamBroadcaster] = None
+
+class RequestCoalescer:
+    """合并相同的进行中请求
+
+    相同键的请求已经在等待上游时，后来的请求不再访问上游，而是共享同一个结果：
+    非流式响应复制响应体，流式响应订阅同一个 StreamBroadcaster。
+    上游请求在独立的任务中执行，只有所有等待者都取消时才会被取消。
+    """
+
+    def __init__(self, settings: CoalesceConfig):
+        self.settings = settings
+        self._flights: Dict[str, _Flight] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.settings.enabled
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def _lead(self, key: str, flight: _Flight, call: Callable[[], Awaitable[Response]]) -> Response:
+        try:
+            response = await call()
+        except BaseException:
+            self._forget(key, flight)
+            raise
+        if isinstance(response, StreamingResponse):
+            # 流结束前后来的请求仍可加入，从缓冲区回放已发送的部分
+            flight.broadcaster = StreamBroadcaster(
+                response.body_iterator, lambda: self._forget(key, flight)
+            )
+        else:
+            self._forget(key, flight)
+        return response
+
+    async def run(self, key: str, call: Callable[[], Awaitable[Response]]) -> Response:
+        """执行或加入 key 对应的请求，返回本次调用方自己的响应对象"""
+        flight = self._flights.get(key)
+        leader = flight is None
+        if flight is not None and flight.broadcaster is not None \
+                and flight.broadcaster.size > self.settings.max_buffer_bytes:
+            # 缓冲过大的流不再接受新的订阅者
+            self._forget(key, flight)
+            flight, leader = None, True
+        if leader:
+            flight = _Flight(None)
+            flight.task = asyncio.ensure_future(self._lead(key, flight, call))
+            self._flights[key] = flight
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        flight.waiters += 1
+        try:
+            response = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+        return self._copy(response, flight.broadcaster, follower=not leader)
+
+    @staticmethod
+    def _copy(response: Response, broadcaster: Optional[StreamBroadcaster], follower: bool) -> Response:
+        headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+        if follower:
+            headers["X-Coalesced"] = "true"
+        if broadcaster is not None:
+            return StreamingResponse(
+                broadcaster.subscribe(), status_code=response.status_code, headers=headers
+            )
+        return Response(content=response.body, status_code=response.status_code, headers=headers)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.settings.enabled,
+            "inflight": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
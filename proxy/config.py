@@ -0,0 +1,187 @@
+from typing import Optional, Dict, List, Literal
+from pydantic import BaseModel, Field, PrivateAttr, model_validator
+from loguru import logger
+import yaml
+
+from .filters import ModelFilter
+
+class PoolConfig(BaseModel):
+    """上游连接池配置，可按 provider 单独设置"""
+    max_connections: int = 100           # 最大连接数
+    max_keepalive_connections: int = 20  # 最大保活连接数
+    keepalive_expiry: float = 30.0       # 空闲保活连接的过期时间（秒）
+    http2: bool = True                   # 上游支持时启用 HTTP/2
+    connect_timeout: float = 10.0        # 建立连接超时（秒）
+    timeout: float = 600.0               # 读写超时（秒）
+
+class TracingConfig(BaseModel):
+    """Langfuse 追踪导出配置"""
+    enabled: bool = True
+    queue_size: int = 10000                    # 内存队列容量
+    batch_size: int = 100                      # 每批上传的记录数
+    flush_interval: float = 2.0                # 最长攒批时间（秒）
+    overflow: Literal["drop", "spill"] = "drop"  # 队列满或上传失败时：丢弃 / 写入磁盘
+    spill_path: str = "traces_spill.jsonl"
+    timeout: float = 10.0                      # 上传请求超时（秒）
+    disabled_users: List[str] = Field(default_factory=list)  # 不追踪的用户
+
+class AccessLogConfig(BaseModel):
+    """结构化访问日志配置"""
+    enabled: bool = True
+    path: str = "access_log.jsonl"
+    # 请求/响应载荷：full 完整记录（可重放）、truncate 截断、hash 只记录摘要、none 不记录
+    payload: Literal["full", "truncate", "hash", "none"] = "truncate"
+    max_payload_bytes: int = 4096
+    sample_rate: float = 1.0                                           # 全局采样率
+    provider_sample_rates: Dict[str, float] = Field(default_factory=dict)
+    user_sample_rates: Dict[str, float] = Field(default_factory=dict)  # 优先级最高
+    compress: bool = False                                             # zstd 压缩，需要 zstandard
+    rotate_bytes: int = 50 * 1024 * 1024                               # 按大小轮转
+    queue_size: int = 10000
+
+class CacheConfig(BaseModel):
+    """精确匹配的响应缓存配置（默认关闭）"""
+    enabled: bool = False
+    deterministic_only: bool = True                # 只缓存 temperature 为 0 的请求
+    ttl: float = 86400.0                           # 缓存有效期（秒）
+    max_memory_bytes: int = 64 * 1024 * 1024       # 内存 LRU 按字节数淘汰
+    max_entry_bytes: int = 4 * 1024 * 1024         # 超过该大小的响应不缓存
+    disk_path: Optional[str] = "response_cache.db"  # SQLite 磁盘层，为空时只用内存
+    max_disk_bytes: int = 1024 * 1024 * 1024
+
+class CoalesceConfig(BaseModel):
+    """合并相同的进行中请求（默认关闭）"""
+    enabled: bool = False
+    deterministic_only: bool = True                # 只合并 temperature 为 0 的请求
+    max_buffer_bytes: int = 4 * 1024 * 1024        # 流式响应缓冲超过该大小后不再接受新的订阅者
+
+class BreakerConfig(BaseModel):
+    """端点熔断器配置"""
+    enabled: bool = True
+    window: float = 60.0            # 滚动统计窗口（秒）
+    buckets: int = 10               # 窗口内的时间桶数量
+    min_requests: int = 10          # 窗口内请求数不足时不熔断
+    error_rate: float = 0.5         # 错误率达到该值时打开
+    open_seconds: float = 30.0      # 打开后多久进入半开
+    half_open_requests: int = 1     # 半开状态下同时放行的探测请求数
+
+class TimeoutConfig(BaseModel):
+    """自适应超时：按端点观测到的延迟分位数调整连接超时和流式首字节超时，上限为 pool 中的静态超时"""
+    adaptive: bool = True
+    percentile: float = 0.99
+    multiplier: float = 3.0         # 超时 = 分位数 × multiplier
+    min_samples: int = 20           # 样本不足时使用静态超时
+    min_connect: float = 0.5
+    min_first_byte: float = 5.0
+
+class EmbeddingBatchConfig(BaseModel):
+    """embeddings 微批处理：短时间窗口内的小请求合并为一次上游调用"""
+    enabled: bool = False
+    window_ms: float = 5.0          # 合并窗口（毫秒）
+    max_batch_size: int = 64        # 每次上游调用最多的输入条数
+
+class BackendConfig(BaseModel):
+    """provider 下的一个上游端点"""
+    url: str
+    api_key: str
+    weight: int = 1
+
+class ServerConfig(BaseModel):
+    # 单端点写法；配置了 backends 时可省略，默认取第一个端点（用于获取模型列表）
+    url: Optional[str] = None
+    api_key: Optional[str] = None
+    # 多端点 / 多密钥负载均衡
+    backends: List[BackendConfig] = Field(default_factory=list)
+    # 端点选择策略：加权轮询 / 最少进行中请求 / EWMA 延迟
+    balance: Literal["round_robin", "least_outstanding", "ewma"] = "round_robin"
+    # 端点返回 429/5xx 或网络错误后暂时摘除的时间（秒）
+    eject_seconds: float = 30.0
+    breaker: BreakerConfig = Field(default_factory=BreakerConfig)
+    timeouts: TimeoutConfig = Field(default_factory=TimeoutConfig)
+    model_filter: Optional[str] = Field(None, alias='filter')
+    override: Optional[List[str]] = None
+    append: Optional[List[str]] = None
+    pool: PoolConfig = Field(default_factory=PoolConfig)
+    # 模型列表缓存时间（秒），默认 300
+    models_ttl: Optional[float] = None
+    # 流式响应模式：sdk 逐块解析再序列化；raw 原样转发上游 SSE 字节帧
+    stream_mode: Literal["sdk", "raw"] = "sdk"
+    # raw 模式下把帧中的 model 字段改写为客户端请求的模型名
+    rewrite_model: bool = False
+    # 是否把该 provider 的请求导出到 Langfuse
+    tracing: bool = True
+    # 全局启用响应缓存时，该 provider 是否参与缓存
+    cache: bool = True
+    embedding_batch: EmbeddingBatchConfig = Field(default_factory=EmbeddingBatchConfig)
+    # 加载配置时由 filter 编译得到的过滤器
+    _filter: Optional[ModelFilter] = PrivateAttr(default=None)
+
+    @model_validator(mode="after")
+    def _compile_filter(self) -> "ServerConfig":
+        self._filter = ModelFilter(self.model_filter) if self.model_filter and self.model_filter.strip() else None
+        return self
+
+    @property
+    def compiled_filter(self) -> Optional[ModelFilter]:
+        return self._filter
+
+    @model_validator(mode="after")
+    def _check_endpoints(self) -> "ServerConfig":
+        if self.backends:
+            if self.url is None:
+                self.url = self.backends[0].url
+            if self.api_key is None:
+                self.api_key = self.backends[0].api_key
+        elif self.url is None or self.api_key is None:
+            raise ValueError("需要配置 url 和 api_key，或者配置 backends")
+        return self
+
+    def endpoints(self) -> List[BackendConfig]:
+        """该 provider 的全部上游端点"""
+        return self.backends or [BackendConfig(url=self.url, api_key=self.api_key)]
+
+class VirtualModelConfig(BaseModel):
+    """虚拟模型：按顺序尝试一组真实模型，上游超时、429 或 5xx 时转到下一个"""
+    targets: List[str]                     # [server_alias]model_name 列表
+    max_attempts: Optional[int] = None     # 最多尝试次数，默认等于 targets 数量，超出时循环使用
+    backoff: float = 0.1                   # 重试退避基数（秒），按指数增长并加随机抖动
+    max_backoff: float = 2.0
+    # 非流式请求：第一个目标超过对冲延迟仍未返回时，向下一个目标并发发出请求，先返回者胜出
+    hedge: bool = False
+    hedge_percentile: float = 0.95         # 对冲延迟取该目标历史延迟的分位数
+    hedge_delay: float = 2.0               # 样本不足时使用的对冲延迟（秒）
+    hedge_min_delay: float = 0.2
+
+class Config(BaseModel):
+    servers: Dict[str, ServerConfig]
+    # 虚拟模型，键为客户端使用的模型名，如 [fast]chat
+    virtual_models: Dict[str, VirtualModelConfig] = Field(default_factory=dict)
+    # proxy 模式下按需创建的客户端使用的连接池配置
+    proxy_pool: PoolConfig = Field(default_factory=PoolConfig)
+    tracing: TracingConfig = Field(default_factory=TracingConfig)
+    access_log: AccessLogConfig = Field(default_factory=AccessLogConfig)
+    cache: CacheConfig = Field(default_factory=CacheConfig)
+    coalesce: CoalesceConfig = Field(default_factory=CoalesceConfig)
+
+    @model_validator(mode="after")
+    def _check_virtual_models(self) -> "Config":
+        for name, virtual in self.virtual_models.items():
+            if not virtual.targets:
+                raise ValueError(f"虚拟模型 {name} 没有配置 targets")
+            for target in virtual.targets:
+                if not target.startswith("[") or "]" not in target:
+                    raise ValueError(f"虚拟模型 {name} 的目标 {target} 不是 [server_alias]model_name 格式")
+                server_alias = target[1:target.index("]")]
+                if server_alias not in self.servers:
+                    raise ValueError(f"虚拟模型 {name} 的目标 {target} 引用了未配置的服务器 {server_alias}")
+        return self
+
+def load_config(config_path: str = "config.yaml") -> Config:
+    """加载YAML配置文件"""
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config_data = yaml.safe_load(f)
+            return Config(**config_data)
+    except Exception as e:
+        logger.error(f"加载配置文件失败: {str(e)}")
+        raise
@@ -0,0 +1,174 @@
+import copy
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import Request
+
+from .jsonfast import json_dumps, json_loads
+
+# 扫描 JSON 顶层字段用：字符串（循环展开写法）或括号
+_TOKEN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\]]')
+_COLON = re.compile(rb'\s*:\s*')
+_SCALAR = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|true|false|null|-?[0-9][0-9.eE+-]*')
+
+def scan_top_level(raw: bytes, keys: Tuple[bytes, ...]) -> Dict[bytes, Tuple[int, int]]:
+    """在不解码整个请求体的情况下定位顶层标量字段
+
+    返回 {字段名: (值起始偏移, 值结束偏移)}，只识别字符串/布尔/数字/null 类型的值，
+    找齐所有字段后立即停止扫描。
+    """
+    wanted = {b'"' + key + b'"': key for key in keys}
+    found: Dict[bytes, Tuple[int, int]] = {}
+    depth = 0
+    for match in _TOKEN.finditer(raw):
+        token = match.group()
+        if token == b"{" or token == b"[":
+            depth += 1
+        elif token == b"}" or token == b"]":
+            depth -= 1
+        elif depth == 1 and token in wanted:
+            colon = _COLON.match(raw, match.end())
+            if colon is None:
+                continue
+            value = _SCALAR.match(raw, colon.end())
+            if value is not None:
+                found[wanted[token]] = (value.start(), value.end())
+                if len(found) == len(wanted):
+                    break
+    return found
+
+@dataclass
+class Route:
+    """解析后的路由结果"""
+    target_url: str
+    server_alias: Optional[str]
+    real_model: str
+
+class RequestContext:
+    """单次请求的上下文，在认证、bypass、路由、代理之间传递
+
+    - raw: 原始请求体字节，只读取一次
+    - body: 按需解码的请求体，整个请求生命周期内最多解码一次
+    - route: 路由结果
+    只改动 model 字段时，直接在原始字节上替换 model 的值转发给上游。
+    """
+
+    def __init__(self, request: Request):
+        self.request = request
+        self.user = None
+        self.route: Optional[Route] = None
+        self.raw = b""
+        self._body: Optional[Dict[str, Any]] = None
+        self._fields: Optional[Dict[bytes, Tuple[int, int]]] = None
+        self._model: Optional[str] = None
+        self._dirty = False
+        # 上游返回的 token 用量，with_route 复制出的上下文共用同一个字典
+        self.usage: Dict[str, Any] = {}
+        # 各阶段耗时（秒），同样由复制出的上下文共用
+        self.timings: Dict[str, float] = {}
+        # 流式响应中途出错时置为 True，这样的响应不写入缓存
+        self.failed = False
+        # 合并了多个调用方的请求，用量和访问日志由各调用方分别记录
+        self.merged = False
+
+    def with_route(self, route: Route) -> "RequestContext":
+        """复制上下文并替换路由，故障转移和对冲请求的每次尝试各用一份"""
+        attempt = copy.copy(self)
+        attempt.route = route
+        return attempt
+
+    def with_body(self, body: Dict[str, Any]) -> "RequestContext":
+        """复制上下文并替换整个请求体，不影响原上下文，用于合并多个调用方的请求后发给上游
+
+        合并后的请求不属于任何一个调用方，不带用户信息。
+        """
+        copied = copy.copy(self)
+        copied.user = None
+        copied._body = body
+        copied._model = None
+        copied._dirty = True
+        copied.usage = {}
+        copied.timings = {}
+        copied.failed = False
+        copied.merged = True
+        return copied
+
+    def span(self, name: str, start: float) -> None:
+        """把从 start（perf_counter）到现在的耗时累加到 timings[name]"""
+        self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    async def read_body(self) -> None:
+        """读取原始请求体"""
+        self.raw = await self.request.body()
+
+    @property
+    def username(self) -> str:
+        return self.user.username if self.user else "anonymous"
+
+    @property
+    def body(self) -> Dict[str, Any]:
+        """解码后的请求体，首次访问时才解码"""
+        if self._body is None:
+            self._body = json_loads(self.raw)
+            if self._model is not None:
+                self._body["model"] = self._model
+        return self._body
+
+    def _field(self, key: bytes) -> Any:
+        if self._body is not None:
+            return self._body.get(key.decode())
+        if self._fields is None:
+            self._fields = scan_top_level(self.raw, (b"model", b"stream"))
+        span = self._fields.get(key)
+        if span is None:
+            return None
+        return json_loads(self.raw[span[0]:span[1]])
+
+    @property
+    def model(self) -> str:
+        """当前请求的模型名（包含 bypass 改写）"""
+        if self._model is None:
+            self._model = self._field(b"model") or ""
+        return self._model
+
+    @property
+    def is_stream(self) -> bool:
+        return bool(self._field(b"stream"))
+
+    @property
+    def temperature(self) -> Any:
+        """temperature 字段，请求体未解码时只扫描该字段"""
+        if self._body is not None:
+            return self._body.get("temperature")
+        span = scan_top_level(self.raw, (b"temperature",)).get(b"temperature")
+        if span is None:
+            return None
+        return json_loads(self.raw[span[0]:span[1]])
+
+    def set_model(self, model: str) -> None:
+        """改写模型名，不会触发请求体解码"""
+        self._model = model
+        if self._body is not None:
+            self._body["model"] = model
+
+    def update_body(self, **fields: Any) -> None:
+        """修改 model 以外的字段，之后转发时会重新编码请求体"""
+        self.body.update(fields)
+        self._dirty = True
+
+    def upstream_body(self, model: str) -> Dict[str, Any]:
+        """发给上游的请求体（字典形式，供 SDK 使用）"""
+        return {**self.body, "model": model}
+
+    def upstream_bytes(self, model: str) -> bytes:
+        """发给上游的请求体字节：只改了 model 时直接在原始字节上替换"""
+        if not self._dirty:
+            if self._fields is None:
+                self._fields = scan_top_level(self.raw, (b"model", b"stream"))
+            span = self._fields.get(b"model")
+            if span is not None:
+                value = json_dumps(model)
+                return self.raw[:span[0]] + value + self.raw[span[1]:]
+        return json_dumps(self.upstream_body(model))
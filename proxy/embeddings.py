@@ -0,0 +1,134 @@
+import asyncio
+import json
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from loguru import logger
+
+from .config import EmbeddingBatchConfig
+
+# 不属于共享参数的字段：input 会被合并，model 由路由决定
+_KEY_EXCLUDED = frozenset({"input", "model"})
+
+def normalize_input(value: Any) -> List[Any]:
+    """把 embeddings 的 input 统一为列表：字符串和单个 token 数组视为一条输入"""
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list) and value and isinstance(value[0], int):
+        return [value]
+    return list(value)
+
+def shared_params(body: Dict[str, Any]) -> Dict[str, Any]:
+    """合并请求中各调用方共用的参数（encoding_format、dimensions、user 等）"""
+    return {k: v for k, v in body.items() if k not in _KEY_EXCLUDED}
+
+def batch_key(server_alias: str, real_model: str, body: Dict[str, Any]) -> str:
+    """同一 provider、模型且其他参数都相同的请求才能合并
+
+    user 等标识调用方的字段也必须相同，合并后的请求不会把一个调用方的标识用于其他调用方的输入。
+    """
+    return json.dumps([server_alias, real_model, shared_params(body)], sort_keys=True, ensure_ascii=False)
+
+def split_response(
+    data: Dict[str, Any],
+    offset: int,
+    inputs: List[Any],
+    total_size: int
+) -> Dict[str, Any]:
+    """从合并请求的结果中取出一个调用方的部分，重新编号 index 并按输入长度分摊 token 用量"""
+    items = sorted(data.get("data") or [], key=lambda item: item.get("index", 0))
+    part = []
+    for i, item in enumerate(items[offset:offset + len(inputs)]):
+        part.append({**item, "index": i})
+    result = {"object": data.get("object", "list"), "data": part, "model": data.get("model")}
+    usage = data.get("usage")
+    if usage:
+        share = sum(len(x) for x in inputs) / total_size if total_size else 0.0
+        result["usage"] = {k: round(v * share) for k, v in usage.items() if isinstance(v, (int, float))}
+    return result
+
+class _Batch:
+    def __init__(self):
+        self.inputs: List[Any] = []
+        self.waiters: List[tuple] = []   # (offset, inputs, future)
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+class EmbeddingBatcher:
+    """embeddings 微批处理
+
+    在 window_ms 毫秒内到达的同一批次键的请求合并为一次上游调用（最多 max_batch_size 条输入），
+    结果按调用方拆分返回。上游调用失败时所有调用方收到同一个异常。
+    """
+
+    def __init__(self):
+        self._batches: Dict[str, _Batch] = {}
+        self._tasks: set = set()
+        self.requests = 0
+        self.upstream_calls = 0
+
+    async def submit(
+        self,
+        key: str,
+        inputs: List[Any],
+        settings: EmbeddingBatchConfig,
+        flush: Callable[[List[Any]], Awaitable[Dict[str, Any]]]
+    ) -> Dict[str, Any]:
+        """加入批次并等待结果，flush(inputs) 发出合并后的请求并返回上游响应（已解码）"""
+        self.requests += 1
+        if len(inputs) >= settings.max_batch_size:
+            self.upstream_calls += 1
+            return split_response(await flush(inputs), 0, inputs, sum(len(x) for x in inputs))
+
+        batch = self._batches.get(key)
+        if batch is not None and len(batch.inputs) + len(inputs) > settings.max_batch_size:
+            self._start(key, batch, flush)
+            batch = None
+        if batch is None:
+            batch = self._batches[key] = _Batch()
+            batch.timer = asyncio.get_running_loop().call_later(
+                settings.window_ms / 1000, self._start, key, batch, flush
+            )
+        future = asyncio.get_running_loop().create_future()
+        batch.waiters.append((len(batch.inputs), inputs, future))
+        batch.inputs.extend(inputs)
+        if len(batch.inputs) >= settings.max_batch_size:
+            self._start(key, batch, flush)
+        # 调用方断开不影响同一批次的其他请求
+        return await asyncio.shield(future)
+
+    def _start(self, key: str, batch: _Batch, flush: Callable[[List[Any]], Awaitable[Dict[str, Any]]]) -> None:
+        if self._batches.get(key) is batch:
+            del self._batches[key]
+        if batch.timer is not None:
+            batch.timer.cancel()
+            batch.timer = None
+        task = asyncio.ensure_future(self._run(batch, flush))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: _Batch, flush: Callable[[List[Any]], Awaitable[Dict[str, Any]]]) -> None:
+        self.upstream_calls += 1
+        total_size = sum(len(x) for x in batch.inputs)
+        try:
+            data = await flush(batch.inputs)
+        except Exception as e:
+            for _, _, future in batch.waiters:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        except BaseException:
+            # 合并请求被取消（如服务关闭）时取消等待中的调用方，不把 CancelledError 作为结果传出
+            for _, _, future in batch.waiters:
+                future.cancel()
+            raise
+        if len(data.get("data") or []) != len(batch.inputs):
+            logger.warning(f"embeddings 合并请求返回 {len(data.get('data') or [])} 条结果，预期 {len(batch.inputs)} 条")
+        for offset, inputs, future in batch.waiters:
+            if not future.done():
+                future.set_result(split_response(data, offset, inputs, total_size))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "upstream_calls": self.upstream_calls,
+            "pending_batches": len(self._batches),
+        }
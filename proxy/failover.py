@@ -0,0 +1,142 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, TypeVar
+
+import httpx
+import openai
+from loguru import logger
+
+from .breaker import CircuitOpenError
+from .config import VirtualModelConfig
+from .ratelimit import RateLimitExceeded
+
+T = TypeVar("T")
+
+# 可以换一个上游重试的状态码
+RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+class UpstreamStatusError(Exception):
+    """上游返回错误状态码（raw 模式），保留原始响应内容以便原样返回给客户端"""
+
+    def __init__(self, status_code: int, content: bytes, media_type: str):
+        super().__init__(f"上游返回 HTTP {status_code}")
+        self.status_code = status_code
+        self.content = content
+        self.media_type = media_type
+
+def is_retryable(error: BaseException) -> bool:
+    """超时、网络错误、熔断、provider 限流、429 和 5xx 可以转到下一个目标"""
+    if isinstance(error, CircuitOpenError):
+        return True
+    if isinstance(error, RateLimitExceeded):
+        return error.scope == "provider"
+    if isinstance(error, (openai.APIStatusError, UpstreamStatusError)):
+        return error.status_code in RETRYABLE_STATUS
+    return isinstance(error, (openai.APIConnectionError, httpx.TransportError))
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """指数退避 + 全抖动：在 [0, min(cap, base * 2^attempt)] 内随机取值"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+class LatencyWindow:
+    """最近若干次成功请求的延迟，用于计算分位数"""
+
+    def __init__(self, size: int = 200):
+        self.samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, latency: float) -> None:
+        self.samples.append(latency)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+class FailoverRunner:
+    """按虚拟模型的目标链依次尝试，可选对冲请求
+
+    attempt(target) 成功时返回结果，失败时抛出异常；
+    可重试的异常（见 is_retryable）转到下一个目标，其他异常直接抛出。
+    """
+
+    # 少于该样本数时使用配置的 hedge_delay
+    MIN_SAMPLES = 20
+
+    def __init__(self):
+        self._latency: Dict[str, LatencyWindow] = {}
+
+    def hedge_delay(self, target: str, settings: VirtualModelConfig) -> float:
+        window = self._latency.get(target)
+        delay = None
+        if window is not None and len(window.samples) >= self.MIN_SAMPLES:
+            delay = window.percentile(settings.hedge_percentile)
+        return max(delay if delay is not None else settings.hedge_delay, settings.hedge_min_delay)
+
+    async def _timed(self, target: str, attempt: Callable[[str], Awaitable[T]]) -> T:
+        start = time.monotonic()
+        result = await attempt(target)
+        self._latency.setdefault(target, LatencyWindow()).add(time.monotonic() - start)
+        return result
+
+    async def run(
+        self,
+        settings: VirtualModelConfig,
+        attempt: Callable[[str], Awaitable[T]],
+        targets: Optional[List[str]] = None,
+        hedge: bool = False
+    ) -> T:
+        targets = targets if targets is not None else settings.targets
+        if not targets:
+            raise ValueError("虚拟模型没有可用的目标")
+        max_attempts = settings.max_attempts or len(targets)
+        plan = [targets[i % len(targets)] for i in range(max_attempts)]
+        last_error: Optional[BaseException] = None
+        i = 0
+        while i < len(plan):
+            if i > 0:
+                await asyncio.sleep(backoff_delay(i - 1, settings.backoff, settings.max_backoff))
+            target = plan[i]
+            primary = asyncio.ensure_future(self._timed(target, attempt))
+            secondary = None
+            try:
+                if hedge and i + 1 < len(plan):
+                    await asyncio.wait({primary}, timeout=self.hedge_delay(target, settings))
+                    if not primary.done():
+                        logger.info(f"{target} 超过对冲延迟未返回，并发请求 {plan[i + 1]}")
+                        secondary = asyncio.ensure_future(self._timed(plan[i + 1], attempt))
+                return await self._first_success(primary, secondary)
+            except asyncio.CancelledError:
+                # 客户端断开时取消仍在进行的请求
+                primary.cancel()
+                if secondary is not None:
+                    secondary.cancel()
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                last_error = e
+                logger.warning(f"{target} 请求失败，转到下一个目标: {str(e)}")
+            i += 2 if secondary is not None else 1
+        raise last_error
+
+    @staticmethod
+    async def _first_success(primary: "asyncio.Future[T]", secondary: "Optional[asyncio.Future[T]]") -> T:
+        """返回先成功的结果并取消另一个请求；都失败时抛出最后一个异常"""
+        pending = {primary} if secondary is None else {primary, secondary}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                    if not is_retryable(error):
+                        raise error
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
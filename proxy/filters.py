@@ -0,0 +1,138 @@
+import operator
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# 字段条件：字段名（可用 . 访问嵌套字段）+ 比较运算符 + 值，如 context_length>=32000、pricing.prompt=0
+_PREDICATE = re.compile(r"^([A-Za-z_][\w.]*)(>=|<=|!=|>|<|=)(.*)$")
+_COMPARE = {
+    ">=": operator.ge,
+    "<=": operator.le,
+    ">": operator.gt,
+    "<": operator.lt,
+    "=": operator.eq,
+    "!=": operator.ne,
+}
+
+Predicate = Callable[[Dict[str, Any]], bool]
+
+def _pattern(term: str) -> str:
+    """模型 ID 的匹配模式：* 为通配符，其余按正则解释（与旧版写法兼容），不是合法正则时按字面匹配"""
+    pattern = term.replace("*", ".*")
+    try:
+        re.compile(pattern)
+    except re.error:
+        pattern = ".*".join(re.escape(part) for part in term.split("*"))
+    return pattern
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+def _field_predicate(path: str, op: str, expected: str) -> Predicate:
+    """字段条件：期望值是数字时按数值比较（OpenRouter 的价格是字符串形式的数字），否则按不区分大小写的通配符比较"""
+    keys = path.split(".")
+    number = _number(expected)
+    compare = _COMPARE[op]
+    if number is None:
+        if op not in ("=", "!="):
+            raise ValueError(f"字段条件 {path}{op}{expected} 只能对数字使用大小比较")
+        regex = re.compile(".*".join(re.escape(part) for part in expected.split("*")), re.IGNORECASE | re.DOTALL)
+        negate = op == "!="
+
+    def lookup(model: Dict[str, Any]) -> Any:
+        value: Any = model
+        for key in keys:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        return value
+
+    # 缺少该字段（或不是数字）的模型只满足 !=
+    missing = op == "!="
+    if number is not None:
+        def predicate(model: Dict[str, Any]) -> bool:
+            value = _number(lookup(model))
+            return missing if value is None else compare(value, number)
+    else:
+        def predicate(model: Dict[str, Any]) -> bool:
+            value = lookup(model)
+            if value is None:
+                return missing
+            return (regex.fullmatch(str(value)) is not None) != negate
+    return predicate
+
+class ModelFilter:
+    """预编译的模型过滤器，在加载配置时编译一次
+
+    语法（空格分隔的条件之间为 AND，大小写不敏感）：
+    - gpt、gpt*4o、^claude：模型 ID 包含该模式，* 为通配符
+    - !preview：排除 ID 包含该模式的模型（- 开头的条件仍按旧写法匹配模型 ID，如 -preview 匹配包含 "-preview" 的模型）
+    - gpt|claude：OR，满足任一即可，也可以和字段条件混用，如 free|pricing.prompt=0
+    - context_length>=32000、pricing.prompt=0、owned_by=openai：字段条件，
+      字段名可用 . 访问嵌套字段，支持 = != > >= < <=，期望值是数字时按数值比较
+
+    各条件在构造时编译好；过滤时依次收窄列表，后面的条件只检查前面留下的模型，
+    模型 ID 条件在前（一次 search 调用），字段条件在后。
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        self._id_terms: List[Tuple[Callable[[str], Any], bool]] = []
+        self._predicates: List[Tuple[Predicate, bool]] = []
+        for term in expression.split():
+            negate = term.startswith("!") and len(term) > 1
+            if negate:
+                term = term[1:]
+            patterns: List[str] = []
+            fields: List[Predicate] = []
+            for alternative in term.split("|"):
+                if not alternative:
+                    continue
+                match = _PREDICATE.match(alternative)
+                if match:
+                    fields.append(_field_predicate(*match.groups()))
+                else:
+                    patterns.append(_pattern(alternative))
+            if not patterns and not fields:
+                continue
+            search = re.compile("|".join(patterns), re.IGNORECASE | re.DOTALL).search if patterns else None
+            if not fields:
+                self._id_terms.append((search, negate))
+                continue
+            if search is not None:
+                fields.append(lambda model, search=search: search(model["id"]) is not None)
+            if len(fields) == 1:
+                self._predicates.append((fields[0], negate))
+            else:
+                self._predicates.append((lambda model, alternatives=tuple(fields): any(
+                    alternative(model) for alternative in alternatives
+                ), negate))
+
+    def apply(self, models: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """过滤模型列表，每个条件对剩余的模型做一次列表推导"""
+        kept = list(models)
+        for search, negate in self._id_terms:
+            if negate:
+                kept = [model for model in kept if search(model["id"]) is None]
+            else:
+                kept = [model for model in kept if search(model["id"])]
+        for predicate, negate in self._predicates:
+            kept = [model for model in kept if predicate(model) != negate]
+        return kept
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, ModelFilter) and other.expression == self.expression
+
+    def __hash__(self) -> int:
+        return hash(self.expression)
+
+    def __repr__(self) -> str:
+        return f"ModelFilter({self.expression!r})"
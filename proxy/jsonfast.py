@@ -0,0 +1,48 @@
+import json
+from typing import Any, Dict, Optional
+
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:  # 可选依赖，未安装时使用标准库
+    orjson = None
+
+ORJSON_AVAILABLE = orjson is not None
+
+def _std_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+if orjson is not None:
+    def json_dumps(obj: Any) -> bytes:
+        """编码为紧凑的 UTF-8 JSON 字节"""
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # 超过 64 位的整数等 orjson 不支持的值交给标准库处理
+            return _std_dumps(obj)
+
+    json_loads = orjson.loads
+else:
+    json_dumps = _std_dumps
+    json_loads = json.loads
+
+def error_body(message: str) -> bytes:
+    return json_dumps({"error": message})
+
+# 固定内容的错误响应体，在导入时编码一次
+ERROR_UNAUTHORIZED = error_body("Unauthorized")
+ERROR_FORBIDDEN_ADMIN = error_body("Forbidden: admin permission required")
+ERROR_ADMIN_DISABLED = error_body("Forbidden: admin API is disabled, set ADMIN_TOKEN to enable it")
+ERROR_FORBIDDEN_PROVIDER = error_body("Forbidden: No access to this provider")
+ERROR_UNSUPPORTED_ENDPOINT = error_body("Unsupported API endpoint")
+ERROR_BATCH_NOT_FOUND = error_body("Batch job not found")
+
+def json_response(data: Any, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    """构造 JSON 响应，data 为 bytes 时视为已编码的内容直接发送"""
+    return Response(
+        content=data if isinstance(data, bytes) else json_dumps(data),
+        media_type="application/json",
+        status_code=status_code,
+        headers=headers
+    )
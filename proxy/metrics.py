@@ -0,0 +1,139 @@
+import os
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import prometheus_client
+    from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+except ImportError:  # 可选依赖，未安装时不导出指标
+    prometheus_client = None
+
+PROMETHEUS_AVAILABLE = prometheus_client is not None
+
+# 多 worker 部署时设置该目录，各进程的指标写入共享目录，由 /metrics 汇总
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# 代理自身耗时（认证、路由、额外开销）通常在毫秒以下
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+UPSTREAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# 每个指标缓存的子指标数上限，超过后不再缓存（仍然正常记录）
+MAX_CHILDREN = 4096
+
+class _Family:
+    """缓存带标签的子指标，避免每次记录都经过 labels() 的参数校验和加锁查找"""
+
+    __slots__ = ("metric", "children")
+
+    def __init__(self, metric: Any):
+        self.metric = metric
+        self.children: Dict[Tuple[str, ...], Any] = {}
+
+    def labels(self, *values: str) -> Any:
+        child = self.children.get(values)
+        if child is None:
+            child = self.metric.labels(*values)
+            if len(self.children) < MAX_CHILDREN:
+                self.children[values] = child
+        return child
+
+class Metrics:
+    """Prometheus 指标
+
+    请求路径上每个请求只在结束时记录一次（流式数据块在本地计数，结束时一次性累加），
+    每次记录只是对缓存的子指标做一次加法或分桶计数。未安装 prometheus_client 时所有方法为空操作。
+    """
+
+    def __init__(self, registry: Optional[Any] = None):
+        self.enabled = PROMETHEUS_AVAILABLE
+        if not self.enabled:
+            return
+        kwargs = {"registry": registry} if registry is not None else {}
+        self.requests = _Family(Counter(
+            "llmrouter_requests_total", "代理请求数", ["provider", "model", "status"], **kwargs
+        ))
+        self.auth_seconds = Histogram(
+            "llmrouter_auth_seconds", "认证耗时", buckets=FAST_BUCKETS, **kwargs
+        )
+        self.routing_seconds = Histogram(
+            "llmrouter_routing_seconds", "路由解析耗时", buckets=FAST_BUCKETS, **kwargs
+        )
+        self.overhead_seconds = _Family(Histogram(
+            "llmrouter_proxy_overhead_seconds", "代理额外开销：开始响应的耗时减去上游首字节耗时",
+            ["provider"], buckets=FAST_BUCKETS, **kwargs
+        ))
+        self.first_byte_seconds = _Family(Histogram(
+            "llmrouter_upstream_first_byte_seconds", "上游首字节耗时（非流式为完整响应耗时）",
+            ["provider"], buckets=UPSTREAM_BUCKETS, **kwargs
+        ))
+        self.upstream_seconds = _Family(Histogram(
+            "llmrouter_upstream_seconds", "上游请求总耗时", ["provider"], buckets=UPSTREAM_BUCKETS, **kwargs
+        ))
+        self.stream_chunks = _Family(Counter(
+            "llmrouter_stream_chunks_total", "转发的流式数据块数", ["provider"], **kwargs
+        ))
+        self.inflight = _Family(Gauge(
+            "llmrouter_inflight_requests", "进行中的请求数", ["provider"], multiprocess_mode="livesum", **kwargs
+        ))
+        self.tokens = _Family(Counter(
+            "llmrouter_tokens_total", "上游返回的 token 用量", ["provider", "type"], **kwargs
+        ))
+        self.cache_lookups = _Family(Counter(
+            "llmrouter_cache_lookups_total", "缓存查询次数", ["cache", "result"], **kwargs
+        ))
+
+    def auth(self, seconds: float) -> None:
+        if self.enabled:
+            self.auth_seconds.observe(seconds)
+
+    def routing(self, seconds: float) -> None:
+        if self.enabled:
+            self.routing_seconds.observe(seconds)
+
+    def request(self, provider: str, model: str, status: int, overhead: Optional[float] = None) -> None:
+        if not self.enabled:
+            return
+        self.requests.labels(provider, model, str(status)).inc()
+        if overhead is not None:
+            self.overhead_seconds.labels(provider).observe(max(overhead, 0.0))
+
+    def upstream(
+        self,
+        provider: Optional[str],
+        first_byte: Optional[float],
+        total: float,
+        chunks: int = 0
+    ) -> None:
+        if not self.enabled:
+            return
+        provider = provider or "proxy"
+        if first_byte is not None:
+            self.first_byte_seconds.labels(provider).observe(first_byte)
+        self.upstream_seconds.labels(provider).observe(total)
+        if chunks:
+            self.stream_chunks.labels(provider).inc(chunks)
+
+    def usage(self, provider: Optional[str], usage: Optional[Dict[str, Any]]) -> None:
+        if not self.enabled or not usage:
+            return
+        provider = provider or "proxy"
+        for key, kind in (("prompt_tokens", "prompt"), ("completion_tokens", "completion")):
+            value = usage.get(key)
+            if value:
+                self.tokens.labels(provider, kind).inc(value)
+
+    def cache_lookup(self, cache: str, hit: bool) -> None:
+        if self.enabled:
+            self.cache_lookups.labels(cache, "hit" if hit else "miss").inc()
+
+    def render(self) -> Tuple[bytes, str]:
+        """导出文本格式的指标；设置了 PROMETHEUS_MULTIPROC_DIR 时汇总所有 worker 进程"""
+        if MULTIPROC_DIR:
+            from prometheus_client import multiprocess
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = prometheus_client.REGISTRY
+        return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+# 进程内唯一的指标实例
+metrics = Metrics()
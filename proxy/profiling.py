@@ -0,0 +1,137 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+# 单次采样窗口的上限，避免忘记关闭时一直占用 CPU 和内存
+MAX_DURATION = 600.0
+# 不同调用栈的数量上限，超出的样本计入 [truncated]
+MAX_STACKS = 20000
+
+def server_timing(timings: Dict[str, float], total: float) -> str:
+    """把各阶段耗时（秒）格式化为 Server-Timing 响应头，单位为毫秒
+
+    overhead 为代理自身的开销：total 减去上游首字节耗时（非流式为完整响应耗时）。
+    """
+    parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items()]
+    parts.append(f"overhead;dur={(total - timings.get('upstream_first_byte', 0.0)) * 1000:.2f}")
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+def _frame_name(code: Any) -> str:
+    filename = code.co_filename
+    for prefix in sys.path:
+        if prefix and filename.startswith(prefix + os.sep):
+            filename = filename[len(prefix) + 1:]
+            break
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    """按比例抽样请求的采样分析器，由管理接口开启，到时自动关闭
+
+    开启后每个请求以 sample_rate 的概率被选中；只要有被选中的请求在处理中，
+    后台线程就每隔 interval 秒抓取一次事件循环线程的调用栈，
+    结果为 flamegraph.pl / speedscope 可直接读取的折叠栈格式（"a;b;c 次数"）。
+    所有请求共用一个事件循环，并发时样本中也会包含同时在处理的其他请求。
+    """
+
+    def __init__(self):
+        self.sample_rate = 0.0
+        self.interval = 0.005
+        self.deadline = 0.0
+        self.started_at: Optional[float] = None
+        self.sampled_requests = 0
+        self.samples = 0
+        self._stacks: Counter = Counter()
+        self._names: Dict[Any, str] = {}
+        self._inflight = 0
+        self._target: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def active(self) -> bool:
+        return self._thread is not None and time.monotonic() < self.deadline
+
+    def start(self, sample_rate: float = 0.1, duration: float = 60.0, interval: float = 0.005) -> None:
+        """开启一个采样窗口并清空上一次的结果，需要在事件循环线程中调用"""
+        if not 0 < sample_rate <= 1:
+            raise ValueError("sample_rate 必须在 (0, 1] 之间")
+        if not 0 < duration <= MAX_DURATION:
+            raise ValueError(f"duration 必须在 (0, {MAX_DURATION:g}] 秒之间")
+        if interval < 0.001:
+            raise ValueError("interval 不能小于 1 毫秒")
+        self.stop()
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.deadline = time.monotonic() + duration
+        self.started_at = time.time()
+        self.sampled_requests = 0
+        self.samples = 0
+        self._stacks = Counter()
+        self._target = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """提前结束采样窗口，已采集的结果保留到下一次开启"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._inflight = 0
+
+    def sample(self) -> bool:
+        """决定当前请求是否被抽中，抽中时调用方需要在请求结束后调用 exit()"""
+        if not self.active or random.random() >= self.sample_rate:
+            return False
+        self.sampled_requests += 1
+        self._inflight += 1
+        return True
+
+    def exit(self) -> None:
+        self._inflight = max(self._inflight - 1, 0)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            if time.monotonic() >= self.deadline:
+                break
+            if self._inflight <= 0:
+                continue
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                name = self._names.get(frame.f_code)
+                if name is None:
+                    name = self._names[frame.f_code] = _frame_name(frame.f_code)
+                stack.append(name)
+                frame = frame.f_back
+            del frame
+            if not stack:
+                continue
+            key = ";".join(reversed(stack))
+            if key not in self._stacks and len(self._stacks) >= MAX_STACKS:
+                key = "[truncated]"
+            self._stacks[key] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        """折叠栈文本，每行 "调用栈 样本数"，按样本数降序"""
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "sample_rate": self.sample_rate,
+            "interval_ms": self.interval * 1000,
+            "started_at": self.started_at,
+            "remaining_seconds": max(self.deadline - time.monotonic(), 0.0) if self.active else 0.0,
+            "sampled_requests": self.sampled_requests,
+            "inflight": self._inflight,
+            "samples": self.samples,
+            "stacks": len(self._stacks),
+        }
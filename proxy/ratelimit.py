@@ -0,0 +1,208 @@
+import asyncio
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+LimitKey = Tuple[str, str]  # (scope, name)
+
+class RateLimitExceeded(Exception):
+    """超出限流配置，retry_after 为建议的重试等待时间（秒）"""
+
+    def __init__(self, scope: str, name: str, reason: str, retry_after: float):
+        super().__init__(f"请求过于频繁: {scope} '{name}' 超出{reason}限制")
+        self.scope = scope
+        self.name = name
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """令牌桶，容量为每分钟额度，按秒连续补充
+
+    reserve 允许余额为负（预约），调用方按返回的等待时间排队，先到先得。
+    """
+
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """取得 amount 个令牌需要等待的时间"""
+        self._refill(now)
+        deficit = min(amount, self.capacity) - self.tokens
+        return deficit / self.rate if deficit > 0 else 0.0
+
+    def reserve(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float) -> None:
+        """归还（amount 为负时补扣）令牌"""
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+class _Limiter:
+    """一个用户或 provider 的限流状态"""
+
+    def __init__(self, rpm: Optional[int], tpm: Optional[int], max_concurrent: Optional[int]):
+        self.signature = (rpm, tpm, max_concurrent)
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.concurrency = asyncio.Semaphore(max_concurrent) if max_concurrent else None
+        self.inflight = 0
+
+class Permit:
+    """一次请求持有的限流许可，请求结束时调用 release() 归还并按实际 token 用量结算"""
+
+    def __init__(self, limiters: List[_Limiter], estimated_tokens: int):
+        self._limiters = limiters
+        self.estimated_tokens = estimated_tokens
+        self._released = False
+
+    def release(self, total_tokens: Optional[int] = None) -> None:
+        if self._released:
+            return
+        self._released = True
+        for limiter in self._limiters:
+            limiter.inflight -= 1
+            if limiter.concurrency is not None:
+                limiter.concurrency.release()
+            if limiter.tokens is not None and total_tokens is not None:
+                limiter.tokens.refund(self.estimated_tokens - total_tokens)
+
+EMPTY_PERMIT = Permit([], 0)
+
+class RateLimiter:
+    """按用户和 provider 的 RPM / TPM 令牌桶与并发上限
+
+    - 限流配置保存在数据库中，按版本号定期重新加载，name 为 * 的配置作为默认值
+    - 每个对象的检查和扣减都是 O(1) 的内存操作
+    - 额度不足时，如果在 max_wait 秒内可以满足就排队等待，否则抛出 RateLimitExceeded
+    - TPM 先按请求体大小预估扣减，请求结束后按实际用量结算
+    - 状态保存在进程内，多 worker 部署时每个 worker 各自计数
+    """
+
+    def __init__(self, max_wait: float = 2.0, version_check_interval: float = 2.0):
+        self.max_wait = max_wait
+        self.version_check_interval = version_check_interval
+        self._config: Dict[LimitKey, Tuple[Optional[int], Optional[int], Optional[int]]] = {}
+        self._limiters: Dict[LimitKey, _Limiter] = {}
+        self._version: Optional[int] = None
+        self._next_version_check = 0.0
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._config)
+
+    def load(self, limits: Iterable[Any]) -> None:
+        """加载限流配置（RateLimit 列表），未变化对象的计数保留"""
+        self._config = {
+            (limit.scope, limit.name): (limit.rpm, limit.tpm, limit.max_concurrent)
+            for limit in limits
+        }
+        self._limiters = {
+            key: limiter for key, limiter in self._limiters.items()
+            if self._lookup(key) == limiter.signature
+        }
+
+    async def sync(self, db: Any) -> None:
+        """按间隔检查数据库中的限流配置版本号，变化时重新加载"""
+        now = time.monotonic()
+        if now < self._next_version_check:
+            return
+        self._next_version_check = now + self.version_check_interval
+        try:
+            version = await db.get_limits_version()
+            if version != self._version:
+                self.load(await db.list_rate_limits())
+                self._version = version
+        except Exception as e:
+            logger.error(f"加载限流配置失败: {str(e)}")
+
+    def _lookup(self, key: LimitKey) -> Optional[Tuple[Optional[int], Optional[int], Optional[int]]]:
+        config = self._config.get(key)
+        if config is None:
+            config = self._config.get((key[0], "*"))
+        return config
+
+    def _limiter(self, scope: str, name: Optional[str]) -> Optional[_Limiter]:
+        if name is None:
+            return None
+        key = (scope, name)
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            config = self._lookup(key)
+            if config is None or not any(config):
+                return None
+            limiter = self._limiters[key] = _Limiter(*config)
+        return limiter
+
+    async def acquire(self, scope: str, name: Optional[str], estimated_tokens: int = 0) -> Permit:
+        """申请一次请求的许可，额度不足且等待超过 max_wait 时抛出 RateLimitExceeded"""
+        limiter = self._limiter(scope, name) if self._config else None
+        if limiter is None:
+            return EMPTY_PERMIT
+        deadline = time.monotonic() + self.max_wait
+
+        if limiter.concurrency is not None:
+            try:
+                await asyncio.wait_for(limiter.concurrency.acquire(), timeout=self.max_wait)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise RateLimitExceeded(scope, name, "并发", 1.0)
+
+        now = time.monotonic()
+        wait = 0.0
+        reason = None
+        for bucket, amount, label in (
+            (limiter.requests, 1, "RPM"),
+            (limiter.tokens, estimated_tokens, "TPM"),
+        ):
+            if bucket is not None:
+                bucket_wait = bucket.wait_time(amount, now)
+                if bucket_wait > wait:
+                    wait, reason = bucket_wait, label
+        if now + wait > deadline:
+            if limiter.concurrency is not None:
+                limiter.concurrency.release()
+            self.rejected += 1
+            raise RateLimitExceeded(scope, name, reason, wait)
+
+        # 先预约令牌再等待，后到的请求会排在后面
+        if limiter.requests is not None:
+            limiter.requests.reserve(1, now)
+        if limiter.tokens is not None:
+            limiter.tokens.reserve(estimated_tokens, now)
+        limiter.inflight += 1
+        permit = Permit([limiter], estimated_tokens)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                permit.release(0)
+                raise
+        return permit
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rejected": self.rejected,
+            "limits": {
+                f"{scope}:{name}": {
+                    "requests_available": round(limiter.requests.tokens, 1) if limiter.requests else None,
+                    "tokens_available": round(limiter.tokens.tokens, 1) if limiter.tokens else None,
+                    "inflight": limiter.inflight,
+                }
+                for (scope, name), limiter in self._limiters.items()
+            },
+        }
+
+def estimate_tokens(raw: bytes) -> int:
+    """按请求体大小粗略估计 prompt token 数（约 4 字节一个 token）"""
+    return len(raw) // 4 + 1
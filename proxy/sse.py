@@ -0,0 +1,72 @@
+import re
+from typing import Any, Dict, List, Optional
+
+from .jsonfast import json_dumps, json_loads
+
+DONE_FRAME = b"data: [DONE]\n\n"
+
+_MODEL_FIELD = re.compile(rb'"model"\s*:\s*"(?:[^"\\]|\\.)*"')
+_USAGE_OBJECT = re.compile(rb'"usage"\s*:\s*\{')
+
+class SSEFrameSplitter:
+    """增量 SSE 帧切分器
+
+    把上游返回的任意字节块切分为完整的事件帧（以空行结尾），
+    不完整的部分保留到下一次 feed。输出帧统一以 b"\\n\\n" 结尾。
+    """
+
+    def __init__(self):
+        self._buffer = b""
+        # 上一块以 \r 结尾时暂存，和下一块开头的 \n 一起按 \r\n 处理
+        self._cr = False
+
+    def feed(self, data: bytes) -> List[bytes]:
+        if self._cr:
+            data = b"\r" + data
+            self._cr = False
+        if b"\r" in data:
+            if data.endswith(b"\r"):
+                data = data[:-1]
+                self._cr = True
+            data = data.replace(b"\r\n", b"\n")
+        buffer = self._buffer + data if self._buffer else data
+        frames = []
+        start = 0
+        while True:
+            end = buffer.find(b"\n\n", start)
+            if end < 0:
+                break
+            if end > start:
+                frames.append(buffer[start:end + 2])
+            start = end + 2
+        self._buffer = buffer[start:]
+        return frames
+
+    def flush(self) -> List[bytes]:
+        """上游结束时返回残留的最后一帧"""
+        rest, self._buffer = self._buffer.strip(), b""
+        self._cr = False
+        return [rest + b"\n\n"] if rest else []
+
+def frame_data(frame: bytes) -> Optional[bytes]:
+    """取出帧中的 data 字段内容，非 data 帧返回 None"""
+    if not frame.startswith(b"data:"):
+        return None
+    return frame[5:].strip()
+
+def rewrite_model(frame: bytes, model: str) -> bytes:
+    """只改写帧中的 model 字段，其余字节保持不变"""
+    replacement = b'"model":' + json_dumps(model)
+    return _MODEL_FIELD.sub(lambda _: replacement, frame, count=1)
+
+def extract_usage(frame: bytes) -> Optional[Dict[str, Any]]:
+    """从包含 usage 对象的帧中解析 token 用量，只有这类帧才会被 JSON 解码"""
+    if not _USAGE_OBJECT.search(frame):
+        return None
+    data = frame_data(frame)
+    if not data:
+        return None
+    try:
+        return json_loads(data).get("usage")
+    except (ValueError, AttributeError):
+        return None
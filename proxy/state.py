@@ -0,0 +1,156 @@
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple
+
+import aiosqlite
+
+class StateBackend(ABC):
+    """多进程共享状态的键值存储接口
+
+    bypass 设置、模型目录等需要在多个 worker 之间共享的数据通过它读写，
+    值统一为 bytes，由调用方负责序列化。
+    """
+
+    # 是否在多个进程之间共享
+    shared: bool = True
+
+    async def initialize(self) -> None:
+        """建立连接、创建表结构"""
+        pass
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        """读取键值，不存在或已过期时返回 None"""
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        """写入键值，ttl 为过期时间（秒）"""
+        pass
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        """删除键"""
+        pass
+
+    async def close(self) -> None:
+        """释放连接"""
+        pass
+
+class MemoryStateBackend(StateBackend):
+    """进程内存储，仅适用于单进程部署"""
+
+    shared = False
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[bytes, Optional[float]]] = {}
+
+    async def get(self, key: str) -> Optional[bytes]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and time.time() > expires_at:
+            del self._data[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    async def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+class SQLiteStateBackend(StateBackend):
+    """基于 SQLite 文件的共享存储，同一台机器上的多个 worker 共用一个文件"""
+
+    def __init__(self, db_path: str = "state.db"):
+        self.db_path = db_path
+        self._conn: Optional[aiosqlite.Connection] = None
+
+    async def initialize(self) -> None:
+        if self._conn is not None:
+            return
+        self._conn = await aiosqlite.connect(self.db_path)
+        await self._conn.execute("PRAGMA journal_mode=WAL")
+        await self._conn.execute("PRAGMA synchronous=NORMAL")
+        await self._conn.execute("PRAGMA busy_timeout=5000")
+        await self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS kv_store (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires_at REAL
+            )
+        """)
+        await self._conn.commit()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        async with self._conn.execute(
+            "SELECT value, expires_at FROM kv_store WHERE key = ?", (key,)
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and time.time() > row[1]:
+            return None
+        return row[0]
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        await self._conn.execute(
+            "INSERT OR REPLACE INTO kv_store (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, time.time() + ttl if ttl else None)
+        )
+        await self._conn.commit()
+
+    async def delete(self, key: str) -> None:
+        await self._conn.execute("DELETE FROM kv_store WHERE key = ?", (key,))
+        await self._conn.commit()
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+class RedisStateBackend(StateBackend):
+    """Redis 协议兼容的共享存储（Redis、Valkey、KeyDB 等），需要安装 redis 包"""
+
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "llmsrouter:"):
+        self.url = url
+        self.prefix = prefix
+        self._client = None
+
+    async def initialize(self) -> None:
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("使用 redis 共享存储需要先安装 redis 包: pip install redis")
+        self._client = redis.from_url(self.url)
+        await self._client.ping()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._client.get(self.prefix + key)
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        await self._client.set(self.prefix + key, value, px=int(ttl * 1000) if ttl else None)
+
+    async def delete(self, key: str) -> None:
+        await self._client.delete(self.prefix + key)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+def create_state_backend(
+    kind: str = "memory",
+    db_path: str = "state.db",
+    redis_url: str = "redis://localhost:6379/0"
+) -> StateBackend:
+    """按名称创建共享状态存储：memory / sqlite / redis"""
+    if kind == "memory":
+        return MemoryStateBackend()
+    if kind == "sqlite":
+        return SQLiteStateBackend(db_path)
+    if kind == "redis":
+        return RedisStateBackend(redis_url)
+    raise ValueError(f"不支持的共享状态存储类型: {kind}")
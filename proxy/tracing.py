@@ -0,0 +1,335 @@
+import base64
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Union
+
+import httpx
+from loguru import logger
+
+from .config import ServerConfig, TracingConfig
+from .sse import frame_data
+
+def _isoformat(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat().replace("+00:00", "Z")
+
+@dataclass
+class TraceRecord:
+    """一次模型调用的追踪记录
+
+    请求体和流式响应以原始形式保存（字节 / SSE 帧列表），
+    解码和组装在导出线程中完成，不占用请求处理的时间。
+    """
+    model: str
+    provider: Optional[str]
+    user_id: Optional[str]
+    start_time: float
+    end_time: float
+    request: Union[bytes, Dict[str, Any]]
+    response: Union[List[bytes], Dict[str, Any], None] = None
+    usage: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+def _assemble_stream(frames: List[bytes]) -> Dict[str, Any]:
+    """把流式响应的 SSE 帧拼接成完整输出"""
+    content = []
+    usage = None
+    finish_reason = None
+    for frame in frames:
+        data = frame_data(frame)
+        if not data or data == b"[DONE]":
+            continue
+        try:
+            chunk = json.loads(data)
+        except ValueError:
+            continue
+        usage = chunk.get("usage") or usage
+        for choice in chunk.get("choices") or []:
+            delta = choice.get("delta") or {}
+            if delta.get("content"):
+                content.append(delta["content"])
+            finish_reason = choice.get("finish_reason") or finish_reason
+    return {
+        "output": {"role": "assistant", "content": "".join(content)},
+        "usage": usage,
+        "finish_reason": finish_reason
+    }
+
+def build_events(record: TraceRecord) -> List[Dict[str, Any]]:
+    """把追踪记录转换为 Langfuse ingestion API 的 trace + generation 事件"""
+    body = json.loads(record.request) if isinstance(record.request, bytes) else record.request
+    usage = record.usage
+    output = None
+    if isinstance(record.response, list):
+        assembled = _assemble_stream(record.response)
+        output = assembled["output"]
+        usage = usage or assembled["usage"]
+    elif isinstance(record.response, dict):
+        choices = record.response.get("choices") or []
+        output = choices[0].get("message") if choices else record.response
+        usage = usage or record.response.get("usage")
+
+    trace_id = str(uuid.uuid4())
+    now = _isoformat(time.time())
+    messages = body.get("messages", body.get("input"))
+    model_parameters = {
+        key: value for key, value in body.items()
+        if key not in ("messages", "input", "model", "stream") and isinstance(value, (int, float, str, bool))
+    }
+    generation = {
+        "id": str(uuid.uuid4()),
+        "traceId": trace_id,
+        "name": "OpenAI-generation",
+        "model": record.model,
+        "modelParameters": model_parameters,
+        "input": messages,
+        "output": output,
+        "startTime": _isoformat(record.start_time),
+        "endTime": _isoformat(record.end_time),
+        "metadata": {"provider": record.provider, **record.metadata},
+    }
+    if usage:
+        generation["usage"] = {
+            "input": usage.get("prompt_tokens", 0),
+            "output": usage.get("completion_tokens", 0),
+            "total": usage.get("total_tokens", 0),
+            "unit": "TOKENS"
+        }
+    if record.error:
+        generation["level"] = "ERROR"
+        generation["statusMessage"] = record.error
+    trace = {
+        "id": trace_id,
+        "name": "OpenAI-generation",
+        "userId": record.user_id,
+        "input": messages,
+        "output": output,
+        "timestamp": _isoformat(record.start_time),
+        "metadata": {"provider": record.provider},
+    }
+    return [
+        {"id": str(uuid.uuid4()), "type": "trace-create", "timestamp": now, "body": trace},
+        {"id": str(uuid.uuid4()), "type": "generation-create", "timestamp": now, "body": generation},
+    ]
+
+class TraceExporter:
+    """异步批量导出到 Langfuse
+
+    - 请求路径只做一次非阻塞入队
+    - 后台线程按 batch_size / flush_interval 攒批上传
+    - 队列满时按 overflow 策略丢弃（drop）或写入磁盘（spill）：溢出的记录先放入另一个有界队列，
+      由导出线程编码并写入磁盘，磁盘中的记录在队列空闲时分批补发
+    - 可按 provider（ServerConfig.tracing）或用户（disabled_users）关闭
+    """
+
+    def __init__(
+        self,
+        settings: TracingConfig,
+        host: Optional[str] = None,
+        public_key: Optional[str] = None,
+        secret_key: Optional[str] = None
+    ):
+        self.settings = settings
+        self.host = (host or os.getenv("LANGFUSE_HOST", "https://cloud.langfuse.com")).rstrip("/")
+        public_key = public_key or os.getenv("LANGFUSE_PUBLIC_KEY")
+        secret_key = secret_key or os.getenv("LANGFUSE_SECRET_KEY")
+        self.enabled = bool(settings.enabled and public_key and secret_key)
+        self._auth = None
+        if self.enabled:
+            token = base64.b64encode(f"{public_key}:{secret_key}".encode("utf-8")).decode("ascii")
+            self._auth = f"Basic {token}"
+        self._queue: "queue.Queue[Optional[TraceRecord]]" = queue.Queue(maxsize=settings.queue_size)
+        # 队列满时等待写入磁盘的记录，只由导出线程取出，磁盘文件也只由导出线程读写
+        self._overflow: "deque[TraceRecord]" = deque()
+        self._thread: Optional[threading.Thread] = None
+        self.exported = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.failed = 0
+
+    def should_trace(self, server_config: Optional[ServerConfig], username: Optional[str]) -> bool:
+        """判断本次请求是否需要追踪"""
+        if not self.enabled or not self.settings.enabled:
+            return False
+        if server_config is not None and not server_config.tracing:
+            return False
+        return not (username and username in self.settings.disabled_users)
+
+    def record(self, record: TraceRecord) -> None:
+        """非阻塞入队，队列满时丢弃或交给导出线程写入磁盘，请求路径上不做编码和文件读写"""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            if self.settings.overflow == "spill" and len(self._overflow) < self.settings.queue_size:
+                self._overflow.append(record)
+            else:
+                self.dropped += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "queue_depth": self._queue.qsize(),
+            "queue_size": self.settings.queue_size,
+            "overflow_depth": len(self._overflow),
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "failed": self.failed,
+        }
+
+    def start(self) -> None:
+        """启动后台导出线程"""
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+            self._thread.start()
+            logger.info(f"已启用 Langfuse 追踪导出: {self.host}")
+
+    def close(self, timeout: float = 5.0) -> None:
+        """通知导出线程发送剩余记录后退出"""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _spill(self, events: List[Dict[str, Any]], count: int = 1) -> None:
+        with open(self.settings.spill_path, "a", encoding="utf-8") as f:
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        self.spilled += count
+
+    def _spill_overflow(self) -> None:
+        """把队列满时溢出的记录编码后写入磁盘"""
+        count = 0
+        events: List[Dict[str, Any]] = []
+        while self._overflow:
+            record = self._overflow.popleft()
+            try:
+                events.extend(build_events(record))
+                count += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"构造追踪事件失败: {str(e)}")
+        if events:
+            self._spill(events, count)
+
+    def _run(self) -> None:
+        with httpx.Client(timeout=self.settings.timeout) as http:
+            stopping = False
+            while not stopping:
+                batch: List[TraceRecord] = []
+                deadline = time.monotonic() + self.settings.flush_interval
+                while len(batch) < self.settings.batch_size:
+                    try:
+                        item = self._queue.get(timeout=max(deadline - time.monotonic(), 0.001))
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stopping = True
+                        break
+                    batch.append(item)
+                # 单次处理出错（如写盘失败）只影响这一批，导出线程继续运行
+                try:
+                    self._process(http, batch)
+                except Exception:
+                    self.failed += len(batch)
+                    logger.exception("追踪导出失败")
+
+    def _process(self, http: httpx.Client, batch: List[TraceRecord]) -> None:
+        self._spill_overflow()
+        if batch:
+            events = []
+            for record in batch:
+                try:
+                    events.extend(build_events(record))
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"构造追踪事件失败: {str(e)}")
+            if events and self._send(http, events):
+                self.exported += len(batch)
+            elif events:
+                self._handle_failure(events, len(batch))
+        elif self._queue.empty():
+            self._drain_spill(http)
+
+    def _send(self, http: httpx.Client, events: List[Dict[str, Any]]) -> bool:
+        try:
+            response = http.post(
+                f"{self.host}/api/public/ingestion",
+                json={"batch": events},
+                headers={"Authorization": self._auth}
+            )
+            if response.status_code >= 300:
+                logger.error(f"上传追踪数据失败: HTTP {response.status_code}, {response.text[:200]}")
+                return False
+            return True
+        except httpx.HTTPError as e:
+            logger.error(f"上传追踪数据失败: {str(e)}")
+            return False
+
+    def _handle_failure(self, events: List[Dict[str, Any]], count: int) -> None:
+        if self.settings.overflow == "spill":
+            self._spill(events, count)
+        else:
+            self.failed += count
+
+    def _drain_spill(self, http: httpx.Client) -> None:
+        """队列空闲时分批补发磁盘中的记录，逐行读取，不把整个文件读入内存
+
+        无法解析的行（如进程崩溃时写了一半）移到 {spill_path}.corrupt，不影响其他记录。
+        """
+        path = self.settings.spill_path
+        draining = f"{path}.draining"
+        # 上次补发中途出错时留下的文件先处理，不会被新的溢出文件覆盖
+        if not os.path.exists(draining):
+            if not os.path.exists(path):
+                return
+            os.replace(path, draining)
+        batch_size = self.settings.batch_size * 2
+        corrupt: List[str] = []
+        with open(draining, "r", encoding="utf-8", errors="replace") as f:
+            chunk: List[str] = []
+            events: List[Dict[str, Any]] = []
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    corrupt.append(line if line.endswith("\n") else line + "\n")
+                    continue
+                chunk.append(line)
+                events.append(event)
+                if len(chunk) >= batch_size:
+                    if not self._resend(http, events, chunk, f):
+                        break
+                    chunk, events = [], []
+            else:
+                if chunk:
+                    self._resend(http, events, chunk, f)
+        if corrupt:
+            self.failed += len(corrupt)
+            logger.warning(f"追踪溢出文件中有 {len(corrupt)} 行无法解析，已移到 {path}.corrupt")
+            with open(f"{path}.corrupt", "a", encoding="utf-8") as f:
+                f.writelines(corrupt)
+        os.remove(draining)
+
+    def _resend(self, http: httpx.Client, events: List[Dict[str, Any]], lines: List[str], rest: Any) -> bool:
+        """补发一批磁盘中的事件；失败时把这一批和文件剩余部分写回磁盘等待下次补发"""
+        if self._send(http, events):
+            return True
+        with open(self.settings.spill_path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+            for line in rest:
+                f.write(line)
+        return False
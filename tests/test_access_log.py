@@ -0,0 +1,31 @@
+"""AccessLogger 写入线程：写文件失败只丢弃当前批次，之后重新打开文件继续写入"""
+import time
+
+from proxy.access_log import AccessLogger, iter_access_log
+from proxy.config import AccessLogConfig
+
+def log(logger: AccessLogger, i: int) -> None:
+    logger.log(
+        model="gpt-x", real_model="gpt-x", provider="mock", target_url="http://127.0.0.1/v1",
+        username=None, is_stream=False, status=200, duration=0.01, request=b'{"i": %d}' % i
+    )
+
+def wait_for(condition, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.02)
+
+def test_writer_survives_write_errors(tmp_path):
+    directory = tmp_path / "logs"
+    access_log = AccessLogger(AccessLogConfig(path=str(directory / "access.jsonl"), payload="full"))
+    access_log.start()
+    # 目录不存在，打开文件失败
+    log(access_log, 0)
+    wait_for(lambda: access_log.failed == 1)
+
+    directory.mkdir()
+    log(access_log, 1)
+    log(access_log, 2)
+    access_log.close()
+    assert [entry["request"]["i"] for entry in iter_access_log(str(directory / "access.jsonl"))] == [1, 2]
@@ -0,0 +1,74 @@
+"""多 worker 部署时 bypass 设置的一致性：两个进程共用同一个 SQLiteStateBackend 文件"""
+import asyncio
+import multiprocessing
+import time
+
+from proxy.state import SQLiteStateBackend
+from user_management.bypass import BypassStore
+
+LOCAL_TTL = 0.2
+
+def _worker(db_path: str, conn) -> None:
+    """另一个 worker 进程：按父进程的指令读写 bypass 设置"""
+    async def serve():
+        backend = SQLiteStateBackend(db_path)
+        await backend.initialize()
+        store = BypassStore(local_ttl=LOCAL_TTL)
+        store.use_backend(backend)
+        while True:
+            command, username, model = await asyncio.to_thread(conn.recv)
+            if command == "get":
+                conn.send(await store.get(username))
+            elif command == "set":
+                await store.set(username, model)
+                conn.send(None)
+            else:
+                await backend.close()
+                conn.send(None)
+                return
+
+    asyncio.run(serve())
+
+def test_bypass_consistent_across_processes(tmp_path):
+    db_path = str(tmp_path / "state.db")
+    ctx = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = ctx.Pipe()
+    process = ctx.Process(target=_worker, args=(db_path, child_conn), daemon=True)
+    process.start()
+
+    def remote(command, username="alice", model=None):
+        parent_conn.send((command, username, model))
+        assert parent_conn.poll(30), "worker 进程无响应"
+        return parent_conn.recv()
+
+    async def scenario():
+        backend = SQLiteStateBackend(db_path)
+        await backend.initialize()
+        store = BypassStore(local_ttl=LOCAL_TTL)
+        store.use_backend(backend)
+        try:
+            # 另一个 worker 先读到空值并缓存在本地
+            assert remote("get") is None
+
+            await store.set("alice", "[openai]gpt-4o")
+            time.sleep(LOCAL_TTL * 2)
+            assert remote("get") == "[openai]gpt-4o"
+
+            # 清除也会传播到其他 worker
+            await store.delete("alice")
+            time.sleep(LOCAL_TTL * 2)
+            assert remote("get") is None
+
+            # 反方向：另一个 worker 的设置在本进程可见
+            remote("set", "bob", "[deepseek]deepseek-chat")
+            assert await store.get("bob") == "[deepseek]deepseek-chat"
+        finally:
+            await backend.close()
+
+    try:
+        asyncio.run(scenario())
+        remote("stop")
+    finally:
+        process.join(10)
+        if process.is_alive():
+            process.terminate()
@@ -0,0 +1,58 @@
+"""ModelCatalog 的磁盘快照：损坏或格式错误的快照按冷启动处理，不影响服务启动"""
+import json
+import time
+
+import pytest
+
+from proxy.catalog import ModelCatalog
+from proxy.clients import UpstreamClientRegistry
+from proxy.config import Config
+
+def make_catalog() -> ModelCatalog:
+    catalog = ModelCatalog(UpstreamClientRegistry())
+    catalog.configure(Config(servers={
+        "a": {"url": "http://127.0.0.1:1/v1", "api_key": "k"},
+        "b": {"url": "http://127.0.0.1:2/v1", "api_key": "k"},
+    }))
+    return catalog
+
+def provider(catalog: ModelCatalog, alias: str, **fields) -> dict:
+    data = {
+        "digest": catalog._digest(catalog._servers[alias]),
+        "fetched_at": time.time(),
+        "etag": '"v1"',
+        "last_modified": None,
+        "models": [{"id": f"[{alias}]m", "object": "model"}],
+    }
+    data.update(fields)
+    return data
+
+@pytest.mark.parametrize("content", [
+    b"[1, 2]",
+    b'{"version": 1}',
+    b'{"providers": []}',
+    b'{"providers": {"a": {"digest": "x"',
+])
+def test_malformed_snapshot_is_cold_start(tmp_path, content):
+    path = tmp_path / "snapshot.json"
+    path.write_bytes(content)
+    catalog = make_catalog()
+    assert catalog.use_snapshot(str(path)) == 0
+    assert catalog.models == []
+
+def test_malformed_provider_entries_are_skipped(tmp_path):
+    catalog = make_catalog()
+    path = tmp_path / "snapshot.json"
+    path.write_text(json.dumps({"version": 1, "providers": {
+        "a": provider(catalog, "a", fetched_at="yesterday"),
+        "b": provider(catalog, "b"),
+        "gone": "not an object",
+    }}), encoding="utf-8")
+    assert catalog.use_snapshot(str(path)) == 1
+    assert [m["id"] for m in catalog.models] == ["[b]m"]
+
+    for broken in ({"models": None}, {"models": [{"object": "model"}]}, {"fetched_at": None}):
+        catalog = make_catalog()
+        data = provider(catalog, "a", **broken)
+        path.write_text(json.dumps({"providers": {"a": data}}), encoding="utf-8")
+        assert catalog.use_snapshot(str(path)) == 0
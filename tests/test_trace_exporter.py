@@ -0,0 +1,165 @@
+"""TraceExporter 对接本地的 Langfuse ingestion 桩服务：批量上传、溢出写盘、故障后补发"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from proxy.config import TracingConfig
+from proxy.tracing import TraceExporter, TraceRecord, build_events
+
+class StubIngestion:
+    """记录收到的事件，available 为 False 时返回 503"""
+
+    def __init__(self):
+        self.events = []
+        self.available = True
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if not stub.available:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                stub.events.extend(body["batch"])
+                self.send_response(207)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(b'{"successes": [], "errors": []}')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def host(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def generations(self):
+        return [event["body"] for event in self.events if event["type"] == "generation-create"]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def stub():
+    server = StubIngestion()
+    yield server
+    server.close()
+
+def make_exporter(stub, tmp_path, **settings) -> TraceExporter:
+    settings.setdefault("flush_interval", 0.05)
+    settings.setdefault("spill_path", str(tmp_path / "spill.jsonl"))
+    return TraceExporter(TracingConfig(**settings), host=stub.host, public_key="pk", secret_key="sk")
+
+def make_record(i: int, stream: bool = False) -> TraceRecord:
+    request = json.dumps({"model": "gpt-x", "messages": [{"role": "user", "content": f"q{i}"}], "stream": stream})
+    if stream:
+        response = [
+            f'data: {{"choices": [{{"index": 0, "delta": {{"content": "a{i}"}}}}]}}\n\n'.encode("utf-8"),
+            b'data: {"choices": [], "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}}\n\n',
+        ]
+    else:
+        response = {
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": f"a{i}"}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }
+    return TraceRecord(
+        model="gpt-x", provider="mock", user_id="alice", start_time=time.time(), end_time=time.time(),
+        request=request.encode("utf-8"), response=response
+    )
+
+def wait_for(condition, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.02)
+
+def test_exports_stream_and_non_stream_records(stub, tmp_path):
+    exporter = make_exporter(stub, tmp_path, batch_size=4)
+    exporter.start()
+    for i in range(6):
+        exporter.record(make_record(i, stream=i % 2 == 1))
+    exporter.close()
+
+    generations = stub.generations()
+    assert len(stub.events) == 12
+    assert exporter.exported == 6
+    assert {g["output"]["content"] for g in generations} == {f"a{i}" for i in range(6)}
+    assert all(g["usage"]["total"] == 2 for g in generations)
+
+def test_spills_while_down_and_resends(stub, tmp_path):
+    stub.available = False
+    exporter = make_exporter(stub, tmp_path, overflow="spill", batch_size=2)
+    exporter.start()
+    for i in range(5):
+        exporter.record(make_record(i))
+    wait_for(lambda: exporter.spilled == 5)
+    assert (tmp_path / "spill.jsonl").exists()
+
+    stub.available = True
+    wait_for(lambda: len(stub.generations()) == 5)
+    exporter.close()
+    assert not (tmp_path / "spill.jsonl").exists()
+    assert not (tmp_path / "spill.jsonl.draining").exists()
+
+def test_overflow_is_spilled_by_exporter_thread(stub, tmp_path):
+    exporter = make_exporter(stub, tmp_path, overflow="spill", queue_size=2)
+    # 导出线程未启动时队列很快写满，溢出的记录不在调用方线程写盘
+    for i in range(5):
+        exporter.record(make_record(i))
+    assert exporter.stats()["queue_depth"] == 2
+    assert exporter.stats()["overflow_depth"] == 2
+    assert exporter.dropped == 1
+    assert not (tmp_path / "spill.jsonl").exists()
+
+    exporter.start()
+    wait_for(lambda: len(stub.generations()) == 4)
+    exporter.close()
+    assert exporter.spilled == 2
+
+def test_drop_policy_counts_overflow(stub, tmp_path):
+    exporter = make_exporter(stub, tmp_path, queue_size=1)
+    for i in range(3):
+        exporter.record(make_record(i))
+    assert exporter.dropped == 2
+    assert exporter.stats()["overflow_depth"] == 0
+
+def test_corrupt_spill_line_is_quarantined(stub, tmp_path):
+    spill = tmp_path / "spill.jsonl"
+    lines = [json.dumps(event) for i in range(3) for event in build_events(make_record(i))]
+    # 进程崩溃时最后写入的一行可能不完整
+    lines.insert(2, '{"id": "broken", "type": "generation-')
+    spill.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    exporter = make_exporter(stub, tmp_path, overflow="spill")
+    exporter.start()
+    wait_for(lambda: len(stub.generations()) == 3)
+    exporter.record(make_record(3))
+    wait_for(lambda: len(stub.generations()) == 4)
+    exporter.close()
+
+    assert not spill.exists()
+    assert (tmp_path / "spill.jsonl.corrupt").read_text(encoding="utf-8").startswith('{"id": "broken"')
+    assert exporter.failed == 1
+
+def test_spill_error_does_not_stop_exporter(stub, tmp_path):
+    stub.available = False
+    # 溢出文件所在目录不存在，写盘抛出 OSError
+    exporter = make_exporter(stub, tmp_path / "missing", overflow="spill")
+    exporter.start()
+    exporter.record(make_record(0))
+    wait_for(lambda: exporter.failed == 1)
+
+    stub.available = True
+    exporter.record(make_record(1))
+    wait_for(lambda: len(stub.generations()) == 1)
+    exporter.close()
+    assert exporter.exported == 1
@@ -3,13 +3,14 @@
 包含用户模型、数据库操作、认证工具和命令行工具
 """
 
-from .models import User
+from .models import User, RateLimit
 from .database import DatabaseProvider, SQLiteProvider
-from .auth import generate_api_key, get_current_user
+from .auth import generate_api_key, get_current_user, auth_cache
 from .cli import main as cli_main
 from .bypass import (
     BypassRequest, 
     BypassResponse, 
+    BypassStore, 
     set_user_bypass, 
     get_user_bypass, 
     get_user_bypass_model,
@@ -18,13 +19,16 @@ from .bypass import (
 
 __all__ = [
     'User',
+    'RateLimit',
     'DatabaseProvider',
     'SQLiteProvider',
     'generate_api_key',
     'get_current_user',
+    'auth_cache',
     'cli_main',
     'BypassRequest',
     'BypassResponse',
+    'BypassStore',
     'set_user_bypass',
     'get_user_bypass',
     'get_user_bypass_model',
@@ -1,6 +1,8 @@
+import hashlib
 import secrets
 import string
-from typing import Optional, Dict
+from collections import OrderedDict
+from typing import Callable, Optional
 from fastapi import Request, HTTPException
 from .models import User
 from .database import DatabaseProvider
@@ -9,36 +11,93 @@ from threading import Lock
 
 # 用户认证缓存
 class UserAuthCache:
-    def __init__(self, ttl_seconds: int = 3600):  # 默认缓存60分钟
-        self.cache: Dict[str, tuple[User, float]] = {}  # {token: (user, timestamp)}
+    """API 密钥 -> 用户 的认证缓存
+
+    - 容量有限的 LRU，超出容量淘汰最久未使用的条目
+    - 未知密钥写入短 TTL 的负缓存，避免无效密钥反复查库
+    - 以密钥的 SHA-256 摘要作为键，内存中不保存明文密钥
+    - 定期对比数据库中的用户表版本号，版本变化时清空缓存，
+      CLI 修改/删除用户后各 worker 在 version_check_interval 秒内生效
+    """
+    
+    def __init__(
+        self,
+        ttl_seconds: int = 3600,  # 默认缓存60分钟
+        capacity: int = 10000,
+        negative_ttl_seconds: int = 30,
+        version_check_interval: float = 2.0
+    ):
+        self.cache: OrderedDict[bytes, tuple[Optional[User], float]] = OrderedDict()  # {digest: (user, expires_at)}
         self.ttl = ttl_seconds
+        self.capacity = capacity
+        self.negative_ttl = negative_ttl_seconds
+        self.version_check_interval = version_check_interval
         self.lock = Lock()
+        self._version: Optional[int] = None
+        self._next_version_check = 0.0
+        # 每次查询后以是否命中为参数调用，用于导出命中率指标
+        self.on_lookup: Optional[Callable[[bool], None]] = None
     
-    def get(self, token: str) -> Optional[User]:
-        """获取缓存的用户信息"""
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode("utf-8")).digest()
+    
+    def lookup(self, token: str) -> tuple[bool, Optional[User]]:
+        """查询缓存，返回 (是否命中, 用户)；命中负缓存时返回 (True, None)"""
+        hit, user = self._lookup(token)
+        if self.on_lookup is not None:
+            self.on_lookup(hit)
+        return hit, user
+    
+    def _lookup(self, token: str) -> tuple[bool, Optional[User]]:
+        key = self._key(token)
         with self.lock:
-            if token in self.cache:
-                user, timestamp = self.cache[token]
-                if time.time() - timestamp <= self.ttl:
-                    return user
+            entry = self.cache.get(key)
+            if entry is None:
+                return False, None
+            user, expires_at = entry
+            if time.monotonic() > expires_at:
                 # 过期则删除
-                del self.cache[token]
-        return None
+                del self.cache[key]
+                return False, None
+            self.cache.move_to_end(key)
+            return True, user
     
-    def set(self, token: str, user: User):
-        """设置缓存"""
+    def get(self, token: str) -> Optional[User]:
+        """获取缓存的用户信息"""
+        return self.lookup(token)[1]
+    
+    def set(self, token: str, user: Optional[User]):
+        """设置缓存，user 为 None 时写入负缓存"""
+        ttl = self.ttl if user is not None else self.negative_ttl
+        key = self._key(token)
         with self.lock:
-            self.cache[token] = (user, time.time())
+            self.cache[key] = (user, time.monotonic() + ttl)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.capacity:
+                self.cache.popitem(last=False)
     
     def invalidate(self, token: str):
         """使指定的缓存失效"""
         with self.lock:
-            self.cache.pop(token, None)
+            self.cache.pop(self._key(token), None)
     
     def clear(self):
         """清空所有缓存"""
         with self.lock:
             self.cache.clear()
+    
+    async def sync(self, db: DatabaseProvider):
+        """按间隔检查用户表版本号，发生变化时清空缓存"""
+        now = time.monotonic()
+        if now < self._next_version_check:
+            return
+        # 先推迟下次检查时间，避免并发请求重复查询
+        self._next_version_check = now + self.version_check_interval
+        version = await db.get_users_version()
+        if self._version is not None and version != self._version:
+            self.clear()
+        self._version = version
 
 # 全局缓存实例
 auth_cache = UserAuthCache()
@@ -65,18 +124,15 @@ async def get_current_user(
     
     token = auth_header.replace("Bearer ", "")
     
-    # 先检查缓存
-    user = auth_cache.get(token)
-    if user:
-        return user
-    
-    # 缓存未命中，查询数据库
-    user = await db.get_user_by_api_key(token)
-    
-    if user:
-        # 将结果加入缓存
+    # 先检查缓存（包括未知密钥的负缓存）
+    await auth_cache.sync(db)
+    hit, user = auth_cache.lookup(token)
+    if not hit:
+        # 缓存未命中，查询数据库，并将结果（包括不存在）加入缓存
+        user = await db.get_user_by_api_key(token)
         auth_cache.set(token, user)
-    elif require_auth:
+    
+    if not user and require_auth:
         raise HTTPException(
             status_code=401,
             detail="Invalid authentication token"
@@ -1,15 +1,62 @@
 from typing import Dict, List, Optional, Any
-from fastapi import Request, Response
+from fastapi import Request
 from pydantic import BaseModel
-import json
-import asyncio
+import time
 from loguru import logger
 
+from proxy import json_dumps, json_response
+
 from .models import User
 from .database import DatabaseProvider
 
-# 用户 bypass 缓存
-user_bypass_cache: Dict[str, str] = {}  # {username: model_name}
+UNAUTHORIZED = json_dumps({"status": "error", "message": "未授权"})
+
+class BypassStore:
+    """用户 bypass 设置存储 {username: model_name}
+
+    默认保存在进程内；多 worker 部署时通过共享状态存储（见 proxy.state）读写，
+    本地只保留 local_ttl 秒的读缓存，其他 worker 的修改在该时间内生效。
+    """
+    
+    def __init__(self, local_ttl: float = 1.0):
+        self.backend = None
+        self.local_ttl = local_ttl
+        self._local: Dict[str, tuple[Optional[str], Optional[float]]] = {}  # {username: (model, expires_at)}
+    
+    def use_backend(self, backend) -> None:
+        """切换到共享存储，backend 不跨进程共享时继续使用进程内存储"""
+        self.backend = backend if backend is not None and backend.shared else None
+        self._local.clear()
+    
+    @staticmethod
+    def _key(username: str) -> str:
+        return f"bypass:{username}"
+    
+    async def get(self, username: str) -> Optional[str]:
+        entry = self._local.get(username)
+        if entry is not None and (entry[1] is None or time.monotonic() < entry[1]):
+            return entry[0]
+        if self.backend is None:
+            return None
+        value = await self.backend.get(self._key(username))
+        model = value.decode("utf-8") if value is not None else None
+        self._local[username] = (model, time.monotonic() + self.local_ttl)
+        return model
+    
+    async def set(self, username: str, model: str) -> None:
+        if self.backend is None:
+            self._local[username] = (model, None)
+            return
+        await self.backend.set(self._key(username), model.encode("utf-8"))
+        self._local[username] = (model, time.monotonic() + self.local_ttl)
+    
+    async def delete(self, username: str) -> None:
+        self._local.pop(username, None)
+        if self.backend is not None:
+            await self.backend.delete(self._key(username))
+
+# 用户 bypass 设置
+user_bypass_cache = BypassStore()
 
 class BypassRequest(BaseModel):
     model: str
@@ -25,106 +72,62 @@ async def set_user_bypass(
     bypass_request: BypassRequest, 
     db: DatabaseProvider,
     get_current_user,
-    fetch_models_from_server,
-    models_cache,
-    config
+    catalog
 ):
     """设置用户的 bypass 模型"""
     # 用户认证
     current_user = await get_current_user(request, db)
     if not current_user:
-        return Response(
-            content=json.dumps({
-                "status": "error",
-                "message": "未授权"
-            }),
-            media_type="application/json",
-            status_code=401
-        )
+        return json_response(UNAUTHORIZED, 401)
     
     model = bypass_request.model
     
     # 如果模型是 "auto"，则清除 bypass 设置
     if model == "auto":
-        if current_user.username in user_bypass_cache:
-            del user_bypass_cache[current_user.username]
-        return Response(
-            content=json.dumps({
-                "username": current_user.username,
-                "bypass": "auto",
-                "status": "success",
-                "message": "已清除 bypass 设置"
-            }),
-            media_type="application/json"
-        )
-    
-    # 验证模型是否在可用模型列表中
-    available_models = []
+        await user_bypass_cache.delete(current_user.username)
+        return json_response({
+            "username": current_user.username,
+            "bypass": "auto",
+            "status": "success",
+            "message": "已清除 bypass 设置"
+        })
     
-    if models_cache:
-        available_models = [m["id"] for m in models_cache.data]
-    else:
-        # 如果缓存不存在，则获取模型列表
-        tasks = []
-        for server_alias, server_config in config.servers.items():
-            task = fetch_models_from_server(server_alias, server_config)
-            tasks.append(task)
-        
-        models_lists = await asyncio.gather(*tasks)
-        
-        for models in models_lists:
-            available_models.extend([m["id"] for m in models])
+    # 验证模型是否在可用模型列表中（缓存为空时由模型目录负责获取）
+    available_models = await catalog.get_index()
     
     if model not in available_models:
-        return Response(
-            content=json.dumps({
-                "status": "error",
-                "message": f"模型 {model} 不可用"
-            }),
-            media_type="application/json",
-            status_code=400
-        )
+        return json_response({
+            "status": "error",
+            "message": f"模型 {model} 不可用"
+        }, 400)
     
     # 设置 bypass
-    user_bypass_cache[current_user.username] = model
+    await user_bypass_cache.set(current_user.username, model)
     
-    return Response(
-        content=json.dumps({
-            "username": current_user.username,
-            "bypass": model,
-            "status": "success",
-            "message": f"已设置 bypass 为 {model}"
-        }),
-        media_type="application/json"
-    )
+    return json_response({
+        "username": current_user.username,
+        "bypass": model,
+        "status": "success",
+        "message": f"已设置 bypass 为 {model}"
+    })
 
 async def get_user_bypass(request: Request, db: DatabaseProvider, get_current_user):
     """获取用户的 bypass 设置"""
     # 用户认证
     current_user = await get_current_user(request, db)
     if not current_user:
-        return Response(
-            content=json.dumps({
-                "status": "error",
-                "message": "未授权"
-            }),
-            media_type="application/json",
-            status_code=401
-        )
+        return json_response(UNAUTHORIZED, 401)
     
     # 获取 bypass 设置
-    bypass = user_bypass_cache.get(current_user.username, "auto")
+    bypass = await user_bypass_cache.get(current_user.username) or "auto"
     
-    return Response(
-        content=json.dumps({
-            "username": current_user.username,
-            "bypass": bypass,
-            "status": "success",
-            "message": f"当前 bypass 设置为 {bypass}"
-        }),
-        media_type="application/json"
-    )
+    return json_response({
+        "username": current_user.username,
+        "bypass": bypass,
+        "status": "success",
+        "message": f"当前 bypass 设置为 {bypass}"
+    })
 
-def get_user_bypass_model(username: str) -> Optional[str]:
+async def get_user_bypass_model(username: str) -> Optional[str]:
     """获取用户的 bypass 模型"""
-    return user_bypass_cache.get(username) 
\ No newline at end of file
+    return await user_bypass_cache.get(username) 
\ No newline at end of file
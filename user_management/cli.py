@@ -3,10 +3,9 @@ import argparse
 import csv
 import json
 from typing import List, Optional
-from .models import User
+from .models import User, RateLimit
 from .database import SQLiteProvider
 from .auth import generate_api_key
-from datetime import datetime
 
 async def create_user(
     db: SQLiteProvider,
@@ -96,13 +95,27 @@ async def main():
     # 列出用户
     subparsers.add_parser('list', help='列出所有用户')
     
+    # 限流配置
+    limit_parser = subparsers.add_parser('limit', help='设置用户或provider的限流，name 为 * 时作为默认值')
+    limit_parser.add_argument('scope', choices=['user', 'provider'], help='限流对象类型')
+    limit_parser.add_argument('name', type=str, help='用户名或provider别名')
+    limit_parser.add_argument('--rpm', type=int, help='每分钟请求数')
+    limit_parser.add_argument('--tpm', type=int, help='每分钟token数')
+    limit_parser.add_argument('--concurrency', type=int, help='最大并发请求数')
+    
+    unlimit_parser = subparsers.add_parser('unlimit', help='删除限流配置')
+    unlimit_parser.add_argument('scope', choices=['user', 'provider'], help='限流对象类型')
+    unlimit_parser.add_argument('name', type=str, help='用户名或provider别名')
+    
+    subparsers.add_parser('limits', help='列出所有限流配置')
+    
     # 数据库路径
     parser.add_argument('--db', default='users.db', help='数据库文件路径')
     
     args = parser.parse_args()
     
     # 初始化数据库
-    db = SQLiteProvider(args.db)
+    db = SQLiteProvider(args.db, pool_size=1)
     await db.initialize()
     
     try:
@@ -152,11 +165,35 @@ async def main():
             else:
                 print(f"用户 '{args.username}' 不存在")
         
+        elif args.command == 'limit':
+            await db.set_rate_limit(RateLimit(
+                scope=args.scope,
+                name=args.name,
+                rpm=args.rpm,
+                tpm=args.tpm,
+                max_concurrent=args.concurrency
+            ))
+            print(f"{args.scope} '{args.name}' 的限流已更新")
+        
+        elif args.command == 'unlimit':
+            if await db.delete_rate_limit(args.scope, args.name):
+                print(f"{args.scope} '{args.name}' 的限流已删除")
+            else:
+                print(f"{args.scope} '{args.name}' 没有限流配置")
+        
+        elif args.command == 'limits':
+            limits = await db.list_rate_limits()
+            print(f"共有 {len(limits)} 条限流配置:")
+            for limit in limits:
+                print(f"- {limit.scope} {limit.name}: rpm={limit.rpm}, tpm={limit.tpm}, 并发={limit.max_concurrent}")
+        
         else:
             parser.print_help()
     
     except Exception as e:
         print(f"错误: {str(e)}")
+    finally:
+        await db.close()
 
 if __name__ == "__main__":
     asyncio.run(main()) 
\ No newline at end of file
@@ -1,10 +1,18 @@
 from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
 from typing import List, Optional
+import asyncio
 import aiosqlite
 from datetime import datetime
-from .models import User
+from .models import User, RateLimit
 import json
 
+# 固定的 SQL 文本，sqlite3 会在每个连接上缓存其预编译语句
+SELECT_USER_BY_USERNAME = "SELECT * FROM users WHERE username = ?"
+SELECT_USER_BY_API_KEY = "SELECT * FROM users WHERE api_key = ?"
+SELECT_USERS_VERSION = "SELECT value FROM meta WHERE key = 'users_version'"
+SELECT_LIMITS_VERSION = "SELECT value FROM meta WHERE key = 'limits_version'"
+
 class DatabaseProvider(ABC):
     @abstractmethod
     async def initialize(self) -> None:
@@ -35,13 +43,79 @@ class DatabaseProvider(ABC):
     async def list_users(self) -> List[User]:
         """列出所有用户"""
         pass
+    
+    async def get_users_version(self) -> int:
+        """用户表的版本号，用户数据每次变更后递增，用于跨进程使缓存失效"""
+        return 0
+    
+    async def list_rate_limits(self) -> List[RateLimit]:
+        """列出所有限流配置"""
+        return []
+    
+    async def set_rate_limit(self, limit: RateLimit) -> None:
+        """新增或更新限流配置"""
+        raise NotImplementedError
+    
+    async def delete_rate_limit(self, scope: str, name: str) -> bool:
+        """删除限流配置"""
+        raise NotImplementedError
+    
+    async def get_limits_version(self) -> int:
+        """限流配置的版本号，每次变更后递增"""
+        return 0
+    
+    async def close(self) -> None:
+        """释放数据库连接"""
+        pass
 
 class SQLiteProvider(DatabaseProvider):
-    def __init__(self, db_path: str = "users.db"):
+    """基于 SQLite 的用户存储
+
+    启动时建立一个小型长连接池（WAL、synchronous=NORMAL、mmap），
+    请求间复用连接和预编译语句，服务关闭时调用 close() 释放。
+    """
+    
+    def __init__(
+        self,
+        db_path: str = "users.db",
+        pool_size: int = 4,
+        mmap_size: int = 64 * 1024 * 1024
+    ):
         self.db_path = db_path
+        self.pool_size = pool_size
+        self.mmap_size = mmap_size
+        self._connections: List[aiosqlite.Connection] = []
+        self._pool: Optional[asyncio.Queue] = None
+    
+    async def _connect(self) -> aiosqlite.Connection:
+        """建立一个连接并设置 PRAGMA"""
+        conn = await aiosqlite.connect(self.db_path, cached_statements=64)
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        await conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+    
+    @asynccontextmanager
+    async def _acquire(self):
+        """从连接池中借出一个连接"""
+        if self._pool is None:
+            raise RuntimeError("数据库未初始化，请先调用 initialize()")
+        conn = await self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put_nowait(conn)
         
     async def initialize(self) -> None:
-        async with aiosqlite.connect(self.db_path) as db:
+        if self._pool is not None:
+            return
+        self._pool = asyncio.Queue()
+        for _ in range(max(self.pool_size, 1)):
+            conn = await self._connect()
+            self._connections.append(conn)
+            self._pool.put_nowait(conn)
+        async with self._acquire() as db:
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS users (
                     username TEXT PRIMARY KEY,
@@ -52,10 +126,47 @@ class SQLiteProvider(DatabaseProvider):
                     updated_at TEXT NOT NULL
                 )
             """)
+            # 用户表版本号：由触发器维护，CLI 等其他进程修改用户后各 worker 据此清理认证缓存
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+            """)
+            await db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('users_version', 0)")
+            # 用户 / provider 的限流配置，scope 为 user 或 provider
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS rate_limits (
+                    scope TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    rpm INTEGER,
+                    tpm INTEGER,
+                    max_concurrent INTEGER,
+                    PRIMARY KEY (scope, name)
+                )
+            """)
+            await db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('limits_version', 0)")
+            for table, version in (("users", "users_version"), ("rate_limits", "limits_version")):
+                for event in ("INSERT", "UPDATE", "DELETE"):
+                    await db.execute(f"""
+                        CREATE TRIGGER IF NOT EXISTS {version}_{event.lower()}
+                        AFTER {event} ON {table}
+                        BEGIN
+                            UPDATE meta SET value = value + 1 WHERE key = '{version}';
+                        END
+                    """)
             await db.commit()
     
+    async def close(self) -> None:
+        if self._pool is None:
+            return
+        self._pool = None
+        connections, self._connections = self._connections, []
+        for conn in connections:
+            await conn.close()
+    
     async def create_user(self, user: User) -> User:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._acquire() as db:
             await db.execute(
                 """
                 INSERT INTO users (username, api_key, email, permissions, created_at, updated_at)
@@ -68,29 +179,29 @@ class SQLiteProvider(DatabaseProvider):
             return user
     
     async def get_user_by_username(self, username: str) -> Optional[User]:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                "SELECT * FROM users WHERE username = ?",
-                (username,)
-            ) as cursor:
+        async with self._acquire() as db:
+            async with db.execute(SELECT_USER_BY_USERNAME, (username,)) as cursor:
                 row = await cursor.fetchone()
                 if row:
                     return self._row_to_user(row)
         return None
     
     async def get_user_by_api_key(self, api_key: str) -> Optional[User]:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                "SELECT * FROM users WHERE api_key = ?",
-                (api_key,)
-            ) as cursor:
+        async with self._acquire() as db:
+            async with db.execute(SELECT_USER_BY_API_KEY, (api_key,)) as cursor:
                 row = await cursor.fetchone()
                 if row:
                     return self._row_to_user(row)
         return None
     
+    async def get_users_version(self) -> int:
+        async with self._acquire() as db:
+            async with db.execute(SELECT_USERS_VERSION) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else 0
+    
     async def delete_user(self, username: str) -> bool:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._acquire() as db:
             cursor = await db.execute(
                 "DELETE FROM users WHERE username = ?",
                 (username,)
@@ -99,13 +210,13 @@ class SQLiteProvider(DatabaseProvider):
             return cursor.rowcount > 0
     
     async def list_users(self) -> List[User]:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._acquire() as db:
             async with db.execute("SELECT * FROM users") as cursor:
                 rows = await cursor.fetchall()
                 return [self._row_to_user(row) for row in rows]
     
     async def update_user_permissions(self, username: str, permissions: dict) -> bool:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._acquire() as db:
             cursor = await db.execute(
                 """
                 UPDATE users SET permissions = ? WHERE username = ?
@@ -115,6 +226,43 @@ class SQLiteProvider(DatabaseProvider):
             await db.commit()
             return cursor.rowcount > 0
     
+    async def list_rate_limits(self) -> List[RateLimit]:
+        async with self._acquire() as db:
+            async with db.execute(
+                "SELECT scope, name, rpm, tpm, max_concurrent FROM rate_limits ORDER BY scope, name"
+            ) as cursor:
+                rows = await cursor.fetchall()
+                return [
+                    RateLimit(scope=row[0], name=row[1], rpm=row[2], tpm=row[3], max_concurrent=row[4])
+                    for row in rows
+                ]
+    
+    async def set_rate_limit(self, limit: RateLimit) -> None:
+        async with self._acquire() as db:
+            await db.execute(
+                """
+                INSERT OR REPLACE INTO rate_limits (scope, name, rpm, tpm, max_concurrent)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (limit.scope, limit.name, limit.rpm, limit.tpm, limit.max_concurrent)
+            )
+            await db.commit()
+    
+    async def delete_rate_limit(self, scope: str, name: str) -> bool:
+        async with self._acquire() as db:
+            cursor = await db.execute(
+                "DELETE FROM rate_limits WHERE scope = ? AND name = ?",
+                (scope, name)
+            )
+            await db.commit()
+            return cursor.rowcount > 0
+    
+    async def get_limits_version(self) -> int:
+        async with self._acquire() as db:
+            async with db.execute(SELECT_LIMITS_VERSION) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else 0
+    
     def _row_to_user(self, row) -> User:
         return User(
             username=row[0],
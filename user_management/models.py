@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional
+from typing import Literal, Optional
 from datetime import datetime
 
 class User(BaseModel):
@@ -11,4 +11,12 @@ class User(BaseModel):
     permissions: Optional[dict] = {}  # 用户对不同provider的访问权限
 
     class Config:
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True
+
+class RateLimit(BaseModel):
+    """用户或 provider 的限流配置，name 为 * 时作为同类对象的默认值"""
+    scope: Literal["user", "provider"]
+    name: str
+    rpm: Optional[int] = None             # 每分钟请求数
+    tpm: Optional[int] = None             # 每分钟 token 数
+    max_concurrent: Optional[int] = None  # 最大并发请求数 
\ No newline at end of file